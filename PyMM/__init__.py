@@ -14,13 +14,32 @@
 # NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
 # DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
-'''Initialiser for the PyMM package'''
-
-from dbus.mainloop.glib import DBusGMainLoop as _DBusGMainLoop
+'''Initialiser for the PyMM package. Importing it has no side effects: the submodules, and with
+   them dbus-python and GLib, are only loaded on first access to the classes exported here, and the
+   main loop is selected when the first ModemManager is created.'''
 
 ModemManagerBusName = 'org.freedesktop.ModemManager1'
 
-_DBusGMainLoop(set_as_default=True)
+# Exported classes and the submodules which implement them
+_LazyExports = {
+    'ModemManager': 'modem_manager',
+    'PropertyMode': 'properties',
+}
+
+__all__ = ['ModemManagerBusName', *_LazyExports]
+
+
+def __getattr__(name):
+    module_name = _LazyExports.get(name)
+    if module_name is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+    import importlib
+
+    value = getattr(importlib.import_module(f'.{module_name}', __name__), name)
+    globals()[name] = value
+    return value
+
 
-# Exported classes
-from .modem_manager import ModemManager
+def __dir__():
+    return sorted(set(globals()) | set(_LazyExports))
@@ -0,0 +1,558 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Implementation of the aio module, which is an asyncio front end to the ModemManager D-Bus API.
+   It mirrors ModemManager, Modem, ModemSimple, Messaging, Sms, Sim and Bearer, but runs on the
+   asyncio event loop through dbus-next instead of dbus-python and the GLib main loop, so a single
+   event loop can drive any number of modems concurrently. Methods and properties are awaitable,
+   every call accepts an optional deadline (in seconds) and signals are delivered as async
+   iterators.'''
+
+import asyncio
+
+from PyMM import ModemManagerBusName
+from PyMM.enums import ModemState, SmsState
+from PyMM.properties import PropertiesInterfaceName
+from PyMM.signatures import DictionarySignatures, MethodSignatures, PropertySignatures
+from PyMM.sms_message import SmsMessage
+
+try:
+    from dbus_next import BusType, Message, MessageType, Variant
+    from dbus_next.aio import MessageBus
+    from dbus_next.errors import DBusError
+    from dbus_next.signature import SignatureTree
+except ImportError as e:
+    raise ImportError('PyMM.aio requires the dbus-next package (pip install PyMM[asyncio])') from e
+
+# Integers are deliberately missing, because ModemManager uses signed and unsigned integers of
+# various sizes and sending the wrong one is rejected. Their type has to come from the static
+# signature tables or from an explicit Variant.
+_VariantSignatures = ((bool, 'b'), (float, 'd'), (str, 's'), (bytes, 'ay'))
+
+
+def _to_variant(value, signature=None):
+    '''Wraps a native Python value in a Variant of the specified signature or, if it is not known,
+       of the signature implied by its Python type.'''
+
+    if isinstance(value, Variant):
+        return value
+
+    if signature is not None:
+        return Variant(signature, value)
+
+    for python_type, signature in _VariantSignatures:
+        if isinstance(value, python_type):
+            return Variant(signature, value)
+
+    raise TypeError(f'Cannot infer the D-Bus type of {value!r}, pass it as a dbus_next Variant')
+
+
+def _marshal(interface_name, method_name, signature, args):
+    variant_signature = None
+    if interface_name == PropertiesInterfaceName and method_name == 'Set':
+        variant_signature = PropertySignatures.get(args[0], {}).get(args[1])
+    dictionary_signatures = DictionarySignatures.get(interface_name, {}).get(method_name, {})
+
+    marshalled = []
+    for arg_type, arg in zip(SignatureTree(signature).types, args):
+        if arg_type.signature == 'v':
+            arg = _to_variant(arg, variant_signature)
+        elif arg_type.signature == 'a{sv}':
+            arg = {
+                key: _to_variant(value, dictionary_signatures.get(key))
+                for key, value in arg.items()
+            }
+        marshalled.append(arg)
+
+    return marshalled
+
+
+def _unmarshal(value):
+    '''Strips the Variant wrappers which dbus-next leaves in the replies.'''
+
+    if isinstance(value, Variant):
+        return _unmarshal(value.value)
+    if isinstance(value, dict):
+        return {key: _unmarshal(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_unmarshal(item) for item in value]
+
+    return value
+
+
+async def _call_bus(bus, message, timeout):
+    reply = await asyncio.wait_for(bus.call(message), timeout)
+    if reply.message_type == MessageType.ERROR:
+        raise DBusError(reply.error_name, reply.body[0] if reply.body else '', reply=reply)
+
+    return reply.body
+
+
+class SignalStream:
+    '''Asynchronous iterator over a signal emitted by a ModemManager object, which yields the tuple
+       of its arguments. Use it as an async context manager, so that the match rule is in place
+       before the action which triggers the signal and is removed afterwards.'''
+
+    def __init__(self, bus, path, interface_name, signal_name):
+        self._bus = bus
+        self._path = path
+        self._interface_name = interface_name
+        self._signal_name = signal_name
+
+        self._match_rule = (f"type='signal',sender='{ModemManagerBusName}',path='{path}',"
+                            f"interface='{interface_name}',member='{signal_name}'")
+        self._queue = asyncio.Queue()
+        self._subscribed = False
+
+    async def __aenter__(self):
+        await self.subscribe()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await self.subscribe()
+        return await self._queue.get()
+
+    async def subscribe(self):
+        if self._subscribed:
+            return
+
+        self._bus.add_message_handler(self._on_message)
+        self._subscribed = True
+        await self._call_dbus_daemon('AddMatch')
+
+    async def close(self):
+        if not self._subscribed:
+            return
+
+        self._bus.remove_message_handler(self._on_message)
+        self._subscribed = False
+        if self._bus.connected:
+            await self._call_dbus_daemon('RemoveMatch')
+
+    async def _call_dbus_daemon(self, method_name):
+        await _call_bus(
+            self._bus,
+            Message(destination='org.freedesktop.DBus', path='/org/freedesktop/DBus',
+                    interface='org.freedesktop.DBus', member=method_name, signature='s',
+                    body=[self._match_rule]), None)
+
+    def _on_message(self, message):
+        if (message.message_type == MessageType.SIGNAL and message.path == self._path
+                and message.interface == self._interface_name
+                and message.member == self._signal_name):
+            self._queue.put_nowait(tuple(_unmarshal(message.body)))
+
+
+class AsyncManagedObject:
+    '''Base class for the asyncio counterparts of the PyMM objects'''
+
+    __slots__ = ('_bus', '_path', '_timeout')
+
+    _interface_name = None
+
+    def __init__(self, bus, path, timeout=None):
+        '''The `timeout` is the default deadline (in seconds) for the calls made through this object
+           and None means no deadline other than the one of the bus itself.'''
+
+        self._bus = bus
+        self._path = path
+        self._timeout = timeout
+
+    def __str__(self):
+        return self._path
+
+    def __repr__(self):
+        return self._path
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def all_properties(self):
+        return self._call('GetAll', self._interface_name, interface_name=PropertiesInterfaceName)
+
+    async def get_property(self, property_name, timeout=None):
+        return await self._call('Get', self._interface_name, property_name,
+                                interface_name=PropertiesInterfaceName, timeout=timeout)
+
+    def signals(self, signal_name, interface_name=None):
+        '''Returns a SignalStream over the specified signal of this object.'''
+
+        return SignalStream(self._bus, self._path, interface_name or self._interface_name,
+                            signal_name)
+
+    def property_changes(self):
+        '''Returns a SignalStream over the PropertiesChanged signal of this object, which yields
+           (interface_name, changed_properties, invalidated_properties) tuples.'''
+
+        return self.signals('PropertiesChanged', PropertiesInterfaceName)
+
+    async def _call(self, method_name, *args, interface_name=None, timeout=None):
+        interface_name = interface_name or self._interface_name
+        signature = MethodSignatures[interface_name][method_name]
+
+        body = await _call_bus(
+            self._bus,
+            Message(destination=ModemManagerBusName, path=self._path, interface=interface_name,
+                    member=method_name, signature=signature,
+                    body=_marshal(interface_name, method_name, signature, args)),
+            self._timeout if timeout is None else timeout)
+
+        if not body:
+            return None
+
+        return _unmarshal(body[0]) if len(body) == 1 else tuple(_unmarshal(body))
+
+    def _child(self, cls, path):
+        return cls(self._bus, path, self._timeout)
+
+
+class AsyncSim(AsyncManagedObject):
+    '''Represents a single Sim card managed by a specific AsyncModem'''
+
+    __slots__ = ()
+
+    _interface_name = 'org.freedesktop.ModemManager1.Sim'
+
+    def __str__(self):
+        return f'Sim @ {self._path}'
+
+    def __repr__(self):
+        return f'Sim @ {self._path}'
+
+    @property
+    def SimIdentifier(self):
+        return self.get_property('SimIdentifier')
+
+    @property
+    def Imsi(self):
+        return self.get_property('Imsi')
+
+    @property
+    def OperatorIdentifier(self):
+        return self.get_property('OperatorIdentifier')
+
+    @property
+    def OperatorName(self):
+        return self.get_property('OperatorName')
+
+    async def SendPin(self, pin, timeout=None):
+        return await self._call('SendPin', pin, timeout=timeout)
+
+
+class AsyncBearer(AsyncManagedObject):
+    '''Represents a single Bearer managed by a specific AsyncModem'''
+
+    __slots__ = ()
+
+    _interface_name = 'org.freedesktop.ModemManager1.Bearer'
+
+    def __str__(self):
+        return f'Bearer @ {self._path}'
+
+    def __repr__(self):
+        return f'Bearer @ {self._path}'
+
+    @property
+    def Connected(self):
+        return self.get_property('Connected')
+
+    @property
+    def Interface(self):
+        return self.get_property('Interface')
+
+    @property
+    def Ip4Config(self):
+        return self.get_property('Ip4Config')
+
+    async def Connect(self, timeout=None):
+        return await self._call('Connect', timeout=timeout)
+
+
+class AsyncModemSimple(AsyncManagedObject):
+    '''Represents the simple interface for a modem managed by the ModemManager service'''
+
+    __slots__ = ()
+
+    _interface_name = 'org.freedesktop.ModemManager1.Modem.Simple'
+
+    async def GetStatus(self, timeout=None):
+        return await self._call('GetStatus', timeout=timeout)
+
+    async def Connect(self, props, timeout=None):
+        return await self._call('Connect', props, timeout=timeout)
+
+    async def Disconnect(self, timeout=None):
+        return await self._call('Disconnect', '/', timeout=timeout)
+
+
+class AsyncSms(AsyncManagedObject):
+    '''Represents a single SMS managed by a specific AsyncModem'''
+
+    __slots__ = ()
+
+    _interface_name = 'org.freedesktop.ModemManager1.Sms'
+
+    def __str__(self):
+        return f'Sms @ {self._path}'
+
+    def __repr__(self):
+        return f'Sms @ {self._path}'
+
+    @property
+    def State(self):
+        return self._get_state()
+
+    @property
+    def Number(self):
+        return self.get_property('Number')
+
+    @property
+    def Text(self):
+        return self.get_property('Text')
+
+    async def Send(self, timeout=None):
+        return await self._call('Send', timeout=timeout)
+
+    async def _get_state(self):
+        return SmsState(await self.get_property('State'))
+
+
+class AsyncMessaging(AsyncManagedObject):
+    '''Represents the messaging interface of a modem managed by the ModemManager service'''
+
+    __slots__ = ()
+
+    _interface_name = 'org.freedesktop.ModemManager1.Modem.Messaging'
+
+    @property
+    def Messages(self):
+        return self._get_messages()
+
+    async def List(self, timeout=None):
+        return await self._call('List', timeout=timeout)
+
+    async def Delete(self, path, timeout=None):
+        return await self._call('Delete', path, timeout=timeout)
+
+    async def Create(self, props, timeout=None):
+        return self._child(AsyncSms, await self._call('Create', props, timeout=timeout))
+
+    async def list_messages(self, timeout=None):
+        '''Returns an SmsMessage for every SMS currently known to the modem, reading the properties
+           of all of them concurrently.'''
+
+        messages = await self._get_messages()
+        properties = await asyncio.gather(*(message.all_properties for message in messages))
+        return [
+            SmsMessage(message.path, self._path, message_properties)
+            for message, message_properties in zip(messages, properties)
+        ]
+
+    async def messages(self, delete_received=False):
+        '''Asynchronous generator which yields an SmsMessage for every message received from now
+           on, driven by the Added signal. Every message is read with a single GetAll call and
+           multi-part messages which are still being received are completed from their
+           PropertiesChanged signals. If `delete_received` is True, every message is deleted from
+           the modem once it has been read.'''
+
+        async with self.signals('Added') as added:
+            async for path, received in added:
+                if not received:
+                    continue
+
+                message = await self._read_received(self._child(AsyncSms, path))
+                if message is None:
+                    continue
+
+                if delete_received:
+                    await self.Delete(message.path)
+
+                yield message
+
+    async def _read_received(self, sms):
+        # Subscribe before reading the properties so that no change can be missed in between
+        async with sms.property_changes() as changes:
+            try:
+                properties = await sms.all_properties
+            except DBusError:
+                # The message was deleted (e.g. by another client) before it could be read
+                return None
+
+            if properties.get('State') != SmsState.MM_SMS_STATE_RECEIVED:
+                async for _, changed_properties, _ in changes:
+                    properties.update(changed_properties)
+                    if properties.get('State') == SmsState.MM_SMS_STATE_RECEIVED:
+                        break
+
+        return SmsMessage(sms.path, self._path, properties)
+
+    async def _get_messages(self):
+        return [self._child(AsyncSms, path) for path in await self.get_property('Messages')]
+
+
+class AsyncModem(AsyncManagedObject):
+    '''Represents a single modem managed by the ModemManager service'''
+
+    __slots__ = ()
+
+    _interface_name = 'org.freedesktop.ModemManager1.Modem'
+
+    def __eq__(self, other):
+        return False if other is None else self._path == other._path
+
+    @property
+    def Manufacturer(self):
+        return self.get_property('Manufacturer')
+
+    @property
+    def Model(self):
+        return self.get_property('Model')
+
+    @property
+    def SignalQuality(self):
+        return self.get_property('SignalQuality')
+
+    @property
+    def CarrierConfiguration(self):
+        return self.get_property('CarrierConfiguration')
+
+    @property
+    def State(self):
+        return self._get_state()
+
+    @property
+    def Sim(self):
+        return self._get_sim()
+
+    @property
+    def EquipmentIdentifier(self):
+        return self.get_property('EquipmentIdentifier')
+
+    @property
+    def Bearers(self):
+        return self._get_bearers()
+
+    @property
+    def Drivers(self):
+        return self.get_property('Drivers')
+
+    async def Reset(self, timeout=None):
+        return await self._call('Reset', timeout=timeout)
+
+    async def Enable(self, enable=True, timeout=None):
+        return await self._call('Enable', enable, timeout=timeout)
+
+    async def CreateBearer(self, props, timeout=None):
+        return await self._call('CreateBearer', props, timeout=timeout)
+
+    @property
+    def name(self):
+        return self._path
+
+    @property
+    def simple_interface(self):
+        return self._child(AsyncModemSimple, self._path)
+
+    @property
+    def messaging_interface(self):
+        return self._child(AsyncMessaging, self._path)
+
+    def state_changes(self):
+        '''Returns a SignalStream over the StateChanged signal, which yields (old, new, reason)
+           tuples.'''
+
+        return self.signals('StateChanged')
+
+    async def _get_state(self):
+        return ModemState(await self.get_property('State'))
+
+    async def _get_sim(self):
+        return self._child(AsyncSim, await self.get_property('Sim'))
+
+    async def _get_bearers(self):
+        return [self._child(AsyncBearer, path) for path in await self.get_property('Bearers')]
+
+
+class AsyncModemManager(AsyncManagedObject):
+    '''Represents the top-level ModemManager D-Bus service. Instances are created with the
+       `connect` coroutine, which establishes the dbus-next connection on the running loop.'''
+
+    __slots__ = ()
+
+    _interface_name = 'org.freedesktop.ModemManager1'
+    _object_manager_interface_name = 'org.freedesktop.DBus.ObjectManager'
+
+    def __init__(self, bus, timeout=None):
+        super().__init__(bus, '/org/freedesktop/ModemManager1', timeout)
+
+    @classmethod
+    async def connect(cls, bus=None, bus_address=None, timeout=None):
+        '''Connects to ModemManager over an existing dbus-next MessageBus, the bus at the specified
+           address or otherwise the system bus.'''
+
+        if bus is None:
+            bus = await MessageBus(bus_address=bus_address, bus_type=BusType.SYSTEM).connect()
+
+        return cls(bus, timeout)
+
+    def __str__(self):
+        return f'ModemManager'
+
+    def __repr__(self):
+        return f'ModemManager'
+
+    @property
+    def Version(self):
+        return self.get_property('Version')
+
+    @property
+    def managed_modems(self):
+        '''Returns (as an awaitable) a dictionary of the modems that are managed by this object.'''
+
+        return self._get_managed_modems()
+
+    def interfaces_added(self):
+        '''Returns a SignalStream which yields (path, interfaces_and_properties) for every object
+           which ModemManager exports.'''
+
+        return self.signals('InterfacesAdded', self._object_manager_interface_name)
+
+    def interfaces_removed(self):
+        '''Returns a SignalStream which yields (path, interfaces) for every object which
+           ModemManager stops exporting.'''
+
+        return self.signals('InterfacesRemoved', self._object_manager_interface_name)
+
+    def disconnect(self):
+        self._bus.disconnect()
+
+    async def _get_managed_modems(self):
+        managed_objects = await self._call('GetManagedObjects',
+                                           interface_name=self._object_manager_interface_name)
+
+        return {
+            path: self._child(AsyncModem, path)
+            for path, interfaces in managed_objects.items()
+            if AsyncModem._interface_name in interfaces
+        }
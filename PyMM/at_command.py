@@ -0,0 +1,253 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Implementation of the at_command module, which runs AT commands through Modem.Command on any
+   number of modems concurrently, one command at a time per modem, and caches the responses of the
+   queries which do not change'''
+
+import time
+
+from collections import deque
+from PyMM.mainloop import run_until
+
+# Timeout (in seconds) which ModemManager applies to a command if none is specified
+DefaultCommandTimeout = 5
+
+# Queries whose responses do not change while the modem stays plugged in (identity, firmware and
+# SIM card), which are cached unless specified otherwise
+IdempotentCommands = frozenset({
+    'ATI', 'AT+GMI', 'AT+GMM', 'AT+GMR', 'AT+GSN', 'AT+CGMI', 'AT+CGMM', 'AT+CGMR', 'AT+CGSN',
+    'AT+CIMI', 'AT+CCID', 'AT+ICCID', 'AT^ICCID?', 'AT+QCCID'
+})
+
+
+class CommandRequest:
+    '''Tracks a single AT command submitted to ATCommandExecutor. Once it is done, exactly one of
+       `response` and `error` is set and `cached` tells whether the response came from the cache
+       instead of the modem.'''
+
+    __slots__ = ('modem', 'command', 'timeout', 'cache', 'response', 'error', 'cached', 'queued_at',
+                 'started_at', 'elapsed', 'callback')
+
+    def __init__(self, modem, command, timeout, cache, callback):
+        self.modem = modem
+        self.command = command
+        self.timeout = timeout
+        self.cache = cache
+        self.response = None
+        self.error = None
+        self.cached = False
+        self.queued_at = time.monotonic()
+        self.started_at = None
+        self.elapsed = None
+        self.callback = callback
+
+    def __repr__(self):
+        outcome = (f'error={self.error!r}'
+                   if self.error is not None else f'response={self.response!r}')
+        return f'CommandRequest({self.modem}, {self.command}, {outcome}, elapsed={self.elapsed})'
+
+    @property
+    def done(self):
+        return self.elapsed is not None
+
+    @property
+    def ok(self):
+        return self.done and self.error is None
+
+
+class ATCommandExecutor:
+    '''Runs AT commands on any number of modems with non-blocking calls. The commands of each modem
+       are queued in order and sent one at a time, because the modem processes them serially on a
+       single port anyway, while the modems themselves are all served in parallel. Each command has
+       its own timeout. The responses of the commands in `cacheable` (compared case-insensitively)
+       are cached per modem for `ttl` seconds. Commands only progress while the main loop is running
+       (see `wait`).'''
+
+    def __init__(self, ttl=3600, default_timeout=DefaultCommandTimeout,
+                 cacheable=IdempotentCommands):
+        self._ttl = ttl
+        self._default_timeout = default_timeout
+        self._cacheable = frozenset(command.upper() for command in cacheable)
+        self._modem_manager = None
+        self._queues = {}
+        self._in_flight = {}
+        # Paths of the modems whose queue is being filled
+        self._filling = set()
+        # Time of the response and the response, keyed by (modem path, normalised command)
+        self._cache = {}
+
+    @property
+    def pending(self):
+        '''Number of commands which are either queued or in flight.'''
+
+        return sum(map(len, self._queues.values())) + len(self._in_flight)
+
+    def attach(self, modem_manager):
+        '''Uses the modems of `modem_manager` for `batch` and forgets the cached responses and fails
+           the queued commands of the modems which disappear.'''
+
+        self._modem_manager = modem_manager
+        modem_manager.connect_modem_removed(self.remove_modem)
+
+    def remove_modem(self, modem):
+        self.invalidate(modem)
+
+        for request in self._queues.pop(modem.path, ()):
+            self._finish(request, error=RuntimeError(f'{modem} was removed'))
+
+    def invalidate(self, modem=None):
+        '''Drops the cached responses of the modem (or of all the modems if None).'''
+
+        if modem is None:
+            self._cache.clear()
+        else:
+            for key in [key for key in self._cache if key[0] == modem.path]:
+                del self._cache[key]
+
+    def cached(self, modem, command, max_age=None):
+        '''Returns the cached response of the command on the modem or None if it has not been
+           received within `max_age` seconds (the TTL if None).'''
+
+        entry = self._cache.get((modem.path, self._normalise(command)))
+        max_age = self._ttl if max_age is None else max_age
+        if entry is None or time.monotonic() - entry[0] > max_age:
+            return None
+
+        return entry[1]
+
+    def submit(self, modem, command, timeout=None, cache=None, callback=None):
+        '''Queues `command` for the modem and returns its CommandRequest. The `timeout` (in seconds)
+           applies to this command only and defaults to the one of the executor. If `cache` is
+           None, the response is served from and stored in the cache only if the command is one of
+           the cacheable ones, True and False force either way. The `callback` is invoked with the
+           CommandRequest once it is done, which may be immediately.'''
+
+        if cache is None:
+            cache = self._normalise(command) in self._cacheable
+
+        request = CommandRequest(modem, command,
+                                 self._default_timeout if timeout is None else timeout, cache,
+                                 callback)
+
+        response = self.cached(modem, command) if cache else None
+        if response is not None:
+            request.cached = True
+            self._finish(request, response=response)
+            return request
+
+        self._queues.setdefault(modem.path, deque()).append(request)
+        self._fill(modem.path)
+        return request
+
+    def execute(self, modem, command, timeout=None, cache=None):
+        '''Runs a single command (behind the ones already queued for the modem), waits for it and
+           returns its response or raises the error it failed with.'''
+
+        request = self.submit(modem, command, timeout, cache)
+        run_until(lambda: request.done)
+
+        if request.error is not None:
+            raise request.error
+
+        return request.response
+
+    def batch(self, commands, modems=None, timeout=None, cache=None, wait_timeout=None):
+        '''Queues the command (or the list of commands, in order) on each of the `modems` (or all
+           the modems of the attached ModemManager if None), waits until they are all done or
+           `wait_timeout` (in seconds) expires and returns a dictionary with the list of
+           CommandRequest of every modem, keyed by modem path. Requests which have not completed in
+           time are returned as they are.'''
+
+        if isinstance(commands, str):
+            commands = [commands]
+        if modems is None:
+            if self._modem_manager is None:
+                raise ValueError('No modems specified and no ModemManager attached')
+            modems = self._modem_manager.managed_modems.values()
+
+        results = {
+            modem.path: [self.submit(modem, command, timeout, cache) for command in commands]
+            for modem in list(modems)
+        }
+        run_until(
+            lambda: all(request.done for requests in results.values() for request in requests),
+            wait_timeout)
+
+        return results
+
+    def wait(self, timeout=None):
+        '''Dispatches the main loop until all the queued commands are done or `timeout` (in seconds)
+           expires. Returns True if they are all done.'''
+
+        return run_until(lambda: self.pending == 0, timeout)
+
+    @staticmethod
+    def _normalise(command):
+        return command.strip().upper()
+
+    def _fill(self, modem_path):
+        # A command which fails synchronously completes from within `_start`, so guard against
+        # re-entering the loop below from its completion, which would recurse once per command
+        if modem_path in self._filling:
+            return
+
+        self._filling.add(modem_path)
+        try:
+            while modem_path not in self._in_flight:
+                queue = self._queues.get(modem_path)
+                if not queue:
+                    self._queues.pop(modem_path, None)
+                    return
+
+                self._start(queue.popleft())
+        finally:
+            self._filling.discard(modem_path)
+
+    def _start(self, request):
+        request.started_at = time.monotonic()
+        self._in_flight[request.modem.path] = request
+
+        def on_reply(response):
+            if request.cache:
+                self._cache[(request.modem.path,
+                             self._normalise(request.command))] = (time.monotonic(), str(response))
+            self._complete(request, response=str(response))
+
+        def on_error(error):
+            self._complete(request, error=error)
+
+        try:
+            request.modem.Command(request.command, request.timeout, reply_handler=on_reply,
+                                  error_handler=on_error)
+        except Exception as e:
+            on_error(e)
+
+    def _complete(self, request, response=None, error=None):
+        modem_path = request.modem.path
+        if self._in_flight.get(modem_path) is request:
+            del self._in_flight[modem_path]
+
+        self._finish(request, response, error)
+        self._fill(modem_path)
+
+    def _finish(self, request, response=None, error=None):
+        request.response = response
+        request.error = error
+        request.elapsed = time.monotonic() - request.queued_at
+
+        if request.callback is not None:
+            request.callback(request)
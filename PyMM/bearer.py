@@ -16,18 +16,15 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 '''Implementation of the Bearer module'''
 
-from PyMM import ModemManagerBusName
+from PyMM.managed_object import ManagedObject
 
 
-class Bearer:
+class Bearer(ManagedObject):
     '''Represents a single Bearer managed by a specific Modem'''
 
-    _bearer_interface_name = 'org.freedesktop.ModemManager1.Bearer'
+    __slots__ = ()
 
-    def __init__(self, system_bus, bearer_path):
-        self._system_bus = system_bus
-        self._path = bearer_path
-        self._bearer_object = self._system_bus.get_object(ModemManagerBusName, self._path)
+    _interface_name = 'org.freedesktop.ModemManager1.Bearer'
 
     def __str__(self):
         return f'Bearer @ {self._path}'
@@ -47,9 +44,34 @@ class Bearer:
     def Ip4Config(self):
         return self.get_property('Ip4Config')
 
-    def Connect(self):
-        return self._bearer_object.Connect(dbus_interface=self._bearer_interface_name)
+    @property
+    def Ip6Config(self):
+        return self.get_property('Ip6Config')
+
+    @property
+    def Properties(self):
+        return self.get_property('Properties')
+
+    @property
+    def Stats(self):
+        return self.get_property('Stats')
+
+    @property
+    def ReloadStatsSupported(self):
+        return self.get_property('ReloadStatsSupported')
+
+    @property
+    def ConnectionError(self):
+        return self.get_property('ConnectionError')
+
+    def Connect(self, **kwargs):
+        return self._call('Connect', **kwargs)
+
+    def Disconnect(self, **kwargs):
+        return self._call('Disconnect', **kwargs)
+
+    def wait_connected(self, timeout=None, connected=True):
+        '''Blocks until the bearer becomes connected (or disconnected if `connected` is False).
+           Raises TimeoutError if `timeout` (in seconds) expires first.'''
 
-    def get_property(self, property_name):
-        return self._bearer_object.Get(self._bearer_interface_name, property_name,
-                                       dbus_interface='org.freedesktop.DBus.Properties')
+        self.wait_for_property('Connected', lambda value: bool(value) == connected, timeout)
@@ -0,0 +1,509 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Implementation of the bringup module, which takes many modems from whatever state they are in
+   to connected, driven by their StateChanged signals and using non-blocking D-Bus calls'''
+
+import dbus
+import random
+import time
+
+from enum import IntEnum, unique
+from gi.repository import GLib
+from PyMM.mainloop import run_until
+from PyMM.modem import ModemState
+
+
+@unique
+class BringUpStage(IntEnum):
+    '''Enumeration of the stages which a modem goes through during bring-up, in order.'''
+
+    PENDING = 0,
+    UNLOCK = 1,
+    ENABLE = 2,
+    REGISTER = 3,
+    CONNECT = 4,
+    DONE = 5,
+    FAILED = 6,
+
+
+# Stage which the modem is in while it is in each of the ModemStates
+_StageByState = {
+    ModemState.MM_MODEM_STATE_UNKNOWN: BringUpStage.PENDING,
+    ModemState.MM_MODEM_STATE_INITIALIZING: BringUpStage.PENDING,
+    ModemState.MM_MODEM_STATE_LOCKED: BringUpStage.UNLOCK,
+    ModemState.MM_MODEM_STATE_DISABLED: BringUpStage.ENABLE,
+    ModemState.MM_MODEM_STATE_DISABLING: BringUpStage.ENABLE,
+    ModemState.MM_MODEM_STATE_ENABLING: BringUpStage.ENABLE,
+    ModemState.MM_MODEM_STATE_ENABLED: BringUpStage.REGISTER,
+    ModemState.MM_MODEM_STATE_SEARCHING: BringUpStage.REGISTER,
+    ModemState.MM_MODEM_STATE_REGISTERED: BringUpStage.CONNECT,
+    ModemState.MM_MODEM_STATE_DISCONNECTING: BringUpStage.CONNECT,
+    ModemState.MM_MODEM_STATE_CONNECTING: BringUpStage.CONNECT,
+    ModemState.MM_MODEM_STATE_CONNECTED: BringUpStage.DONE,
+}
+
+
+class ApnProfile:
+    '''Connection settings passed to Modem.Simple.Connect. The `properties` are any additional
+       connection properties from the ModemManager API (e.g. 'allowed-auth' or
+       'roaming-allowed').'''
+
+    __slots__ = ('apn', 'user', 'password', 'ip_type', 'properties')
+
+    def __init__(self, apn, user=None, password=None, ip_type=None, properties=None):
+        self.apn = apn
+        self.user = user
+        self.password = password
+        # One of the MMBearerIpFamily values or None to leave it to ModemManager
+        self.ip_type = ip_type
+        self.properties = properties or {}
+
+    def __repr__(self):
+        return f'ApnProfile({self.apn})'
+
+    def to_connect_properties(self):
+        props = dbus.Dictionary(self.properties, signature='sv')
+        props['apn'] = self.apn
+        if self.user is not None:
+            props['user'] = self.user
+        if self.password is not None:
+            props['password'] = self.password
+        if self.ip_type is not None:
+            props['ip-type'] = dbus.UInt32(self.ip_type)
+
+        return props
+
+
+class BringUpResult:
+    '''Outcome of the bring-up of a single modem. The `stage_durations` contain the number of
+       seconds spent in each BringUpStage, including the time spent waiting to retry it.'''
+
+    __slots__ = ('modem', 'stage', 'attempts', 'stage_durations', 'started_at', 'elapsed', 'error',
+                 'bearer_path', '_stage_entered_at')
+
+    def __init__(self, modem):
+        self.modem = modem
+        self.stage = BringUpStage.PENDING
+        # Number of attempts made so far, keyed by BringUpStage
+        self.attempts = {}
+        self.stage_durations = {}
+        self.started_at = None
+        self.elapsed = None
+        self.error = None
+        self.bearer_path = None
+        self._stage_entered_at = None
+
+    def __repr__(self):
+        outcome = f'error={self.error!r}' if self.error is not None else f'stage={self.stage.name}'
+        return f'BringUpResult({self.modem}, {outcome}, elapsed={self.elapsed})'
+
+    @property
+    def ok(self):
+        return self.stage == BringUpStage.DONE
+
+    def _enter(self, stage):
+        now = time.monotonic()
+        if self._stage_entered_at is not None:
+            self.stage_durations[self.stage] = (self.stage_durations.get(self.stage, 0.0) + now -
+                                                self._stage_entered_at)
+
+        self.stage = stage
+        self._stage_entered_at = now
+        if stage in (BringUpStage.DONE, BringUpStage.FAILED):
+            self.elapsed = None if self.started_at is None else now - self.started_at
+
+
+class _ModemBringUp:
+    '''State machine which brings up a single modem. Every step is either a non-blocking call or a
+       wait for the next StateChanged signal, so any number of them can progress concurrently from
+       the same main loop.'''
+
+    __slots__ = ('_bring_up', '_modem', '_result', '_state', '_acted_in', '_signal_match', '_busy',
+                 '_timer_id', '_stage_timer_id')
+
+    def __init__(self, bring_up, modem):
+        self._bring_up = bring_up
+        self._modem = modem
+        self._result = BringUpResult(modem)
+        self._state = None
+        # State in which the last successful call was made. Its effect only becomes visible with
+        # the next StateChanged, so no further call is made until then.
+        self._acted_in = None
+        self._signal_match = None
+        # Whether a call is in flight or a retry is scheduled, during which state changes are only
+        # recorded and acted upon once it completes
+        self._busy = False
+        self._timer_id = None
+        self._stage_timer_id = None
+
+    @property
+    def result(self):
+        return self._result
+
+    def start(self):
+        self._result.started_at = time.monotonic()
+        try:
+            # Subscribe before reading the current state so that no transition can be missed
+            self._signal_match = self._modem.connect_to_signal('StateChanged',
+                                                               self._on_state_changed)
+            if self._state is None:
+                self._state = self._modem.State
+        except Exception as e:
+            self._fail(e)
+            return
+
+        self._advance()
+
+    def cancel(self, error):
+        if self._result.stage not in (BringUpStage.DONE, BringUpStage.FAILED):
+            self._fail(error)
+
+    def _on_state_changed(self, old, new, reason):
+        self._state = ModemState(new)
+        self._acted_in = None
+        if not self._busy:
+            self._advance()
+
+    def _advance(self):
+        if self._result.stage in (BringUpStage.DONE, BringUpStage.FAILED):
+            return
+
+        if self._state == ModemState.MM_MODEM_STATE_FAILED:
+            self._fail(RuntimeError(f'Modem {self._modem.path} is in the FAILED state'))
+            return
+
+        stage = _StageByState[self._state]
+        if stage == BringUpStage.DONE:
+            self._finish()
+            return
+
+        if stage != self._result.stage:
+            self._result._enter(stage)
+            self._arm_stage_timer()
+
+        if self._state == self._acted_in:
+            return
+
+        if self._state == ModemState.MM_MODEM_STATE_LOCKED:
+            self._unlock()
+        elif self._state == ModemState.MM_MODEM_STATE_DISABLED:
+            self._call(self._modem.Enable, True)
+        elif self._state == ModemState.MM_MODEM_STATE_REGISTERED:
+            self._connect()
+
+        # All the other states are transitional and the next StateChanged drives the progress
+
+    def _unlock(self):
+        # The EquipmentIdentifier is only needed if some PIN is specific to a modem
+        if self._bring_up._pins_by_equipment_identifier:
+            self._read('EquipmentIdentifier', self._unlock_with_pin_for)
+        else:
+            self._unlock_with_pin_for(None)
+
+    def _unlock_with_pin_for(self, equipment_identifier):
+        pin = self._bring_up._pin_for(equipment_identifier)
+        if pin is None:
+            self._fail(
+                RuntimeError(f'Modem {self._modem.path} is locked and there is no PIN for it'))
+            return
+
+        def on_sim(sim_path):
+            # The number of PIN attempts is limited, so a rejected PIN is never retried
+            self._call(lambda **kwargs: self._modem.sim_by_path(sim_path).SendPin(pin, **kwargs),
+                       retry=False)
+
+        self._read('Sim', on_sim)
+
+    def _connect(self):
+        # The operator of the SIM is only needed if some profile is specific to an operator
+        if not self._bring_up._profiles:
+            self._connect_with_profile_for(None)
+            return
+
+        def on_sim(sim_path):
+            self._read('OperatorIdentifier', self._connect_with_profile_for, sim_path)
+
+        self._read('Sim', on_sim)
+
+    def _connect_with_profile_for(self, operator_identifier):
+        profile = self._bring_up._profile_for(operator_identifier)
+        if profile is None:
+            self._fail(RuntimeError(f'There is no APN profile for modem {self._modem.path}'))
+            return
+
+        def on_connected(bearer_path):
+            self._result.bearer_path = bearer_path
+            self._finish()
+
+        self._call(self._modem.simple_interface.Connect, profile.to_connect_properties(),
+                   on_reply=on_connected)
+
+    def _read(self, property_name, on_value, sim_path=None):
+        '''Reads a property of the modem (or of its Sim at `sim_path`) needed by the current stage
+           with a non-blocking call. Only a failed read counts as an attempt of the stage. If the
+           state changes while the read is in flight, the value is discarded and the new state is
+           acted upon instead.'''
+
+        state = self._state
+
+        def read(**kwargs):
+            # Creating the Sim object may read its properties, so it is done within `_call` too
+            managed_object = self._modem if sim_path is None else self._modem.sim_by_path(sim_path)
+            managed_object.get_property_async(property_name, **kwargs)
+
+        def on_reply(value):
+            if self._state == state:
+                on_value(value)
+            else:
+                self._advance()
+
+        self._call(read, on_reply=on_reply, count_attempt=False)
+
+    def _count_attempt(self):
+        stage = self._result.stage
+        self._result.attempts[stage] = self._result.attempts.get(stage, 0) + 1
+
+    def _call(self, method, *args, retry=True, on_reply=None, count_attempt=True):
+        if count_attempt:
+            self._count_attempt()
+        self._busy = True
+        state = self._state
+
+        def reply_handler(*values):
+            self._busy = False
+            self._acted_in = state if self._state == state else None
+            if on_reply is not None:
+                on_reply(*values)
+            else:
+                self._advance()
+
+        def error_handler(error):
+            self._busy = False
+            if not count_attempt:
+                self._count_attempt()
+            if retry:
+                self._retry(error)
+            else:
+                self._fail(error)
+
+        try:
+            method(*args, reply_handler=reply_handler, error_handler=error_handler,
+                   timeout=self._bring_up._call_timeout)
+        except Exception as e:
+            error_handler(e)
+
+    def _retry(self, error):
+        '''Schedules the current stage to be re-evaluated after the backoff delay, unless it has
+           exhausted its attempts.'''
+
+        stage = self._result.stage
+        attempts = self._result.attempts.get(stage, 1)
+        if attempts > self._bring_up._retries:
+            self._fail(error)
+            return
+
+        # Randomised so that modems which failed together (e.g. after a site power cycle) do not
+        # retry in lockstep
+        delay = min(self._bring_up._backoff * 2**(attempts - 1), self._bring_up._max_backoff)
+        delay *= random.uniform(0.5, 1.0)
+
+        self._busy = True
+
+        def on_timer():
+            self._timer_id = None
+            self._busy = False
+            self._acted_in = None
+            try:
+                self._state = self._modem.State
+            except Exception as e:
+                self._count_attempt()
+                self._retry(e)
+                return False
+
+            self._advance()
+            return False
+
+        self._timer_id = GLib.timeout_add(max(int(delay * 1000), 1), on_timer)
+
+    def _arm_stage_timer(self):
+        self._cancel_stage_timer()
+        if self._bring_up._stage_timeout is None:
+            return
+
+        stage = self._result.stage
+
+        def on_timer():
+            self._stage_timer_id = None
+            if self._result.stage != stage:
+                return False
+
+            # While a call or a backoff is in flight, its own outcome drives the progress, so the
+            # stage is only checked again after another period
+            if not self._busy:
+                self._count_attempt()
+                self._retry(
+                    TimeoutError(f'Modem {self._modem.path} did not complete the {stage.name} '
+                                 f'stage within {self._bring_up._stage_timeout} seconds'))
+
+            if self._result.stage == stage:
+                self._arm_stage_timer()
+            return False
+
+        self._stage_timer_id = GLib.timeout_add(max(int(self._bring_up._stage_timeout * 1000), 1),
+                                                on_timer)
+
+    def _cancel_stage_timer(self):
+        if self._stage_timer_id is not None:
+            GLib.source_remove(self._stage_timer_id)
+            self._stage_timer_id = None
+
+    def _finish(self):
+        self._result._enter(BringUpStage.DONE)
+        self._release()
+
+    def _fail(self, error):
+        self._result.error = error
+        self._result._enter(BringUpStage.FAILED)
+        self._release()
+
+    def _release(self):
+        self._cancel_stage_timer()
+        if self._timer_id is not None:
+            GLib.source_remove(self._timer_id)
+            self._timer_id = None
+        if self._signal_match is not None:
+            self._signal_match.remove()
+            self._signal_match = None
+
+        self._bring_up._on_modem_complete(self)
+
+
+class BringUp:
+    '''Brings many modems online by taking each of them through the unlock, enable, register and
+       connect stages, as required by its current ModemState. Up to `concurrency` modems are in
+       progress at any time (unlimited if None) and each of them moves to its next stage as soon as
+       its StateChanged signal arrives, so faster modems are not held back by slower ones.
+
+       The `profiles` map the operator identifier (MCC/MNC) reported by Sim.OperatorIdentifier to
+       the ApnProfile used to connect the modems with that SIM, with `default_profile` used for
+       operators which are not listed. The `pins` map the modem EquipmentIdentifier (or '*' for all
+       modems) to the PIN used to unlock its SIM.
+
+       Failed calls and stages which do not complete within `stage_timeout` seconds are retried up
+       to `retries` times, with an exponential backoff starting at `backoff` seconds and capped at
+       `max_backoff`. The `call_timeout` (in seconds) applies to each individual D-Bus call.'''
+
+    def __init__(self, modems, profiles=None, default_profile=None, pins=None, concurrency=None,
+                 retries=3, backoff=1.0, max_backoff=30.0, stage_timeout=120.0, call_timeout=None):
+        self._modems = list(modems)
+        self._profiles = dict(profiles or {})
+        self._default_profile = default_profile
+        self._pins = dict(pins or {})
+        self._concurrency = len(self._modems) if concurrency is None else concurrency
+        if self._concurrency < 1 and self._modems:
+            raise ValueError('Concurrency must be at least 1')
+
+        self._retries = retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._stage_timeout = stage_timeout
+        self._call_timeout = -1 if call_timeout is None else call_timeout
+
+        self._machines = [_ModemBringUp(self, modem) for modem in self._modems]
+        self._next = 0
+        self._in_flight = 0
+        self._completed = 0
+        self._filling = False
+        self._complete_callbacks = []
+
+    @property
+    def results(self):
+        '''Returns a dictionary of BringUpResult keyed by modem path.'''
+
+        return {machine.result.modem.path: machine.result for machine in self._machines}
+
+    @property
+    def done(self):
+        return self._completed == len(self._machines)
+
+    def connect_modem_complete(self, callback):
+        '''Registers a callback, which will be invoked with the BringUpResult of every modem as soon
+           as it is either connected or has failed.'''
+
+        self._complete_callbacks.append(callback)
+
+    def start(self):
+        '''Starts the bring-up without waiting for it. It progresses while the main loop runs.'''
+
+        self._fill()
+
+    def run(self, timeout=None):
+        '''Starts the bring-up and dispatches the main loop until all the modems are either
+           connected or have failed, or until `timeout` (in seconds) expires, in which case the
+           modems which are still in progress fail with TimeoutError. Returns `results`.'''
+
+        self.start()
+        if not run_until(lambda: self.done, timeout):
+            self.cancel(TimeoutError(f'Bring-up did not complete within {timeout} seconds'))
+
+        return self.results
+
+    def cancel(self, error=None):
+        '''Stops the bring-up of all the modems which have not completed yet and marks them as
+           failed with `error`. Calls which are already in flight are not aborted.'''
+
+        error = error or RuntimeError('Bring-up was cancelled')
+
+        # Prevent modems which have not started yet from starting while the others are cancelled
+        self._next = len(self._machines)
+        for machine in self._machines:
+            machine.cancel(error)
+
+    def _fill(self):
+        # Modems which complete synchronously do so from within `start`, so guard against
+        # re-entering the loop below from their completion
+        if self._filling:
+            return
+
+        self._filling = True
+        try:
+            while self._in_flight < self._concurrency and self._next < len(self._machines):
+                self._next += 1
+                self._in_flight += 1
+                self._machines[self._next - 1].start()
+        finally:
+            self._filling = False
+
+    def _on_modem_complete(self, machine):
+        self._completed += 1
+        if machine.result.started_at is not None:
+            self._in_flight -= 1
+
+        for callback in self._complete_callbacks:
+            callback(machine.result)
+
+        self._fill()
+
+    @property
+    def _pins_by_equipment_identifier(self):
+        return any(key != '*' for key in self._pins)
+
+    def _pin_for(self, equipment_identifier):
+        return self._pins.get(equipment_identifier, self._pins.get('*'))
+
+    def _profile_for(self, operator_identifier):
+        return self._profiles.get(operator_identifier, self._default_profile)
@@ -0,0 +1,305 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Implementation of the connection module, which keeps persistent data connections up by
+   reconnecting their bearers as soon as they drop'''
+
+import random
+import time
+
+from gi.repository import GLib
+from PyMM.ring_buffer import ColumnarRingBuffer, aggregate
+
+# D-Bus errors which mean that the bearer no longer exists and has to be created again
+_BearerGoneErrors = ('org.freedesktop.DBus.Error.UnknownObject',
+                     'org.freedesktop.DBus.Error.UnknownMethod')
+
+
+class ManagedConnection:
+    '''Data connection of a single modem through the bearer created for one ApnProfile. Its
+       history is kept in ColumnarRingBuffer instances of `capacity` rows: the duration of every
+       successful Bearer.Connect and of every outage, from the bearer dropping to it being connected
+       again (the time to the first connection is not an outage).'''
+
+    __slots__ = ('_manager', '_profile', '_bearer', '_signal_match', '_enabled', '_connected',
+                 '_connecting', '_attempts', '_timer_id', '_connect_started_at', '_down_since',
+                 'reconnects', 'failures', 'last_error', 'connect_latencies', 'outages')
+
+    def __init__(self, manager, profile, capacity):
+        self._manager = manager
+        self._profile = profile
+        self._bearer = None
+        self._signal_match = None
+        # Whether the connection should be kept up, which is cleared by `stop`
+        self._enabled = False
+        self._connected = False
+        self._connecting = False
+        # Number of consecutive failed attempts, which determines the backoff before the next one
+        self._attempts = 0
+        self._timer_id = None
+        self._connect_started_at = None
+        self._down_since = None
+
+        self.reconnects = 0
+        self.failures = 0
+        self.last_error = None
+        self.connect_latencies = ColumnarRingBuffer(capacity, [('latency', 'd')])
+        self.outages = ColumnarRingBuffer(capacity, [('duration', 'd')])
+
+    def __repr__(self):
+        return (f'ManagedConnection({self._profile}, bearer={self._bearer}, '
+                f'connected={self._connected})')
+
+    @property
+    def profile(self):
+        return self._profile
+
+    @property
+    def bearer(self):
+        return self._bearer
+
+    @property
+    def connected(self):
+        return self._connected
+
+    def statistics(self):
+        '''Returns the reconnect and failure counts together with the aggregates of the connect
+           latencies and of the outage durations (in seconds).'''
+
+        return {
+            'connected': self._connected,
+            'reconnects': self.reconnects,
+            'failures': self.failures,
+            'connect_latency': aggregate(self.connect_latencies.column('latency')),
+            'outage': aggregate(self.outages.column('duration')),
+        }
+
+    def start(self):
+        '''Connects the bearer (creating it first if needed) and keeps it connected from then on.'''
+
+        self._enabled = True
+        if self._bearer is None:
+            self._bearer = self._manager._bearer_for(self._profile)
+            self._watch()
+
+        # Outages are only measured once the bearer has been connected, so the first connection is
+        # not counted as one
+        if self._bearer.Connected:
+            self._on_connected()
+        else:
+            self._connect()
+
+    def stop(self, disconnect=True):
+        '''Stops keeping the connection up and (unless `disconnect` is False) disconnects the
+           bearer. The bearer itself is kept, so `start` reconnects it with a single call.'''
+
+        self._enabled = False
+        self._cancel_timer()
+        if disconnect and self._bearer is not None and self._connected:
+            self._bearer.Disconnect(reply_handler=lambda: None, error_handler=lambda error: None)
+
+    def close(self):
+        self.stop(disconnect=False)
+        if self._signal_match is not None:
+            self._signal_match.remove()
+            self._signal_match = None
+
+    def _watch(self):
+        if self._signal_match is not None:
+            self._signal_match.remove()
+
+        self._signal_match = self._bearer.connect_to_properties_changed(
+            self._on_bearer_properties_changed)
+
+    def _connect(self):
+        if not self._enabled or self._connecting:
+            return
+
+        self._connecting = True
+        self._connect_started_at = time.monotonic()
+        try:
+            self._bearer.Connect(reply_handler=self._on_connect_reply,
+                                 error_handler=self._on_connect_error,
+                                 timeout=self._manager._connect_timeout)
+        except Exception as e:
+            self._on_connect_error(e)
+
+    def _on_connect_reply(self):
+        self._connecting = False
+        self.connect_latencies.append(time.monotonic(), time.monotonic() - self._connect_started_at)
+        self._on_connected()
+
+    def _on_connect_error(self, error):
+        self._connecting = False
+        self.failures += 1
+        self.last_error = error
+        self._attempts += 1
+
+        get_dbus_name = getattr(error, 'get_dbus_name', None)
+        if get_dbus_name is not None and get_dbus_name() in _BearerGoneErrors:
+            # ModemManager dropped the bearer (e.g. the modem was re-probed), so the next attempt
+            # has to create it again
+            self._manager._pool_discard(self._bearer)
+            self._bearer = None
+
+        self._schedule_reconnect()
+
+    def _on_connected(self):
+        if not self._connected:
+            self._connected = True
+            self._attempts = 0
+            if self._down_since is not None:
+                self.outages.append(time.monotonic(), time.monotonic() - self._down_since)
+                self._down_since = None
+
+    def _on_disconnected(self):
+        if self._connected:
+            self._connected = False
+            self._down_since = time.monotonic()
+            if self._enabled:
+                self.reconnects += 1
+                self._schedule_reconnect()
+
+    def _on_bearer_properties_changed(self, interface_name, changed_properties, invalidated):
+        if 'Connected' not in changed_properties:
+            return
+
+        if changed_properties['Connected']:
+            self._on_connected()
+        else:
+            self._on_disconnected()
+
+    def _schedule_reconnect(self):
+        '''Schedules the next connection attempt after an exponential backoff with full jitter, so
+           that the modems of a site which all dropped together do not reconnect in lockstep.'''
+
+        if not self._enabled or self._timer_id is not None:
+            return
+
+        manager = self._manager
+        delay = random.uniform(0, min(manager._backoff * 2**self._attempts, manager._max_backoff))
+
+        def on_timer():
+            self._timer_id = None
+            if self._bearer is None:
+                try:
+                    self._bearer = manager._bearer_for(self._profile)
+                    self._watch()
+                except Exception as e:
+                    self.failures += 1
+                    self.last_error = e
+                    self._attempts += 1
+                    self._schedule_reconnect()
+                    return False
+
+            self._connect()
+            return False
+
+        self._timer_id = GLib.timeout_add(max(int(delay * 1000), 1), on_timer)
+
+    def _cancel_timer(self):
+        if self._timer_id is not None:
+            GLib.source_remove(self._timer_id)
+            self._timer_id = None
+
+
+class ConnectionManager:
+    '''Keeps the data connections of a modem up. Each ApnProfile gets its own bearer, which is
+       created once (or reused if the modem already has a bearer for the same APN and user) and is
+       then kept for the lifetime of the connection. When the bearer drops, as reported by its
+       Connected property, it is reconnected with a single Bearer.Connect call instead of a full
+       Modem.Simple.Connect sequence. Failed attempts are retried after an exponential backoff
+       starting at `backoff` seconds and capped at `max_backoff`, with full jitter. Reconnects only
+       happen while the main loop is running.'''
+
+    def __init__(self, modem, backoff=0.5, max_backoff=60.0, connect_timeout=None, capacity=1024):
+        self._modem = modem
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._connect_timeout = -1 if connect_timeout is None else connect_timeout
+        self._capacity = capacity
+        self._connections = []
+
+    @property
+    def modem(self):
+        return self._modem
+
+    @property
+    def connections(self):
+        return list(self._connections)
+
+    def add(self, profile, start=True):
+        '''Returns the ManagedConnection for `profile`, creating it if needed, and (unless `start`
+           is False) starts keeping it connected.'''
+
+        connection = self.connection_for(profile)
+        if connection is None:
+            connection = ManagedConnection(self, profile, self._capacity)
+            self._connections.append(connection)
+
+        if start:
+            connection.start()
+
+        return connection
+
+    def connection_for(self, profile):
+        for connection in self._connections:
+            if connection.profile is profile:
+                return connection
+
+        return None
+
+    def remove(self, profile, delete_bearer=False):
+        '''Stops and disconnects the connection for `profile` and (if `delete_bearer` is True)
+           deletes its bearer as well.'''
+
+        connection = self.connection_for(profile)
+        if connection is None:
+            return
+
+        self._connections.remove(connection)
+        connection.stop()
+        connection.close()
+        if delete_bearer and connection.bearer is not None:
+            self._modem.DeleteBearer(connection.bearer)
+
+    def statistics(self):
+        '''Returns the statistics of every connection keyed by bearer path. Connections whose bearer
+           has not been created yet are left out.'''
+
+        return {
+            connection.bearer.path: connection.statistics()
+            for connection in self._connections if connection.bearer is not None
+        }
+
+    def close(self):
+        '''Stops keeping the connections up without disconnecting or deleting their bearers.'''
+
+        for connection in self._connections:
+            connection.close()
+
+        self._connections.clear()
+
+    def _bearer_for(self, profile):
+        for bearer in self._modem.Bearers:
+            properties = bearer.Properties
+            if (properties.get('apn') == profile.apn and properties.get('user') == profile.user):
+                return bearer
+
+        return self._modem.CreateBearer(profile.to_connect_properties())
+
+    def _pool_discard(self, bearer):
+        self._modem._pool.discard(bearer.path)
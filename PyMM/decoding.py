@@ -0,0 +1,337 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Implementation of the decoding module, which converts the dbus-python values returned by
+   ModemManager into native Python objects. The converter of every property is built once from its
+   static signature (see `signatures.PropertySignatures`), so a reply is converted in a single pass
+   which only inspects the types of the values inside variants, whose signature is not known
+   upfront.'''
+
+import dbus
+
+from dataclasses import dataclass
+from functools import lru_cache
+from PyMM.enums import ModemAccessTechnology, ModemState
+from PyMM.signatures import PropertySignatures
+
+
+@dataclass
+class SignalQuality:
+    '''Decoded Modem.SignalQuality property'''
+
+    __slots__ = ('value', 'recent')
+
+    value: int
+    recent: bool
+
+
+@dataclass
+class IpConfig:
+    '''Decoded Bearer.Ip4Config or Bearer.Ip6Config property. Entries which ModemManager did not
+       report are None.'''
+
+    __slots__ = ('method', 'address', 'prefix', 'gateway', 'dns', 'mtu')
+
+    method: int
+    address: str
+    prefix: int
+    gateway: str
+    dns: list
+    mtu: int
+
+
+@dataclass
+class BearerStats:
+    '''Decoded Bearer.Stats property. Entries which ModemManager did not report are None.'''
+
+    __slots__ = ('rx_bytes', 'tx_bytes', 'duration', 'attempts', 'failed_attempts',
+                 'total_duration', 'total_rx_bytes', 'total_tx_bytes', 'uplink_speed',
+                 'downlink_speed')
+
+    rx_bytes: int
+    tx_bytes: int
+    duration: int
+    attempts: int
+    failed_attempts: int
+    total_duration: int
+    total_rx_bytes: int
+    total_tx_bytes: int
+    uplink_speed: int
+    downlink_speed: int
+
+
+@dataclass
+class SimpleStatus:
+    '''Decoded reply of Modem.Simple.GetStatus. Entries which ModemManager did not report (which
+       depends on the state of the modem) are None.'''
+
+    __slots__ = ('state', 'signal_quality', 'current_bands', 'access_technologies',
+                 'registration_state', 'operator_code', 'operator_name')
+
+    state: ModemState
+    signal_quality: SignalQuality
+    current_bands: list
+    access_technologies: frozenset
+    registration_state: int
+    operator_code: str
+    operator_name: str
+
+
+# The individual bits of the ModemAccessTechnology bitmask
+_AccessTechnologyBits = tuple(
+    technology for technology in ModemAccessTechnology
+    if technology and technology != ModemAccessTechnology.MM_MODEM_ACCESS_TECHNOLOGY_ANY)
+
+
+def decode_access_technologies(mask):
+    '''Decodes a ModemAccessTechnology bitmask into the frozenset of its individual technologies.'''
+
+    mask = int(mask)
+    return frozenset(technology for technology in _AccessTechnologyBits if mask & technology)
+
+
+def _int_or_none(value):
+    return None if value is None else int(value)
+
+
+def _str_or_none(value):
+    return None if value is None else str(value)
+
+
+def _decode_signal_quality(value):
+    return SignalQuality(int(value[0]), bool(value[1]))
+
+
+def _decode_ip_config(value):
+    dns = [str(value[key]) for key in ('dns1', 'dns2', 'dns3') if key in value]
+    return IpConfig(_int_or_none(value.get('method')), _str_or_none(value.get('address')),
+                    _int_or_none(value.get('prefix')), _str_or_none(value.get('gateway')), dns,
+                    _int_or_none(value.get('mtu')))
+
+
+def _decode_bearer_stats(value):
+    get = value.get
+    return BearerStats(_int_or_none(get('rx-bytes')), _int_or_none(get('tx-bytes')),
+                       _int_or_none(get('duration')), _int_or_none(get('attempts')),
+                       _int_or_none(get('failed-attempts')), _int_or_none(get('total-duration')),
+                       _int_or_none(get('total-rx-bytes')), _int_or_none(get('total-tx-bytes')),
+                       _int_or_none(get('uplink-speed')), _int_or_none(get('downlink-speed')))
+
+
+def _decode_connection_error(value):
+    # An empty error name means that the last connection attempt did not fail
+    return (str(value[0]), str(value[1])) if value[0] else None
+
+
+def decode_simple_status(value):
+    '''Decodes the reply of Modem.Simple.GetStatus into a SimpleStatus.'''
+
+    get = value.get
+    state = get('state')
+    signal_quality = get('signal-quality')
+    current_bands = get('current-bands')
+    access_technologies = get('access-technologies')
+    return SimpleStatus(
+        None if state is None else ModemState(state),
+        None if signal_quality is None else _decode_signal_quality(signal_quality),
+        None if current_bands is None else list(map(int, current_bands)),
+        None if access_technologies is None else decode_access_technologies(access_technologies),
+        _int_or_none(get('m3gpp-registration-state')), _str_or_none(get('m3gpp-operator-code')),
+        _str_or_none(get('m3gpp-operator-name')))
+
+
+# Converters of the properties whose values have a meaning beyond their D-Bus type, keyed by
+# interface name and then by property name. All the others are converted according to their
+# signature.
+PropertyConverters = {
+    'org.freedesktop.ModemManager1.Modem': {
+        'State': ModemState,
+        'AccessTechnologies': decode_access_technologies,
+        'SignalQuality': _decode_signal_quality,
+    },
+    'org.freedesktop.ModemManager1.Bearer': {
+        'Ip4Config': _decode_ip_config,
+        'Ip6Config': _decode_ip_config,
+        'Stats': _decode_bearer_stats,
+        'ConnectionError': _decode_connection_error,
+    },
+}
+
+
+def to_native(value):
+    '''Converts a dbus-python value of any type into the equivalent native Python value. Only used
+       for the contents of variants and of the properties whose signature is not known.'''
+
+    converter = _NativeConverters.get(type(value))
+    return value if converter is None else converter(value)
+
+
+_NativeConverters = {
+    dbus.String: str,
+    dbus.ObjectPath: str,
+    dbus.Signature: str,
+    dbus.Boolean: bool,
+    dbus.Byte: int,
+    dbus.Int16: int,
+    dbus.UInt16: int,
+    dbus.Int32: int,
+    dbus.UInt32: int,
+    dbus.Int64: int,
+    dbus.UInt64: int,
+    dbus.Double: float,
+    dbus.ByteArray: bytes,
+    dbus.Array: lambda value: [to_native(item) for item in value],
+    dbus.Struct: lambda value: tuple(to_native(item) for item in value),
+    dbus.Dictionary: lambda value: {
+        to_native(key): to_native(item)
+        for key, item in value.items()
+    },
+}
+
+
+def _split_signature(signature):
+    '''Splits a D-Bus signature into its complete types.'''
+
+    types = []
+    start = 0
+    while start < len(signature):
+        end = start
+        while signature[end] == 'a':
+            end += 1
+
+        if signature[end] in '({':
+            depth = 0
+            for end in range(end, len(signature)):
+                if signature[end] in '({':
+                    depth += 1
+                elif signature[end] in ')}':
+                    depth -= 1
+                    if depth == 0:
+                        break
+
+        types.append(signature[start:end + 1])
+        start = end + 1
+
+    return types
+
+
+_BasicConverters = {
+    'y': int,
+    'n': int,
+    'q': int,
+    'i': int,
+    'u': int,
+    'x': int,
+    't': int,
+    'h': int,
+    'b': bool,
+    'd': float,
+    's': str,
+    'o': str,
+    'g': str,
+    'v': to_native,
+}
+
+
+@lru_cache(maxsize=None)
+def converter_for_signature(signature):
+    '''Returns a function which converts a value of the specified single complete D-Bus type into
+       its native equivalent. The function is built once per signature.'''
+
+    basic = _BasicConverters.get(signature)
+    if basic is not None:
+        return basic
+
+    if signature == 'ay':
+        return bytes
+
+    if signature.startswith('a{'):
+        key_converter = converter_for_signature(signature[2])
+        item_converter = converter_for_signature(signature[3:-1])
+        return lambda value: {
+            key_converter(key): item_converter(item)
+            for key, item in value.items()
+        }
+
+    if signature.startswith('a'):
+        item_converter = converter_for_signature(signature[1:])
+        return lambda value: list(map(item_converter, value))
+
+    if signature.startswith('('):
+        item_converters = tuple(map(converter_for_signature, _split_signature(signature[1:-1])))
+        return lambda value: tuple(
+            converter(item) for converter, item in zip(item_converters, value))
+
+    raise ValueError(f'Unsupported D-Bus signature {signature}')
+
+
+class PropertyDecoder:
+    '''Converts the properties of a single ModemManager interface into native Python objects. The
+       converters of all its properties are built on construction, so use `for_interface` to get
+       the shared instance.'''
+
+    __slots__ = ('_interface_name', '_converters')
+
+    _decoders = {}
+
+    @classmethod
+    def for_interface(cls, interface_name):
+        decoder = cls._decoders.get(interface_name)
+        if decoder is None:
+            decoder = cls._decoders[interface_name] = cls(interface_name)
+
+        return decoder
+
+    def __init__(self, interface_name):
+        self._interface_name = interface_name
+        self._converters = {
+            property_name: converter_for_signature(signature)
+            for property_name, signature in PropertySignatures.get(interface_name, {}).items()
+        }
+        self._converters.update(PropertyConverters.get(interface_name, {}))
+
+    def decode(self, property_name, value):
+        return self._converters.get(property_name, to_native)(value)
+
+    def decode_all(self, properties):
+        '''Converts a dictionary of properties (e.g. the reply of GetAll) in a single pass.'''
+
+        converters = self._converters
+        return {
+            str(property_name): converters.get(property_name, to_native)(value)
+            for property_name, value in properties.items()
+        }
+
+
+def decode_interfaces(interfaces_and_properties):
+    '''Converts the interfaces and properties of a single object (a{sa{sv}}, e.g. the payload of
+       InterfacesAdded) into a dictionary keyed by interface name of the decoded properties.'''
+
+    return {
+        str(interface_name): PropertyDecoder.for_interface(interface_name).decode_all(properties)
+        for interface_name, properties in interfaces_and_properties.items()
+    }
+
+
+def decode_managed_objects(managed_objects):
+    '''Converts the reply of GetManagedObjects (a{oa{sa{sv}}}) into a dictionary keyed by object
+       path of dictionaries keyed by interface name of the decoded properties. See
+       `decode_interfaces` for a single object.'''
+
+    return {
+        str(path): decode_interfaces(interfaces_and_properties)
+        for path, interfaces_and_properties in managed_objects.items()
+    }
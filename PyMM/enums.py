@@ -0,0 +1,81 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Implementation of the enums module, which holds the ModemManager enumerations that are shared
+   between the dbus-python objects and the asyncio front end in `PyMM.aio`. It must not depend on
+   dbus-python.'''
+
+from enum import IntEnum, unique
+
+
+@unique
+class ModemState(IntEnum):
+    '''Enumeration which represents the current initialisation state of the modem. Corresponds
+       verbatim to the values from https://www.freedesktop.org/software/ModemManager/api/latest/gdbus-org.freedesktop.ModemManager1.Modem.html#gdbus-property-org-freedesktop-ModemManager1-Modem.State.'''
+
+    MM_MODEM_STATE_FAILED = -1,
+    MM_MODEM_STATE_UNKNOWN = 0,
+    MM_MODEM_STATE_INITIALIZING = 1,
+    MM_MODEM_STATE_LOCKED = 2,
+    MM_MODEM_STATE_DISABLED = 3,
+    MM_MODEM_STATE_DISABLING = 4,
+    MM_MODEM_STATE_ENABLING = 5,
+    MM_MODEM_STATE_ENABLED = 6,
+    MM_MODEM_STATE_SEARCHING = 7,
+    MM_MODEM_STATE_REGISTERED = 8,
+    MM_MODEM_STATE_DISCONNECTING = 9,
+    MM_MODEM_STATE_CONNECTING = 10,
+    MM_MODEM_STATE_CONNECTED = 11,
+
+
+@unique
+class ModemAccessTechnology(IntEnum):
+    '''Enumeration which represents the access technology supported by the modem. Corresponds
+       verbatim to the values from https://www.freedesktop.org/software/ModemManager/doc/latest/ModemManager/ModemManager-Flags-and-Enumerations.html#MMModemAccessTechnology.'''
+
+    MM_MODEM_ACCESS_TECHNOLOGY_UNKNOWN = 0,
+    MM_MODEM_ACCESS_TECHNOLOGY_POTS = 1 << 0,
+    MM_MODEM_ACCESS_TECHNOLOGY_GSM = 1 << 1,
+    MM_MODEM_ACCESS_TECHNOLOGY_GSM_COMPACT = 1 << 2,
+    MM_MODEM_ACCESS_TECHNOLOGY_GPRS = 1 << 3,
+    MM_MODEM_ACCESS_TECHNOLOGY_EDGE = 1 << 4,
+    MM_MODEM_ACCESS_TECHNOLOGY_UMTS = 1 << 5,
+    MM_MODEM_ACCESS_TECHNOLOGY_HSDPA = 1 << 6,
+    MM_MODEM_ACCESS_TECHNOLOGY_HSUPA = 1 << 7,
+    MM_MODEM_ACCESS_TECHNOLOGY_HSPA = 1 << 8,
+    MM_MODEM_ACCESS_TECHNOLOGY_HSPA_PLUS = 1 << 9,
+    MM_MODEM_ACCESS_TECHNOLOGY_1XRTT = 1 << 10,
+    MM_MODEM_ACCESS_TECHNOLOGY_EVDO0 = 1 << 11,
+    MM_MODEM_ACCESS_TECHNOLOGY_EVDOA = 1 << 12,
+    MM_MODEM_ACCESS_TECHNOLOGY_EVDOB = 1 << 13,
+    MM_MODEM_ACCESS_TECHNOLOGY_LTE = 1 << 14,
+    MM_MODEM_ACCESS_TECHNOLOGY_5GNR = 1 << 15,
+    MM_MODEM_ACCESS_TECHNOLOGY_LTE_CAT_M = 1 << 16,
+    MM_MODEM_ACCESS_TECHNOLOGY_LTE_NB_IOT = 1 << 17,
+    MM_MODEM_ACCESS_TECHNOLOGY_ANY = 0xFFFFFFFF,
+
+
+@unique
+class SmsState(IntEnum):
+    '''Enumeration which represents the state of an SMS. Corresponds verbatim to the values from
+       https://www.freedesktop.org/software/ModemManager/api/latest/ModemManager-Flags-and-Enumerations.html#MMSmsState.'''
+
+    MM_SMS_STATE_UNKNOWN = 0,
+    MM_SMS_STATE_STORED = 1,
+    MM_SMS_STATE_RECEIVING = 2,
+    MM_SMS_STATE_RECEIVED = 3,
+    MM_SMS_STATE_SENDING = 4,
+    MM_SMS_STATE_SENT = 5,
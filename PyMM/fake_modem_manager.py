@@ -0,0 +1,777 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Implementation of the fake_modem_manager module, which is a stand-in for the ModemManager service
+   exposing any number of synthetic modems (with their SIMs, bearers and SMS) on a private bus. It
+   is intended for tests and benchmarks which cannot rely on real hardware or on the system bus.
+   Every modem has one own number and the messages sent to it are received back, which stands in
+   for the network.
+
+   It can be run as `python -m PyMM.fake_modem_manager --address <bus address> --modems 100`, or
+   from Python through PrivateBus and FakeModemManagerProcess, which start a private dbus-daemon and
+   the fake service in a separate process respectively.'''
+
+import argparse
+import dbus
+import dbus.service
+import os
+import subprocess
+import sys
+import time
+
+from gi.repository import GLib
+from PyMM import ModemManagerBusName
+from PyMM.mainloop import install as install_mainloop
+from PyMM.enums import ModemAccessTechnology, ModemState, SmsState
+
+_PropertiesInterfaceName = 'org.freedesktop.DBus.Properties'
+_ObjectManagerInterfaceName = 'org.freedesktop.DBus.ObjectManager'
+_ModemManagerInterfaceName = 'org.freedesktop.ModemManager1'
+_ModemInterfaceName = 'org.freedesktop.ModemManager1.Modem'
+_ModemSimpleInterfaceName = 'org.freedesktop.ModemManager1.Modem.Simple'
+_ModemSignalInterfaceName = 'org.freedesktop.ModemManager1.Modem.Signal'
+_MessagingInterfaceName = 'org.freedesktop.ModemManager1.Modem.Messaging'
+_SmsInterfaceName = 'org.freedesktop.ModemManager1.Sms'
+_SimInterfaceName = 'org.freedesktop.ModemManager1.Sim'
+_BearerInterfaceName = 'org.freedesktop.ModemManager1.Bearer'
+
+_ModemManagerPath = '/org/freedesktop/ModemManager1'
+
+
+def _error(name, message):
+    return dbus.exceptions.DBusException(message,
+                                         name=f'org.freedesktop.ModemManager1.Error.{name}')
+
+
+class _FakeObject(dbus.service.Object):
+    '''Base class for the fake objects, which implements org.freedesktop.DBus.Properties on top of
+       a dictionary of already typed D-Bus values per interface'''
+
+    def __init__(self, service, path, properties):
+        super().__init__(service.bus, path)
+        self._service = service
+        self._path = path
+        self._properties = properties
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def properties(self):
+        return self._properties
+
+    def set_property(self, interface_name, property_name, value):
+        self._properties[interface_name][property_name] = value
+        self.PropertiesChanged(interface_name,
+                               dbus.Dictionary({property_name: value}, signature='sv'),
+                               dbus.Array([], signature='s'))
+
+    @dbus.service.method(_PropertiesInterfaceName, in_signature='ss', out_signature='v',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def Get(self, interface_name, property_name, reply_handler, error_handler):
+        try:
+            value = self._properties[interface_name][property_name]
+        except KeyError:
+            self._service.respond(
+                error_handler,
+                dbus.exceptions.DBusException(f'No such property {interface_name}.{property_name}',
+                                              name='org.freedesktop.DBus.Error.UnknownProperty'))
+        else:
+            self._service.respond(reply_handler, value)
+
+    @dbus.service.method(_PropertiesInterfaceName, in_signature='s', out_signature='a{sv}',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def GetAll(self, interface_name, reply_handler, error_handler):
+        self._service.respond(
+            reply_handler, dbus.Dictionary(self._properties.get(interface_name, {}),
+                                           signature='sv'))
+
+    @dbus.service.signal(_PropertiesInterfaceName, signature='sa{sv}as')
+    def PropertiesChanged(self, interface_name, changed_properties, invalidated_properties):
+        pass
+
+
+class FakeSim(_FakeObject):
+
+    def __init__(self, service, index):
+        super().__init__(
+            service, f'{_ModemManagerPath}/SIM/{index}', {
+                _SimInterfaceName: {
+                    'Active': dbus.Boolean(True),
+                    'SimIdentifier': dbus.String(f'8934{index:015d}'),
+                    'Imsi': dbus.String(f'21407{index:010d}'),
+                    'OperatorIdentifier': dbus.String('21407'),
+                    'OperatorName': dbus.String('Fake Operator'),
+                    'Eid': dbus.String(''),
+                },
+            })
+
+    @dbus.service.method(_SimInterfaceName, in_signature='s', out_signature='',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def SendPin(self, pin, reply_handler, error_handler):
+        if pin == self._service.pin:
+            self._service.respond(reply_handler)
+        else:
+            self._service.respond(error_handler,
+                                  _error('MobileEquipment.IncorrectPassword', 'Incorrect PIN'))
+
+
+class FakeBearer(_FakeObject):
+
+    def __init__(self, service, index, modem, settings):
+        super().__init__(
+            service, f'{_ModemManagerPath}/Bearer/{index}', {
+                _BearerInterfaceName: {
+                    'Connected': dbus.Boolean(False),
+                    'Suspended': dbus.Boolean(False),
+                    'Interface': dbus.String(f'wwan{index}'),
+                    'Ip4Config': dbus.Dictionary({}, signature='sv'),
+                    'Ip6Config': dbus.Dictionary({}, signature='sv'),
+                    'Stats': dbus.Dictionary({}, signature='sv'),
+                    'ReloadStatsSupported': dbus.Boolean(False),
+                    'IpTimeout': dbus.UInt32(20),
+                    'BearerType': dbus.UInt32(1),
+                    'Properties': dbus.Dictionary(settings, signature='sv'),
+                    'ConnectionError': dbus.Struct(('', ''), signature='ss'),
+                },
+            })
+        self._index = index
+        self._modem = modem
+        self._rx_bytes = 0
+        self._tx_bytes = 0
+        self._stats_timer = None
+
+    @property
+    def connected(self):
+        return bool(self._properties[_BearerInterfaceName]['Connected'])
+
+    def connect(self):
+        self.set_property(
+            _BearerInterfaceName, 'Ip4Config',
+            dbus.Dictionary(
+                {
+                    'method': dbus.UInt32(2),
+                    'address': dbus.String(f'10.{self._index // 256 % 256}.{self._index % 256}.2'),
+                    'prefix': dbus.UInt32(30),
+                    'gateway': dbus.String(f'10.{self._index // 256 % 256}.{self._index % 256}.1'),
+                    'dns1': dbus.String('8.8.8.8'),
+                    'mtu': dbus.UInt32(1500),
+                }, signature='sv'))
+        self.set_property(_BearerInterfaceName, 'Connected', dbus.Boolean(True))
+
+        self._rx_bytes = 0
+        self._tx_bytes = 0
+        if self._service.stats_interval and self._stats_timer is None:
+            self._stats_timer = GLib.timeout_add(int(self._service.stats_interval * 1000),
+                                                 self._update_stats)
+
+    def disconnect(self):
+        if self._stats_timer is not None:
+            GLib.source_remove(self._stats_timer)
+            self._stats_timer = None
+
+        self.set_property(_BearerInterfaceName, 'Connected', dbus.Boolean(False))
+        self.set_property(_BearerInterfaceName, 'Ip4Config', dbus.Dictionary({}, signature='sv'))
+
+    def _update_stats(self):
+        self._rx_bytes += 100000 + self._index * 1000
+        self._tx_bytes += 20000 + self._index * 100
+        self.set_property(
+            _BearerInterfaceName, 'Stats',
+            dbus.Dictionary(
+                {
+                    'rx-bytes': dbus.UInt64(self._rx_bytes),
+                    'tx-bytes': dbus.UInt64(self._tx_bytes),
+                    'duration': dbus.UInt32(0),
+                }, signature='sv'))
+        return True
+
+    @dbus.service.method(_BearerInterfaceName, in_signature='', out_signature='',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def Connect(self, reply_handler, error_handler):
+        self._modem.connect_bearer(self, reply_handler, error_handler)
+
+    @dbus.service.method(_BearerInterfaceName, in_signature='', out_signature='',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def Disconnect(self, reply_handler, error_handler):
+        self._modem.disconnect_bearer(self, reply_handler)
+
+
+class FakeSms(_FakeObject):
+
+    def __init__(self, service, index, modem, number, text, state):
+        super().__init__(
+            service, f'{_ModemManagerPath}/SMS/{index}', {
+                _SmsInterfaceName: {
+                    'State': dbus.UInt32(state),
+                    'PduType': dbus.UInt32(1 if state == SmsState.MM_SMS_STATE_RECEIVED else 2),
+                    'Number': dbus.String(number),
+                    'Text': dbus.String(text),
+                    'Data': dbus.Array([], signature='y'),
+                    'SMSC': dbus.String(''),
+                    'MessageReference': dbus.UInt32(0),
+                    'Timestamp': dbus.String(''),
+                    'DeliveryState': dbus.UInt32(0x100),
+                    'Storage': dbus.UInt32(0),
+                },
+            })
+        self._modem = modem
+
+    @property
+    def number(self):
+        return str(self._properties[_SmsInterfaceName]['Number'])
+
+    @property
+    def text(self):
+        return str(self._properties[_SmsInterfaceName]['Text'])
+
+    @dbus.service.method(_SmsInterfaceName, in_signature='', out_signature='',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def Send(self, reply_handler, error_handler):
+        self._modem.send_message(self, reply_handler, error_handler)
+
+
+class FakeModem(_FakeObject):
+
+    def __init__(self, service, index, sim):
+        super().__init__(
+            service, f'{_ModemManagerPath}/Modem/{index}', {
+                _ModemInterfaceName: {
+                    'Sim':
+                        dbus.ObjectPath(sim.path),
+                    'SimSlots':
+                        dbus.Array([dbus.ObjectPath(sim.path)], signature='o'),
+                    'PrimarySimSlot':
+                        dbus.UInt32(1),
+                    'Bearers':
+                        dbus.Array([], signature='o'),
+                    'Manufacturer':
+                        dbus.String('PyMM'),
+                    'Model':
+                        dbus.String('Fake Modem'),
+                    'Revision':
+                        dbus.String('1.0'),
+                    'CarrierConfiguration':
+                        dbus.String('default'),
+                    'DeviceIdentifier':
+                        dbus.String(f'{index:040x}'),
+                    'Device':
+                        dbus.String(f'/sys/devices/fake/{index}'),
+                    'Drivers':
+                        dbus.Array(['fake'], signature='s'),
+                    'Plugin':
+                        dbus.String('fake'),
+                    'PrimaryPort':
+                        dbus.String(f'cdc-wdm{index}'),
+                    'EquipmentIdentifier':
+                        dbus.String(f'35{index:013d}'),
+                    'UnlockRequired':
+                        dbus.UInt32(1),
+                    'State':
+                        dbus.Int32(ModemState.MM_MODEM_STATE_DISABLED),
+                    'StateFailedReason':
+                        dbus.UInt32(0),
+                    'AccessTechnologies':
+                        dbus.UInt32(0),
+                    'SignalQuality':
+                        dbus.Struct((dbus.UInt32(0), dbus.Boolean(False)), signature='ub'),
+                    'OwnNumbers':
+                        dbus.Array([f'+1555{index:07d}'], signature='s'),
+                    'PowerState':
+                        dbus.UInt32(3),
+                },
+                _ModemSimpleInterfaceName: {},
+                _ModemSignalInterfaceName: {
+                    'Rate': dbus.UInt32(0),
+                    'RssiThreshold': dbus.UInt32(0),
+                    'ErrorRateThreshold': dbus.Boolean(False),
+                    'Cdma': dbus.Dictionary({}, signature='sv'),
+                    'Evdo': dbus.Dictionary({}, signature='sv'),
+                    'Gsm': dbus.Dictionary({}, signature='sv'),
+                    'Umts': dbus.Dictionary({}, signature='sv'),
+                    'Lte': dbus.Dictionary({}, signature='sv'),
+                    'Nr5g': dbus.Dictionary({}, signature='sv'),
+                },
+                _MessagingInterfaceName: {
+                    'Messages': dbus.Array([], signature='o'),
+                    'SupportedStorages': dbus.Array([dbus.UInt32(2)], signature='u'),
+                    'DefaultStorage': dbus.UInt32(2),
+                },
+            })
+        self._index = index
+        self._sim = sim
+        self._bearers = []
+        self._messages = []
+        self._signal_timer = None
+
+    @property
+    def state(self):
+        return ModemState(self._properties[_ModemInterfaceName]['State'])
+
+    def set_state(self, new_state):
+        old_state = self.state
+        if old_state == new_state:
+            return
+
+        self.set_property(_ModemInterfaceName, 'State', dbus.Int32(new_state))
+        self.StateChanged(dbus.Int32(old_state), dbus.Int32(new_state), dbus.UInt32(0))
+
+    def update_signal_quality(self, quality):
+        self.set_property(_ModemInterfaceName, 'SignalQuality',
+                          dbus.Struct((dbus.UInt32(quality), dbus.Boolean(True)), signature='ub'))
+
+    def connect_bearer(self, bearer, reply_handler, error_handler):
+        if self.state < ModemState.MM_MODEM_STATE_REGISTERED:
+            self._service.respond(error_handler, _error('Core.WrongState',
+                                                        'Modem is not registered'))
+            return
+
+        self.set_state(ModemState.MM_MODEM_STATE_CONNECTING)
+
+        def connected():
+            bearer.connect()
+            self.set_state(ModemState.MM_MODEM_STATE_CONNECTED)
+            reply_handler()
+
+        self._service.respond(connected)
+
+    def disconnect_bearer(self, bearer, reply_handler):
+        bearer.disconnect()
+        if not any(b.connected for b in self._bearers):
+            self.set_state(ModemState.MM_MODEM_STATE_REGISTERED)
+        self._service.respond(reply_handler)
+
+    def send_message(self, sms, reply_handler, error_handler):
+        '''Sends the message, which is received back by this modem if it is addressed to one of its
+           own numbers.'''
+
+        if self.state < ModemState.MM_MODEM_STATE_REGISTERED:
+            self._service.respond(error_handler, _error('Core.WrongState',
+                                                        'Modem is not registered'))
+            return
+
+        sms.set_property(_SmsInterfaceName, 'State', dbus.UInt32(SmsState.MM_SMS_STATE_SENDING))
+
+        def sent():
+            sms.set_property(_SmsInterfaceName, 'State', dbus.UInt32(SmsState.MM_SMS_STATE_SENT))
+            reply_handler()
+
+            if sms.number in self._properties[_ModemInterfaceName]['OwnNumbers']:
+                self._add_message(sms.number, sms.text, SmsState.MM_SMS_STATE_RECEIVED)
+
+        self._service.respond(sent)
+
+    def _add_message(self, number, text, state):
+        sms = FakeSms(self._service, self._service.next_sms_index(), self, number, text, state)
+        self._messages.append(sms)
+        self._update_messages()
+        self.Added(dbus.ObjectPath(sms.path), dbus.Boolean(state == SmsState.MM_SMS_STATE_RECEIVED))
+        return sms
+
+    def _update_messages(self):
+        self.set_property(
+            _MessagingInterfaceName, 'Messages',
+            dbus.Array([dbus.ObjectPath(sms.path) for sms in self._messages], signature='o'))
+
+    def _create_bearer(self, settings):
+        bearer = FakeBearer(self._service, self._service.next_bearer_index(), self, settings)
+        self._bearers.append(bearer)
+        self.set_property(
+            _ModemInterfaceName, 'Bearers',
+            dbus.Array([dbus.ObjectPath(b.path) for b in self._bearers], signature='o'))
+        return bearer
+
+    def remove_from_connection(self, *args, **kwargs):
+        for bearer in self._bearers:
+            bearer.disconnect()
+            bearer.remove_from_connection()
+        for sms in self._messages:
+            sms.remove_from_connection()
+        self._sim.remove_from_connection()
+        if self._signal_timer is not None:
+            GLib.source_remove(self._signal_timer)
+            self._signal_timer = None
+
+        super().remove_from_connection(*args, **kwargs)
+
+    @dbus.service.signal(_ModemInterfaceName, signature='iiu')
+    def StateChanged(self, old, new, reason):
+        pass
+
+    @dbus.service.method(_ModemInterfaceName, in_signature='b', out_signature='',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def Enable(self, enable, reply_handler, error_handler):
+        if not enable:
+            for bearer in self._bearers:
+                bearer.disconnect()
+            self.set_state(ModemState.MM_MODEM_STATE_DISABLED)
+            self._service.respond(reply_handler)
+            return
+
+        if self.state >= ModemState.MM_MODEM_STATE_ENABLED:
+            self._service.respond(reply_handler)
+            return
+
+        self.set_state(ModemState.MM_MODEM_STATE_ENABLING)
+
+        def enabled():
+            self.set_state(ModemState.MM_MODEM_STATE_ENABLED)
+            self.set_property(_ModemInterfaceName, 'AccessTechnologies',
+                              dbus.UInt32(ModemAccessTechnology.MM_MODEM_ACCESS_TECHNOLOGY_LTE))
+            self.update_signal_quality(50 + self._index % 50)
+            reply_handler()
+
+            # Registration completes asynchronously after the Enable reply, as on real modems
+            self.set_state(ModemState.MM_MODEM_STATE_SEARCHING)
+            self._service.respond(lambda: self.set_state(ModemState.MM_MODEM_STATE_REGISTERED))
+
+        self._service.respond(enabled)
+
+    @dbus.service.method(_ModemInterfaceName, in_signature='', out_signature='',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def Reset(self, reply_handler, error_handler):
+        for bearer in self._bearers:
+            bearer.disconnect()
+        self.set_state(ModemState.MM_MODEM_STATE_DISABLED)
+        self._service.respond(reply_handler)
+
+    @dbus.service.method(_ModemInterfaceName, in_signature='a{sv}', out_signature='o',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def CreateBearer(self, properties, reply_handler, error_handler):
+        bearer = self._create_bearer(properties)
+        self._service.respond(reply_handler, dbus.ObjectPath(bearer.path))
+
+    @dbus.service.method(_ModemInterfaceName, in_signature='su', out_signature='s',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def Command(self, cmd, timeout, reply_handler, error_handler):
+        self._service.respond(reply_handler, dbus.String(f'{cmd}: {self._index}'))
+
+    @dbus.service.method(_ModemSimpleInterfaceName, in_signature='a{sv}', out_signature='o',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def Connect(self, properties, reply_handler, error_handler):
+        bearer = self._bearers[0] if self._bearers else self._create_bearer(properties)
+        self.connect_bearer(bearer, lambda: reply_handler(dbus.ObjectPath(bearer.path)),
+                            error_handler)
+
+    @dbus.service.method(_ModemSimpleInterfaceName, in_signature='o', out_signature='',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def Disconnect(self, bearer_path, reply_handler, error_handler):
+        for bearer in self._bearers:
+            if bearer_path == '/' or bearer.path == bearer_path:
+                bearer.disconnect()
+        if self.state == ModemState.MM_MODEM_STATE_CONNECTED:
+            self.set_state(ModemState.MM_MODEM_STATE_REGISTERED)
+        self._service.respond(reply_handler)
+
+    @dbus.service.method(_ModemSimpleInterfaceName, in_signature='', out_signature='a{sv}',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def GetStatus(self, reply_handler, error_handler):
+        modem = self._properties[_ModemInterfaceName]
+        self._service.respond(
+            reply_handler,
+            dbus.Dictionary(
+                {
+                    'state': dbus.UInt32(modem['State']),
+                    'signal-quality': modem['SignalQuality'],
+                    'access-technologies': modem['AccessTechnologies'],
+                }, signature='sv'))
+
+    @dbus.service.method(_MessagingInterfaceName, in_signature='', out_signature='ao',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def List(self, reply_handler, error_handler):
+        self._service.respond(
+            reply_handler,
+            dbus.Array([dbus.ObjectPath(sms.path) for sms in self._messages], signature='o'))
+
+    @dbus.service.method(_MessagingInterfaceName, in_signature='a{sv}', out_signature='o',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def Create(self, properties, reply_handler, error_handler):
+        if 'number' not in properties or 'text' not in properties:
+            self._service.respond(error_handler, _error('Core.InvalidArgs',
+                                                        'Missing number or text'))
+            return
+
+        sms = self._add_message(properties['number'], properties['text'],
+                                SmsState.MM_SMS_STATE_UNKNOWN)
+        self._service.respond(reply_handler, dbus.ObjectPath(sms.path))
+
+    @dbus.service.method(_MessagingInterfaceName, in_signature='o', out_signature='',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def Delete(self, path, reply_handler, error_handler):
+        sms = next((sms for sms in self._messages if sms.path == path), None)
+        if sms is None:
+            self._service.respond(error_handler, _error('Core.NotFound', f'No SMS at {path}'))
+            return
+
+        self._messages.remove(sms)
+        sms.remove_from_connection()
+        self._update_messages()
+        self.Deleted(dbus.ObjectPath(path))
+        self._service.respond(reply_handler)
+
+    @dbus.service.signal(_MessagingInterfaceName, signature='ob')
+    def Added(self, path, received):
+        pass
+
+    @dbus.service.signal(_MessagingInterfaceName, signature='o')
+    def Deleted(self, path):
+        pass
+
+    @dbus.service.method(_ModemSignalInterfaceName, in_signature='u', out_signature='',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def Setup(self, rate, reply_handler, error_handler):
+        if self._signal_timer is not None:
+            GLib.source_remove(self._signal_timer)
+            self._signal_timer = None
+        if rate > 0:
+            self._signal_timer = GLib.timeout_add_seconds(rate, self._update_extended_signal)
+
+        self._properties[_ModemSignalInterfaceName]['Rate'] = dbus.UInt32(rate)
+        self._service.respond(reply_handler)
+
+    def _update_extended_signal(self):
+        phase = int(time.monotonic()) % 10
+        self.set_property(
+            _ModemSignalInterfaceName, 'Lte',
+            dbus.Dictionary(
+                {
+                    'rssi': dbus.Double(-60.0 - phase),
+                    'rsrp': dbus.Double(-90.0 - phase),
+                    'rsrq': dbus.Double(-10.0 - phase / 2),
+                    'snr': dbus.Double(10.0 - phase / 2),
+                }, signature='sv'))
+        return True
+
+
+class FakeModemManager(_FakeObject):
+    '''Root object of the fake service, which implements the ModemManager and ObjectManager
+       interfaces over a set of FakeModem objects. The `latency` (in seconds) is added to every
+       method reply and the `signal_interval` and `stats_interval` (in seconds, disabled if 0)
+       control how often every modem emits signal quality and connected bearer statistics
+       updates.'''
+
+    def __init__(self, bus, modems=1, latency=0, signal_interval=0, stats_interval=0, pin='1234'):
+        self.bus = bus
+        self.latency = latency
+        self.stats_interval = stats_interval
+        self.pin = pin
+
+        super().__init__(self, _ModemManagerPath, {
+            _ModemManagerInterfaceName: {
+                'Version': dbus.String('1.20.0'),
+            },
+        })
+
+        self._modems = {}
+        self._next_modem_index = 0
+        self._next_bearer_index = 0
+        self._next_sms_index = 0
+        for _ in range(modems):
+            self.add_modem()
+
+        if signal_interval:
+            GLib.timeout_add(int(signal_interval * 1000), self._update_signal_quality)
+
+    @property
+    def modems(self):
+        return list(self._modems.values())
+
+    def respond(self, callback, *args):
+        '''Invokes `callback` with the arguments after the configured latency.'''
+
+        if not self.latency:
+            callback(*args)
+            return
+
+        def respond():
+            callback(*args)
+            return False
+
+        GLib.timeout_add(int(self.latency * 1000), respond)
+
+    def next_bearer_index(self):
+        self._next_bearer_index += 1
+        return self._next_bearer_index - 1
+
+    def next_sms_index(self):
+        self._next_sms_index += 1
+        return self._next_sms_index - 1
+
+    def add_modem(self):
+        '''Hot-plugs a new modem and returns it.'''
+
+        index = self._next_modem_index
+        self._next_modem_index += 1
+
+        modem = FakeModem(self, index, FakeSim(self, index))
+        self._modems[modem.path] = modem
+        self.InterfacesAdded(dbus.ObjectPath(modem.path), self._interfaces_and_properties(modem))
+        return modem
+
+    def remove_modem(self, path):
+        '''Hot-unplugs the modem at the specified path.'''
+
+        modem = self._modems.pop(path)
+        modem.remove_from_connection()
+        self.InterfacesRemoved(dbus.ObjectPath(path),
+                               dbus.Array(list(modem.properties), signature='s'))
+
+    def _interfaces_and_properties(self, modem):
+        return dbus.Dictionary(
+            {
+                interface_name: dbus.Dictionary(properties, signature='sv')
+                for interface_name, properties in modem.properties.items()
+            }, signature='sa{sv}')
+
+    def _update_signal_quality(self):
+        phase = int(time.monotonic())
+        for modem in self._modems.values():
+            if modem.state >= ModemState.MM_MODEM_STATE_ENABLED:
+                modem.update_signal_quality(40 + (phase + modem._index) % 60)
+        return True
+
+    @dbus.service.method(_ObjectManagerInterfaceName, in_signature='',
+                         out_signature='a{oa{sa{sv}}}',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def GetManagedObjects(self, reply_handler, error_handler):
+        self.respond(
+            reply_handler,
+            dbus.Dictionary(
+                {
+                    dbus.ObjectPath(path): self._interfaces_and_properties(modem)
+                    for path, modem in self._modems.items()
+                }, signature='oa{sa{sv}}'))
+
+    @dbus.service.signal(_ObjectManagerInterfaceName, signature='oa{sa{sv}}')
+    def InterfacesAdded(self, object_path, interfaces_and_properties):
+        pass
+
+    @dbus.service.signal(_ObjectManagerInterfaceName, signature='oas')
+    def InterfacesRemoved(self, object_path, interfaces):
+        pass
+
+    @dbus.service.method(_ModemManagerInterfaceName, in_signature='', out_signature='',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def ScanDevices(self, reply_handler, error_handler):
+        self.respond(reply_handler)
+
+
+class PrivateBus:
+    '''Private dbus-daemon, which is started on construction and stopped by `close` (or on exit
+       from the `with` block)'''
+
+    def __init__(self):
+        self._process = subprocess.Popen(
+            ['dbus-daemon', '--session', '--nofork', '--nopidfile', '--print-address=1'],
+            stdout=subprocess.PIPE, text=True)
+        self.address = self._process.stdout.readline().strip()
+        if not self.address:
+            self._process.kill()
+            raise RuntimeError('Failed to start a private dbus-daemon')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def connect(self):
+        '''Opens a new client connection to the private bus, dispatched by the GLib main loop.'''
+
+        install_mainloop('glib')
+        return dbus.bus.BusConnection(self.address)
+
+    def close(self):
+        if self._process.poll() is None:
+            self._process.terminate()
+            self._process.wait()
+
+
+def wait_for_service(address, process, timeout):
+    '''Waits until the ModemManager bus name is owned on the bus at `address`. Returns False if the
+       child `process` which is expected to own it exits or `timeout` (in seconds) expires first.'''
+
+    bus = dbus.bus.BusConnection(address)
+    try:
+        deadline = time.monotonic() + timeout
+        while not bus.name_has_owner(ModemManagerBusName):
+            if process.poll() is not None or time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+
+        return True
+    finally:
+        bus.close()
+
+
+class FakeModemManagerProcess:
+    '''Runs FakeModemManager in a child process attached to the bus at `address`, so that its
+       replies are not serialised with the main loop of the process under test. The keyword
+       arguments are those of FakeModemManager.'''
+
+    def __init__(self, address, modems=1, latency=0, signal_interval=0, stats_interval=0,
+                 timeout=30):
+        self._process = subprocess.Popen([
+            sys.executable, '-m', 'PyMM.fake_modem_manager', '--address', address, '--modems',
+            str(modems), '--latency',
+            str(latency), '--signal-interval',
+            str(signal_interval), '--stats-interval',
+            str(stats_interval)
+        ], env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+
+        # Wait until the service has exported all of its objects and acquired the bus name
+        if not wait_for_service(address, self._process, timeout):
+            self.close()
+            raise RuntimeError('The fake ModemManager service failed to start')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._process.poll() is None:
+            self._process.terminate()
+            self._process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake ModemManager service')
+    parser.add_argument('--address', required=True, help='Address of the bus to attach to')
+    parser.add_argument('--modems', type=int, default=1, help='Number of synthetic modems')
+    parser.add_argument('--latency', type=float, default=0, help='Reply latency in seconds')
+    parser.add_argument('--signal-interval', type=float, default=0,
+                        help='Seconds between signal quality updates (0 to disable)')
+    parser.add_argument('--stats-interval', type=float, default=0,
+                        help='Seconds between bearer statistics updates (0 to disable)')
+    args = parser.parse_args()
+
+    install_mainloop('glib')
+    bus = dbus.bus.BusConnection(args.address)
+
+    # Objects are exported before the name is requested, so that clients which wait for the name
+    # find the complete object tree
+    service = FakeModemManager(bus, args.modems, args.latency, args.signal_interval,
+                               args.stats_interval)
+    bus_name = dbus.service.BusName(ModemManagerBusName, bus)
+
+    GLib.MainLoop().run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Implementation of the fleet module, which runs the same operation against many modems
+   concurrently using non-blocking D-Bus calls'''
+
+import time
+
+from PyMM.mainloop import run_until
+
+
+class FleetResult:
+    '''Outcome of a fleet operation on a single modem. Exactly one of `value` and `error` is set
+       once the operation has completed.'''
+
+    __slots__ = ('modem', 'value', 'error', 'started_at', 'elapsed')
+
+    def __init__(self, modem):
+        self.modem = modem
+        self.value = None
+        self.error = None
+        self.started_at = time.monotonic()
+        self.elapsed = None
+
+    def __repr__(self):
+        outcome = f'error={self.error!r}' if self.error is not None else f'value={self.value!r}'
+        return f'FleetResult({self.modem}, {outcome}, elapsed={self.elapsed})'
+
+    @property
+    def ok(self):
+        return self.elapsed is not None and self.error is None
+
+    def _complete(self, value=None, error=None):
+        self.value = value
+        self.error = error
+        self.elapsed = time.monotonic() - self.started_at
+
+
+def for_each(modems, op, concurrency=None, timeout=None):
+    '''Invokes `op` on each of the `modems` as a pending call and waits for all of them to complete,
+       keeping at most `concurrency` calls in flight (unlimited if None). The `op` is either the
+       name of a Modem method which takes no arguments (e.g. 'Enable' or 'Reset') or a callable,
+       which receives the modem and the `reply_handler`, `error_handler` and `timeout` keywords and
+       must pass them on to a single PyMM method, for example:
+
+           lambda modem, **kwargs: modem.simple_interface.Connect(props, **kwargs)
+
+       The `timeout` (in seconds) applies to each individual call. Returns a dictionary of
+       FleetResult keyed by modem path. The total wall-clock time is therefore bounded by the
+       slowest modem(s) rather than by the sum of all of them.'''
+
+    modems = list(modems)
+    limit = len(modems) if concurrency is None else concurrency
+    if limit < 1:
+        raise ValueError('Concurrency must be at least 1')
+
+    results = {}
+    state = {'next': 0, 'in_flight': 0, 'filling': False}
+
+    def complete(result, value=None, error=None):
+        result._complete(value, error)
+        state['in_flight'] -= 1
+        fill()
+
+    def start(modem):
+        result = FleetResult(modem)
+        results[modem.path] = result
+        state['in_flight'] += 1
+
+        def on_reply(*values):
+            complete(result, value=values[0] if len(values) == 1 else (values or None))
+
+        def on_error(error):
+            complete(result, error=error)
+
+        kwargs = {'reply_handler': on_reply, 'error_handler': on_error}
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+
+        try:
+            if isinstance(op, str):
+                getattr(modem, op)(**kwargs)
+            else:
+                op(modem, **kwargs)
+        except Exception as e:
+            on_error(e)
+
+    def fill():
+        # Operations which fail synchronously complete from within `start`, so guard against
+        # re-entering the loop below from their completion
+        if state['filling']:
+            return
+
+        state['filling'] = True
+        try:
+            while state['in_flight'] < limit and state['next'] < len(modems):
+                state['next'] += 1
+                start(modems[state['next'] - 1])
+        finally:
+            state['filling'] = False
+
+    fill()
+    run_until(lambda: state['in_flight'] == 0 and state['next'] == len(modems))
+
+    return results
@@ -0,0 +1,313 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Implementation of the instrumentation module, which measures every D-Bus method call made by the
+   PyMM wrappers. All calls go through `signatures.call_method`, which only consults this module
+   when instrumentation has been enabled, so the cost when it is disabled is a single flag check.'''
+
+import bisect
+import time
+
+# Upper bounds (in seconds) of the latency histogram buckets, which are the Prometheus defaults
+# extended downwards, because most calls to a local ModemManager complete within a millisecond
+LatencyBuckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                  1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Read by `signatures.call_method` on every call, use `enable` and `disable` to change it
+enabled = False
+
+_pre_call_hooks = []
+_post_call_hooks = []
+_method_stats = {}
+
+# Duplicated from `PyMM.properties`, which depends on this module
+_PropertiesInterfaceName = 'org.freedesktop.DBus.Properties'
+
+
+class CallInfo:
+    '''Describes a single method call. The same instance is passed to the pre-call hooks before the
+       call is made and to the post-call hooks once it has completed, at which point exactly one of
+       `result` and `error` is set. For non-blocking calls the post-call hooks run from the main
+       loop, when the reply arrives.'''
+
+    __slots__ = ('path', 'interface_name', 'method_name', 'args', 'started_at', 'elapsed', 'result',
+                 'error', 'request_size', 'reply_size')
+
+    def __init__(self, path, interface_name, method_name, args):
+        self.path = path
+        self.interface_name = interface_name
+        self.method_name = method_name
+        self.args = args
+        self.started_at = None
+        self.elapsed = None
+        self.result = None
+        self.error = None
+        self.request_size = payload_size(args)
+        self.reply_size = 0
+
+    def __repr__(self):
+        return (f'CallInfo({self.path}, {self.interface_name}.{self.method_name}, '
+                f'elapsed={self.elapsed})')
+
+
+class MethodStats:
+    '''Aggregated measurements of all the calls to one method of one interface.'''
+
+    __slots__ = ('calls', 'errors', 'latency_sum', 'latency_max', 'buckets', 'request_bytes',
+                 'reply_bytes')
+
+    def __init__(self):
+        self.calls = 0
+        # Number of failed calls keyed by D-Bus error name (or exception type name)
+        self.errors = {}
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        # Non-cumulative count of calls per entry of LatencyBuckets, with one extra slot for the
+        # calls which took longer than the last bound
+        self.buckets = [0] * (len(LatencyBuckets) + 1)
+        self.request_bytes = 0
+        self.reply_bytes = 0
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': sum(self.errors.values()),
+            'errors_by_name': dict(self.errors),
+            'latency_sum': self.latency_sum,
+            'latency_max': self.latency_max,
+            'latency_mean': self.latency_sum / self.calls if self.calls else None,
+            'latency_buckets': dict(zip(LatencyBuckets + (float('inf'), ), self.buckets)),
+            'request_bytes': self.request_bytes,
+            'reply_bytes': self.reply_bytes,
+        }
+
+    def _record(self, call_info):
+        self.calls += 1
+        if call_info.error is not None:
+            error_name = _error_name(call_info.error)
+            self.errors[error_name] = self.errors.get(error_name, 0) + 1
+
+        self.latency_sum += call_info.elapsed
+        self.latency_max = max(self.latency_max, call_info.elapsed)
+        self.buckets[bisect.bisect_left(LatencyBuckets, call_info.elapsed)] += 1
+        self.request_bytes += call_info.request_size
+        self.reply_bytes += call_info.reply_size
+
+
+def enable():
+    '''Starts measuring every D-Bus method call made by the PyMM wrappers.'''
+
+    global enabled
+    enabled = True
+
+
+def disable():
+    '''Stops measuring calls. The statistics collected so far are retained until `reset`.'''
+
+    global enabled
+    enabled = False
+
+
+def reset():
+    '''Discards all the statistics collected so far.'''
+
+    _method_stats.clear()
+
+
+def add_pre_call_hook(hook):
+    '''Registers a callable which receives the CallInfo of every method call before it is sent.
+       Hooks only run while instrumentation is enabled.'''
+
+    _pre_call_hooks.append(hook)
+
+
+def add_post_call_hook(hook):
+    '''Registers a callable which receives the CallInfo of every method call after it completes,
+       whether successfully or not. Hooks only run while instrumentation is enabled.'''
+
+    _post_call_hooks.append(hook)
+
+
+def remove_hook(hook):
+    '''Unregisters a hook previously registered with `add_pre_call_hook` or `add_post_call_hook`.'''
+
+    for hooks in (_pre_call_hooks, _post_call_hooks):
+        if hook in hooks:
+            hooks.remove(hook)
+
+
+def stats():
+    '''Returns the statistics collected so far as a dictionary keyed by interface name and then by
+       method name. The Properties calls are accounted to the interface whose properties they
+       access, as 'GetAll' or as 'Get(<property>)' and 'Set(<property>)'.'''
+
+    result = {}
+    for (interface_name, method_name), method_stats in _method_stats.items():
+        result.setdefault(interface_name, {})[method_name] = method_stats.to_dict()
+
+    return result
+
+
+def prometheus_text(prefix='pymm_dbus'):
+    '''Returns the statistics collected so far in the Prometheus text exposition format.'''
+
+    lines = []
+
+    def family(name, metric_type, help_text):
+        lines.append(f'# HELP {prefix}_{name} {help_text}')
+        lines.append(f'# TYPE {prefix}_{name} {metric_type}')
+
+    def labels(interface_name, method_name, **extra):
+        pairs = [('interface', interface_name), ('method', method_name)] + list(extra.items())
+        return ','.join(f'{key}="{_escape_label(value)}"' for key, value in pairs)
+
+    items = sorted(_method_stats.items())
+
+    family('calls_total', 'counter', 'Number of D-Bus method calls.')
+    for (interface_name, method_name), method_stats in items:
+        lines.append(f'{prefix}_calls_total{{{labels(interface_name, method_name)}}} '
+                     f'{method_stats.calls}')
+
+    family('call_errors_total', 'counter', 'Number of D-Bus method calls which failed.')
+    for (interface_name, method_name), method_stats in items:
+        for error_name, count in sorted(method_stats.errors.items()):
+            lines.append(f'{prefix}_call_errors_total'
+                         f'{{{labels(interface_name, method_name, error=error_name)}}} {count}')
+
+    family('call_duration_seconds', 'histogram', 'Latency of D-Bus method calls.')
+    for (interface_name, method_name), method_stats in items:
+        cumulative = 0
+        for bound, count in zip(LatencyBuckets + (float('inf'), ), method_stats.buckets):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{prefix}_call_duration_seconds_bucket'
+                         f'{{{labels(interface_name, method_name, le=le)}}} {cumulative}')
+        lines.append(f'{prefix}_call_duration_seconds_sum{{{labels(interface_name, method_name)}}} '
+                     f'{method_stats.latency_sum}')
+        lines.append(f'{prefix}_call_duration_seconds_count'
+                     f'{{{labels(interface_name, method_name)}}} {method_stats.calls}')
+
+    family('request_bytes_total', 'counter', 'Estimated marshalled size of the call arguments.')
+    for (interface_name, method_name), method_stats in items:
+        lines.append(f'{prefix}_request_bytes_total{{{labels(interface_name, method_name)}}} '
+                     f'{method_stats.request_bytes}')
+
+    family('reply_bytes_total', 'counter', 'Estimated marshalled size of the replies.')
+    for (interface_name, method_name), method_stats in items:
+        lines.append(f'{prefix}_reply_bytes_total{{{labels(interface_name, method_name)}}} '
+                     f'{method_stats.reply_bytes}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def payload_size(value):
+    '''Estimates the marshalled size in bytes of a D-Bus value, ignoring the alignment padding.'''
+
+    if isinstance(value, (bytes, bytearray)):
+        return 4 + len(value)
+    if isinstance(value, str):
+        # Strings and object paths carry a 32-bit length and a terminating NUL
+        return 5 + len(value.encode('utf-8', 'surrogateescape'))
+    if isinstance(value, bool):
+        return 4
+    if isinstance(value, float):
+        return 8
+    if isinstance(value, int):
+        return 8 if value > 0x7fffffff or value < -0x80000000 else 4
+    if isinstance(value, dict):
+        return 4 + sum(payload_size(key) + payload_size(item) for key, item in value.items())
+    if isinstance(value, tuple):
+        return sum(payload_size(item) for item in value)
+    if isinstance(value, list):
+        return 4 + sum(payload_size(item) for item in value)
+    return 0
+
+
+def instrumented_call(dbus_object, interface_name, method_name, call, args, kwargs):
+    '''Invokes `call(*args, **kwargs)` measuring it and running the hooks. Called by
+       `signatures.call_method` while instrumentation is enabled.'''
+
+    call_info = CallInfo(getattr(dbus_object, 'object_path', None), interface_name, method_name,
+                         args)
+    for hook in tuple(_pre_call_hooks):
+        hook(call_info)
+
+    reply_handler = kwargs.get('reply_handler')
+    error_handler = kwargs.get('error_handler')
+    if reply_handler is not None or error_handler is not None:
+        # Non-blocking call, which completes when either of the handlers is invoked
+
+        def on_reply(*result):
+            _complete(call_info, result=result[0] if len(result) == 1 else result or None)
+            if reply_handler is not None:
+                reply_handler(*result)
+
+        def on_error(error):
+            _complete(call_info, error=error)
+            if error_handler is not None:
+                error_handler(error)
+
+        kwargs = dict(kwargs, reply_handler=on_reply, error_handler=on_error)
+
+    call_info.started_at = time.monotonic()
+    try:
+        result = call(*args, **kwargs)
+    except Exception as e:
+        _complete(call_info, error=e)
+        raise
+
+    if reply_handler is None and error_handler is None:
+        _complete(call_info, result=result)
+
+    return result
+
+
+def _complete(call_info, result=None, error=None):
+    call_info.elapsed = time.monotonic() - call_info.started_at
+    call_info.result = result
+    call_info.error = error
+    if error is None:
+        call_info.reply_size = payload_size(result)
+
+    key = _stats_key(call_info)
+    method_stats = _method_stats.get(key)
+    if method_stats is None:
+        method_stats = _method_stats[key] = MethodStats()
+    method_stats._record(call_info)
+
+    for hook in tuple(_post_call_hooks):
+        hook(call_info)
+
+
+def _stats_key(call_info):
+    # All the property accesses would otherwise be lumped together under the Properties interface
+    args = call_info.args
+    if call_info.interface_name == _PropertiesInterfaceName and args:
+        if call_info.method_name in ('Get', 'Set') and len(args) > 1:
+            return (str(args[0]), f'{call_info.method_name}({args[1]})')
+        return (str(args[0]), call_info.method_name)
+
+    return (call_info.interface_name, call_info.method_name)
+
+
+def _error_name(error):
+    get_dbus_name = getattr(error, 'get_dbus_name', None)
+    error_name = get_dbus_name() if get_dbus_name is not None else None
+    return error_name or type(error).__name__
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,478 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Implementation of the location module, which wraps the Location interface of the modems and turns
+   the location updates they signal into a stream of GNSS fixes. The NMEA traces are parsed
+   incrementally and the fixes of every modem are kept in a fixed-size ring buffer.'''
+
+import calendar
+import math
+import time
+
+from collections import deque
+from enum import IntEnum, unique
+from PyMM.mainloop import run_until
+from PyMM.managed_object import ManagedObject
+from PyMM.properties import PropertyMode
+from PyMM.ring_buffer import ColumnarRingBuffer
+
+
+@unique
+class ModemLocationSource(IntEnum):
+    '''Enumeration which represents the sources of location information of the modem. Corresponds
+       verbatim to the values from https://www.freedesktop.org/software/ModemManager/api/latest/ModemManager-Flags-and-Enumerations.html#MMModemLocationSource.'''
+
+    MM_MODEM_LOCATION_SOURCE_NONE = 0,
+    MM_MODEM_LOCATION_SOURCE_3GPP_LAC_CI = 1 << 0,
+    MM_MODEM_LOCATION_SOURCE_GPS_RAW = 1 << 1,
+    MM_MODEM_LOCATION_SOURCE_GPS_NMEA = 1 << 2,
+    MM_MODEM_LOCATION_SOURCE_CDMA_BS = 1 << 3,
+    MM_MODEM_LOCATION_SOURCE_GPS_UNMANAGED = 1 << 4,
+    MM_MODEM_LOCATION_SOURCE_AGPS_MSA = 1 << 5,
+    MM_MODEM_LOCATION_SOURCE_AGPS_MSB = 1 << 6,
+
+
+_GpsRaw = ModemLocationSource.MM_MODEM_LOCATION_SOURCE_GPS_RAW
+_GpsNmea = ModemLocationSource.MM_MODEM_LOCATION_SOURCE_GPS_NMEA
+
+_KnotsToMetresPerSecond = 1852 / 3600
+
+# Columns of the per-modem history of fixes, after the `time.monotonic()` time at which the fix was
+# received, which keeps the history ordered even if the system clock is set
+FixColumns = [('fix_time', 'd'), ('latitude', 'd'), ('longitude', 'd'), ('altitude', 'f'),
+              ('speed', 'f'), ('course', 'f'), ('hdop', 'f'), ('satellites', 'B'),
+              ('received_at', 'd')]
+
+
+class Fix:
+    '''Single position of a modem. `fix_time` is the UTC time of the fix as a POSIX timestamp (None
+       if the receiver did not report the date), `received_at` the local time at which it was
+       received. `speed` is in metres per second and `course` in degrees. Values which the receiver
+       did not report are NaN (or 0 for `satellites`).'''
+
+    __slots__ = ('modem_path', 'received_at', 'fix_time', 'latitude', 'longitude', 'altitude',
+                 'speed', 'course', 'hdop', 'satellites')
+
+    def __init__(self, modem_path, received_at, fix_time, latitude, longitude, altitude=math.nan,
+                 speed=math.nan, course=math.nan, hdop=math.nan, satellites=0):
+        self.modem_path = modem_path
+        self.received_at = received_at
+        self.fix_time = fix_time
+        self.latitude = latitude
+        self.longitude = longitude
+        self.altitude = altitude
+        self.speed = speed
+        self.course = course
+        self.hdop = hdop
+        self.satellites = satellites
+
+    def __repr__(self):
+        return f'Fix({self.modem_path}, {self.latitude:.6f}, {self.longitude:.6f})'
+
+    @classmethod
+    def from_gps_raw(cls, modem_path, received_at, raw):
+        '''Builds the fix from the dictionary of the GPS_RAW source or returns None if it has no
+           position.'''
+
+        if 'latitude' not in raw or 'longitude' not in raw:
+            return None
+
+        return cls(modem_path, received_at, None, float(raw['latitude']), float(raw['longitude']),
+                   float(raw.get('altitude', math.nan)))
+
+
+###
+### NMEA parsing
+###
+
+
+def _checksum_ok(sentence):
+    body, separator, checksum = sentence[1:].partition('*')
+    if not separator:
+        # The checksum is optional in NMEA 0183
+        return True
+
+    computed = 0
+    for character in body:
+        computed ^= ord(character)
+
+    try:
+        return computed == int(checksum[:2], 16)
+    except ValueError:
+        return False
+
+
+def _coordinate(value, hemisphere):
+    '''Converts a (d)ddmm.mmmm coordinate and its hemisphere to signed decimal degrees.'''
+
+    if not value:
+        return math.nan
+
+    degrees_and_minutes = float(value)
+    degrees = int(degrees_and_minutes // 100)
+    coordinate = degrees + (degrees_and_minutes - degrees * 100) / 60
+    return -coordinate if hemisphere in ('S', 'W') else coordinate
+
+
+def _float(value):
+    return float(value) if value else math.nan
+
+
+class _Gga:
+    __slots__ = ('utc_time', 'latitude', 'longitude', 'quality', 'satellites', 'hdop', 'altitude')
+
+    def __init__(self, fields):
+        self.utc_time = fields[1]
+        self.latitude = _coordinate(fields[2], fields[3])
+        self.longitude = _coordinate(fields[4], fields[5])
+        self.quality = int(fields[6] or 0)
+        self.satellites = int(fields[7] or 0)
+        self.hdop = _float(fields[8])
+        self.altitude = _float(fields[9])
+
+
+class _Rmc:
+    __slots__ = ('utc_time', 'valid', 'latitude', 'longitude', 'speed', 'course', 'fix_time')
+
+    def __init__(self, fields):
+        self.utc_time = fields[1]
+        self.valid = fields[2] == 'A'
+        self.latitude = _coordinate(fields[3], fields[4])
+        self.longitude = _coordinate(fields[5], fields[6])
+        self.speed = _float(fields[7]) * _KnotsToMetresPerSecond
+        self.course = _float(fields[8])
+        self.fix_time = self._timestamp(fields[9], fields[1])
+
+    @staticmethod
+    def _timestamp(date, utc_time):
+        if len(date) != 6 or len(utc_time) < 6:
+            return None
+
+        # Two-digit years from 80 onwards are in the 20th century, as GPS started in 1980
+        year = int(date[4:6])
+        year += 1900 if year >= 80 else 2000
+        seconds = calendar.timegm(
+            (year, int(date[2:4]), int(date[0:2]), int(utc_time[0:2]), int(utc_time[2:4]), 0))
+        return seconds + float(utc_time[4:])
+
+
+class NmeaParser:
+    '''Incremental parser of NMEA 0183 traces, of which only the GGA and RMC sentences are used.
+       ModemManager publishes the latest sentence of every type in each update of the Location
+       property, so a sentence which is identical to the last one seen of its type is skipped
+       without being parsed. Traces can also be fed in arbitrary chunks, in which case an
+       incomplete last sentence is kept until the rest of it arrives.'''
+
+    __slots__ = ('_partial', '_last', '_last_parsed_type', '_gga', '_rmc', 'parsed', 'skipped',
+                 'invalid')
+
+    _Parsers = {'GGA': _Gga, 'RMC': _Rmc}
+
+    def __init__(self):
+        self._partial = ''
+        # Last sentence seen of every type (e.g. 'GGA'), regardless of the talker
+        self._last = {}
+        self._last_parsed_type = None
+        self._gga = None
+        self._rmc = None
+
+        self.parsed = 0
+        self.skipped = 0
+        self.invalid = 0
+
+    def feed(self, data):
+        '''Parses the new sentences in `data` and returns True if the position may have changed.'''
+
+        lines = (self._partial + data).split('\n')
+        self._partial = lines.pop()
+
+        changed = False
+        for line in lines:
+            changed |= self._parse(line.strip())
+
+        return changed
+
+    def fix(self, modem_path, received_at):
+        '''Returns the Fix from the last GGA and RMC sentences or None if neither has a position.
+           The values of the two are only combined if they belong to the same epoch.'''
+
+        gga = self._gga if self._gga is not None and self._gga.quality > 0 else None
+        rmc = self._rmc if self._rmc is not None and self._rmc.valid else None
+        if gga is not None and rmc is not None and gga.utc_time != rmc.utc_time:
+            # Use the newer of the two, which is the one parsed last
+            if self._last_parsed_type == 'GGA':
+                rmc = None
+            else:
+                gga = None
+
+        position = gga or rmc
+        if position is None or math.isnan(position.latitude) or math.isnan(position.longitude):
+            return None
+
+        return Fix(modem_path, received_at, None if rmc is None else rmc.fix_time,
+                   position.latitude, position.longitude, math.nan if gga is None else gga.altitude,
+                   math.nan if rmc is None else rmc.speed, math.nan if rmc is None else rmc.course,
+                   math.nan if gga is None else gga.hdop, 0 if gga is None else gga.satellites)
+
+    def _parse(self, sentence):
+        if len(sentence) < 7 or sentence[0] != '$':
+            return False
+
+        sentence_type = sentence[3:6]
+        parser = self._Parsers.get(sentence_type)
+        if parser is None or self._last.get(sentence_type) == sentence:
+            self.skipped += 1
+            return False
+
+        self._last[sentence_type] = sentence
+
+        if not _checksum_ok(sentence):
+            self.invalid += 1
+            return False
+
+        try:
+            parsed = parser(sentence.partition('*')[0].split(','))
+        except (IndexError, ValueError):
+            self.invalid += 1
+            return False
+
+        self.parsed += 1
+        self._last_parsed_type = sentence_type
+        if sentence_type == 'GGA':
+            self._gga = parsed
+        else:
+            self._rmc = parsed
+
+        return True
+
+
+###
+### D-Bus wrapper
+###
+
+
+class Location(ManagedObject):
+    '''Represents the Location interface of a modem managed by the ModemManager service'''
+
+    __slots__ = ()
+
+    _interface_name = 'org.freedesktop.ModemManager1.Modem.Location'
+
+    @property
+    def Capabilities(self):
+        return self.get_property('Capabilities')
+
+    @property
+    def Enabled(self):
+        return self.get_property('Enabled')
+
+    @property
+    def SignalsLocation(self):
+        return self.get_property('SignalsLocation')
+
+    @property
+    def Location(self):
+        return self.get_property('Location')
+
+    @property
+    def GpsRefreshRate(self):
+        return self.get_property('GpsRefreshRate')
+
+    @property
+    def SuplServer(self):
+        return self.get_property('SuplServer')
+
+    def Setup(self, sources, signal_location, **kwargs):
+        '''Enables the specified ModemLocationSource bitmask (disabling all the other sources) and
+           selects whether the Location property is updated and signalled.'''
+
+        return self._call('Setup', sources, signal_location, **kwargs)
+
+    def GetLocation(self, **kwargs):
+        '''Returns the current location from each enabled source, keyed by ModemLocationSource.'''
+
+        return self._call('GetLocation', **kwargs)
+
+    def SetGpsRefreshRate(self, rate, **kwargs):
+        '''Sets the minimum interval (in seconds) between the GPS location updates, 0 for none.'''
+
+        return self._call('SetGpsRefreshRate', rate, **kwargs)
+
+    def SetSuplServer(self, supl, **kwargs):
+        return self._call('SetSuplServer', supl, **kwargs)
+
+    def InjectAssistanceData(self, data, **kwargs):
+        return self._call('InjectAssistanceData', data, **kwargs)
+
+
+###
+### Streaming
+###
+
+
+class _ModemLocation:
+    __slots__ = ('signal_match', 'parser', 'history', 'latest', 'updates', 'error')
+
+    def __init__(self, signal_match, capacity):
+        self.signal_match = signal_match
+        self.parser = NmeaParser()
+        self.history = ColumnarRingBuffer(capacity, FixColumns)
+        self.latest = None
+        self.updates = 0
+        self.error = None
+
+
+class LocationStream:
+    '''Streams the GNSS fixes of any number of modems. Every modem is set up once to enable
+       `sources` (in addition to the sources which are already enabled) and to signal its location
+       at most every `refresh_rate` seconds. From then on the fixes are driven by the
+       PropertiesChanged signal of the Location property, so no modem is polled. The fixes of every
+       modem are kept in a ColumnarRingBuffer of `capacity` rows and are also queued for the
+       `fixes` generator and passed to the callbacks registered with `connect_fix`.'''
+
+    def __init__(self, sources=_GpsNmea | _GpsRaw, refresh_rate=1, capacity=3600,
+                 queue_length=10000):
+        self._sources = int(sources)
+        self._refresh_rate = refresh_rate
+        self._capacity = capacity
+        self._modems = {}
+        self._queue = deque(maxlen=queue_length)
+        self._callbacks = []
+
+    def attach(self, modem_manager):
+        '''Streams the fixes of all the modems of `modem_manager`, including the modems which appear
+           later.'''
+
+        for modem in modem_manager.managed_modems.values():
+            self.add_modem(modem)
+
+        modem_manager.connect_modem_added(self.add_modem)
+        modem_manager.connect_modem_removed(self.remove_modem)
+
+    def add_modem(self, modem):
+        '''Sets up the location of the modem with non-blocking calls and follows its updates. If the
+           setup fails (e.g. because the modem does not implement the Location interface), the
+           error is kept for `error` and the other modems are not affected.'''
+
+        if modem.path in self._modems:
+            return
+
+        # The DIRECT mode wrapper does not read the properties, so building it does not block
+        location = modem.get_interface(Location, PropertyMode.DIRECT)
+
+        def on_properties_changed(interface_name, changed_properties, invalidated_properties):
+            if 'Location' in changed_properties:
+                self._on_location(modem.path, changed_properties['Location'])
+
+        # Subscribe before the setup so that no update can be missed in between
+        state = _ModemLocation(location.connect_to_properties_changed(on_properties_changed),
+                               self._capacity)
+        self._modems[modem.path] = state
+
+        def on_error(error):
+            state.error = error
+
+        def on_enabled(enabled):
+            location.Setup(
+                int(enabled) | self._sources, True, reply_handler=on_setup, error_handler=on_error)
+
+        def on_setup():
+            if self._sources & (_GpsNmea | _GpsRaw):
+                location.SetGpsRefreshRate(self._refresh_rate, reply_handler=lambda: None,
+                                           error_handler=on_error)
+
+        try:
+            location.get_property_async('Enabled', reply_handler=on_enabled, error_handler=on_error)
+        except Exception as e:
+            on_error(e)
+
+    def remove_modem(self, modem):
+        state = self._modems.pop(modem.path, None)
+        if state is not None:
+            state.signal_match.remove()
+
+    def close(self):
+        '''Stops following the updates. The location sources are left enabled.'''
+
+        for state in self._modems.values():
+            state.signal_match.remove()
+
+        self._modems.clear()
+
+    def connect_fix(self, callback):
+        '''Registers a callback, which will be invoked with every Fix.'''
+
+        self._callbacks.append(callback)
+
+    def history(self, modem_path):
+        '''Returns the ColumnarRingBuffer with the FixColumns history of the modem or None if it is
+           not being followed.'''
+
+        state = self._modems.get(modem_path)
+        return None if state is None else state.history
+
+    def latest(self, modem_path):
+        '''Returns the last Fix of the modem or None if there is none yet.'''
+
+        state = self._modems.get(modem_path)
+        return None if state is None else state.latest
+
+    def error(self, modem_path):
+        '''Returns the error which the setup of the location of the modem failed with, if any.'''
+
+        state = self._modems.get(modem_path)
+        return None if state is None else state.error
+
+    def fixes(self, timeout=None):
+        '''Generator which yields Fix objects as the modems report them, dispatching the GLib main
+           context while there are none. Stops if no fix arrives within `timeout` seconds (waits
+           forever if None).'''
+
+        while True:
+            if not run_until(lambda: len(self._queue) > 0, timeout):
+                return
+
+            yield self._queue.popleft()
+
+    def _on_location(self, modem_path, location):
+        state = self._modems.get(modem_path)
+        if state is None:
+            return
+
+        state.updates += 1
+        timestamp = time.monotonic()
+        received_at = time.time()
+
+        fix = None
+        nmea = location.get(_GpsNmea)
+        # Each update consists of complete sentences, the last of which is not terminated
+        if nmea is not None and state.parser.feed(str(nmea) + '\n'):
+            fix = state.parser.fix(modem_path, received_at)
+
+        raw = location.get(_GpsRaw)
+        if fix is None and nmea is None and raw is not None:
+            fix = Fix.from_gps_raw(modem_path, received_at, raw)
+
+        if fix is None:
+            return
+
+        state.latest = fix
+        state.history.append(timestamp, math.nan if fix.fix_time is None else fix.fix_time,
+                             fix.latitude, fix.longitude, fix.altitude, fix.speed, fix.course,
+                             fix.hdop, fix.satellites, received_at)
+        self._queue.append(fix)
+        for callback in self._callbacks:
+            callback(fix)
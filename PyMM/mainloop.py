@@ -0,0 +1,82 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Implementation of the mainloop module, which contains the selection of the main loop which
+   dispatches D-Bus replies and signals, and helpers for waiting on them by iterating the default
+   GLib main context'''
+
+import time
+
+# Main loop installed as the dbus-python default by `install`, if any
+_installed = None
+
+
+def install(mainloop='glib'):
+    '''Selects the main loop integration of dbus-python for the connections created from now on.
+       With 'glib' the GLib main loop becomes the default (once per process) and signals and
+       asynchronous replies are dispatched by it. With None nothing is installed and only blocking
+       calls can be made, which is the cheapest choice for short-lived scripts. The asyncio front
+       end does not use dbus-python and lives in `PyMM.aio`.'''
+
+    global _installed
+
+    if mainloop is None:
+        return
+    if mainloop == 'asyncio':
+        raise ValueError('The asyncio main loop is supported through PyMM.aio.AsyncModemManager')
+    if mainloop != 'glib':
+        raise ValueError(f'Unknown main loop {mainloop!r}')
+
+    if _installed is None:
+        from dbus.mainloop.glib import DBusGMainLoop
+
+        DBusGMainLoop(set_as_default=True)
+        _installed = mainloop
+
+
+def run_until(predicate, timeout=None):
+    '''Dispatches events from the default GLib main context until `predicate` returns True or
+       `timeout` (in seconds) expires. Returns the last result of `predicate`. Can be called whether
+       or not a GLib main loop is already running.'''
+
+    if predicate():
+        return True
+
+    from gi.repository import GLib
+
+    context = GLib.MainContext.default()
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    # One-shot timer, which guarantees that the blocking iteration below wakes up at the deadline
+    # even if there is no D-Bus traffic at all
+    timer = {'fired': False}
+
+    def on_timer():
+        timer['fired'] = True
+        return False
+
+    timer_id = None if timeout is None else GLib.timeout_add(max(int(timeout * 1000), 1), on_timer)
+
+    try:
+        while not predicate():
+            if deadline is not None and time.monotonic() >= deadline:
+                return predicate()
+            context.iteration(True)
+
+        return True
+    finally:
+        if timer_id is not None and not timer['fired']:
+            GLib.source_remove(timer_id)
@@ -0,0 +1,180 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Implementation of the managed_object module'''
+
+from PyMM.mainloop import run_until
+from PyMM.properties import PropertiesInterfaceName, PropertyCache, PropertyMode, PropertySnapshot
+from PyMM.proxy_pool import ProxyPool
+from PyMM.signatures import call_method
+
+
+class ManagedObject:
+    '''Base class for the PyMM objects which represent a single D-Bus object exported by the
+       ModemManager service. The keyword arguments of the D-Bus methods (`timeout`, `reply_handler`
+       and `error_handler`) are passed verbatim to dbus-python, so every method can also be invoked
+       as a non-blocking pending call.'''
+
+    __slots__ = ('_system_bus', '_path', '_pool', '_object', '_property_mode', '_max_age',
+                 '_property_cache')
+
+    _interface_name = None
+
+    def __init__(self, system_bus, path, property_mode=PropertyMode.DIRECT, properties=None,
+                 max_age=None):
+        '''If `properties` is specified, it is used as the initial content of the property cache
+           instead of calling GetAll. The `max_age` (in seconds) after which the cached properties
+           are re-read from the bus is passed to the PropertyCache. Both are ignored in the DIRECT
+           property mode.'''
+
+        self._system_bus = system_bus
+        self._path = path
+        self._pool = ProxyPool.for_bus(self._system_bus)
+        self._object = self._pool.get_object(self._path)
+        self._property_mode = property_mode
+        self._max_age = max_age
+
+        if self._property_mode == PropertyMode.CACHED:
+            self._property_cache = PropertyCache(self._object, self._interface_name, max_age,
+                                                 properties)
+        elif self._property_mode == PropertyMode.SNAPSHOT:
+            self._property_cache = PropertySnapshot(self._object, self._interface_name, max_age,
+                                                    properties)
+        else:
+            self._property_cache = None
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def property_mode(self):
+        return self._property_mode
+
+    @property
+    def property_cache(self):
+        '''Returns the PropertyCache of this object or None if it is in the DIRECT mode.'''
+
+        return self._property_cache
+
+    @property
+    def properties_age(self):
+        '''Returns the number of seconds since the properties of this object were last loaded in
+           full or None if it is in the DIRECT mode.'''
+
+        return None if self._property_cache is None else self._property_cache.age()
+
+    def refresh(self):
+        '''Reloads all the properties of this object with a single GetAll call. Has no effect in the
+           DIRECT mode, where every read goes to the bus anyway.'''
+
+        if self._property_cache is not None:
+            self._property_cache.refresh()
+
+    def close(self):
+        '''Releases the signal subscriptions held by this object. It remains usable, but its cached
+           properties (if any) are no longer kept current.'''
+
+        if self._property_cache is not None:
+            self._property_cache.close()
+
+    def connect_to_signal(self, signal_name, handler, interface_name=None, **keywords):
+        '''Subscribes `handler` to a signal of this object (by default from its own interface) and
+           returns the signal match, whose `remove` method unsubscribes it.'''
+
+        return self._object.connect_to_signal(signal_name, handler, dbus_interface=interface_name
+                                              or self._interface_name, **keywords)
+
+    def connect_to_properties_changed(self, handler):
+        '''Subscribes `handler` to the PropertiesChanged signal for the interface of this object. It
+           is invoked with the interface name, the changed and the invalidated properties.'''
+
+        return self.connect_to_signal('PropertiesChanged', handler, PropertiesInterfaceName,
+                                      arg0=self._interface_name)
+
+    def wait_for_property(self, property_name, predicate, timeout=None):
+        '''Blocks until `predicate` returns True for the value of the specified property and returns
+           that value. Changes are delivered by the PropertiesChanged signal, so this returns as
+           soon as the transition arrives instead of polling. Raises TimeoutError if `timeout` (in
+           seconds) expires first.'''
+
+        latest = {}
+
+        def on_properties_changed(interface_name, changed_properties, invalidated_properties):
+            if property_name in changed_properties:
+                latest['value'] = changed_properties[property_name]
+
+        # Subscribe before reading the current value so that no transition can be missed. The value
+        # is read from the bus, because a snapshot may be arbitrarily old.
+        signal_match = self.connect_to_properties_changed(on_properties_changed)
+        try:
+            latest.setdefault('value', self._read_property(property_name))
+            if not run_until(lambda: predicate(latest['value']), timeout):
+                raise TimeoutError(
+                    f'Timed out waiting for {property_name} of {self._path}, last value was '
+                    f'{latest["value"]}')
+
+            return latest['value']
+        finally:
+            signal_match.remove()
+
+    def get_decoded_property(self, property_name):
+        '''Returns the value of the property converted into native Python objects (see
+           `PyMM.decoding`), e.g. ModemState for Modem.State or IpConfig for Bearer.Ip4Config.'''
+
+        from PyMM.decoding import PropertyDecoder
+        return PropertyDecoder.for_interface(self._interface_name).decode(
+            property_name, self.get_property(property_name))
+
+    @property
+    def decoded_properties(self):
+        '''Returns all the properties of this object converted into native Python objects. They are
+           read with a single GetAll call, unless they are already cached.'''
+
+        from PyMM.decoding import PropertyDecoder
+        if self._property_cache is not None:
+            properties = self._property_cache.values
+        else:
+            properties = self._call('GetAll', self._interface_name,
+                                    interface_name=PropertiesInterfaceName)
+
+        return PropertyDecoder.for_interface(self._interface_name).decode_all(properties)
+
+    def get_property(self, property_name):
+        if self._property_cache is not None:
+            return self._property_cache.get(property_name)
+
+        return self._read_property(property_name)
+
+    def get_property_async(self, property_name, reply_handler, error_handler, **kwargs):
+        '''Reads the current value of the property from the bus with a non-blocking call, which
+           passes it to `reply_handler` (or the exception to `error_handler`) from the main loop.
+           The cache or snapshot is bypassed. The other keyword arguments (e.g. `timeout`) are
+           passed verbatim to dbus-python.'''
+
+        self._call('Get', self._interface_name, property_name,
+                   interface_name=PropertiesInterfaceName, reply_handler=reply_handler,
+                   error_handler=error_handler, **kwargs)
+
+    def _read_property(self, property_name):
+        '''Reads the current value of the property from the bus, bypassing the cache or snapshot.'''
+
+        return self._call('Get', self._interface_name, property_name,
+                          interface_name=PropertiesInterfaceName)
+
+    def _call(self, method_name, *args, interface_name=None, **kwargs):
+        return call_method(self._object, interface_name or self._interface_name, method_name, *args,
+                           **kwargs)
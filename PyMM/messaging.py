@@ -0,0 +1,472 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Implementation of the messaging module, which wraps the SMS interfaces of the modems and turns
+   the incoming messages into a stream driven by the Messaging.Added signal'''
+
+import dbus
+import time
+
+from collections import deque
+from PyMM.enums import SmsState
+from PyMM.fleet import for_each
+from PyMM.mainloop import run_until
+from PyMM.managed_object import ManagedObject
+from PyMM.properties import PropertiesInterfaceName
+from PyMM.signatures import DictionarySignatures
+from PyMM.sms_message import SmsMessage
+
+
+class Sms(ManagedObject):
+    '''Represents a single SMS managed by a specific Modem'''
+
+    __slots__ = ()
+
+    _interface_name = 'org.freedesktop.ModemManager1.Sms'
+
+    def __str__(self):
+        return f'Sms @ {self._path}'
+
+    def __repr__(self):
+        return f'Sms @ {self._path}'
+
+    @property
+    def State(self):
+        return SmsState(self.get_property('State'))
+
+    @property
+    def Number(self):
+        return self.get_property('Number')
+
+    @property
+    def Text(self):
+        return self.get_property('Text')
+
+    @property
+    def Data(self):
+        return self.get_property('Data')
+
+    @property
+    def Timestamp(self):
+        return self.get_property('Timestamp')
+
+    @property
+    def Storage(self):
+        return self.get_property('Storage')
+
+    @property
+    def MessageReference(self):
+        return self.get_property('MessageReference')
+
+    @property
+    def DeliveryState(self):
+        return self.get_property('DeliveryState')
+
+    def Send(self, **kwargs):
+        return self._call('Send', **kwargs)
+
+    def Store(self, storage=0, **kwargs):
+        return self._call('Store', dbus.UInt32(storage), **kwargs)
+
+
+class Messaging(ManagedObject):
+    '''Represents the messaging interface of a modem managed by the ModemManager service'''
+
+    __slots__ = ()
+
+    _interface_name = 'org.freedesktop.ModemManager1.Modem.Messaging'
+
+    @property
+    def Messages(self):
+        return [self._message(path) for path in self.get_property('Messages')]
+
+    @property
+    def SupportedStorages(self):
+        return self.get_property('SupportedStorages')
+
+    @property
+    def DefaultStorage(self):
+        return self.get_property('DefaultStorage')
+
+    def List(self, **kwargs):
+        return self._call('List', **kwargs)
+
+    def Delete(self, message, **kwargs):
+        '''Deletes the specified Sms, SmsMessage or SMS object path.'''
+
+        path = message if isinstance(message, str) else message.path
+        self._pool.discard(path)
+        return self._call('Delete', path, **kwargs)
+
+    def Create(self, props, **kwargs):
+        '''Creates a new SMS with the specified properties and returns it as an Sms object. If
+           `reply_handler` is specified, it is the one which receives the Sms object.'''
+
+        reply_handler = kwargs.get('reply_handler')
+        if reply_handler is not None:
+            kwargs['reply_handler'] = lambda path: reply_handler(self._message(path))
+            return self._call('Create', props, **kwargs)
+
+        return self._message(self._call('Create', props, **kwargs))
+
+    def SetDefaultStorage(self, storage, **kwargs):
+        return self._call('SetDefaultStorage', dbus.UInt32(storage), **kwargs)
+
+    def list_messages(self, concurrency=None, timeout=None):
+        '''Returns an SmsMessage for every SMS currently known to the modem. The properties of all
+           of them are read with concurrent GetAll calls, one per message.'''
+
+        results = for_each(self.Messages, self._get_all, concurrency, timeout)
+
+        return [
+            SmsMessage(path, self._path, result.value) for path, result in results.items()
+            if result.ok
+        ]
+
+    def delete_messages(self, messages, concurrency=None, timeout=None):
+        '''Deletes all the specified Sms or SmsMessage objects (or SMS object paths) with concurrent
+           calls and returns a dictionary of FleetResult keyed by SMS path.'''
+
+        messages = [
+            self._message(message) if isinstance(message, str) else message for message in messages
+        ]
+        return for_each(messages, lambda message, **kwargs: self.Delete(message, **kwargs),
+                        concurrency, timeout)
+
+    def _get_all(self, message, **kwargs):
+        return message._call('GetAll', Sms._interface_name, interface_name=PropertiesInterfaceName,
+                             **kwargs)
+
+    def _message(self, path):
+        return self._pool.get_wrapper(Sms, path, owner=self._path)
+
+
+class _PendingMessage:
+    __slots__ = ('sms', 'signal_match', 'properties', 'loaded')
+
+    def __init__(self, sms):
+        self.sms = sms
+        self.signal_match = None
+        # Changes which arrive before the GetAll reply are superseded by it
+        self.properties = {}
+        self.loaded = False
+
+
+class MessageIntake:
+    '''Streams the SMS received by any number of modems. Every message announced by the
+       Messaging.Added signal is read with a single non-blocking GetAll call. Multi-part messages
+       which are still being received are completed from their PropertiesChanged signals, so the
+       modems are never polled with List. Received messages are queued for the `messages`
+       generator and passed to the callbacks registered with `connect_message_received`. If
+       `delete_received` is True, every message is deleted from the modem once it has been read,
+       which keeps the storage of the SIM from filling up.'''
+
+    def __init__(self, delete_received=False, queue_length=10000):
+        self._delete_received = delete_received
+        self._queue = deque(maxlen=queue_length)
+        self._modem_matches = {}
+        self._pending = {}
+        self._callbacks = []
+
+    def attach(self, modem_manager, existing=False):
+        '''Streams the messages of all the modems of `modem_manager`, including the modems which
+           appear later. If `existing` is True, the messages which have already been received are
+           streamed as well.'''
+
+        for modem in modem_manager.managed_modems.values():
+            self.add_modem(modem, existing)
+
+        modem_manager.connect_modem_added(lambda modem: self.add_modem(modem, existing))
+        modem_manager.connect_modem_removed(self.remove_modem)
+
+    def add_modem(self, modem, existing=False):
+        if modem.path in self._modem_matches:
+            return
+
+        messaging = modem.messaging_interface
+
+        def on_added(path, received):
+            if received:
+                self._fetch(modem.path, messaging, path)
+
+        self._modem_matches[modem.path] = messaging.connect_to_signal('Added', on_added)
+
+        if existing:
+            for message in messaging.Messages:
+                self._fetch(modem.path, messaging, message.path)
+
+    def remove_modem(self, modem):
+        signal_match = self._modem_matches.pop(modem.path, None)
+        if signal_match is not None:
+            signal_match.remove()
+
+        for path in [path for path, pending in self._pending.items() if pending[0] == modem.path]:
+            self._discard(path)
+
+    def connect_message_received(self, callback):
+        '''Registers a callback, which will be invoked with the SmsMessage of every received
+           message.'''
+
+        self._callbacks.append(callback)
+
+    def messages(self, timeout=None):
+        '''Generator which yields SmsMessage objects as they are received, dispatching the GLib main
+           context while there are none. Stops if no message arrives within `timeout` seconds
+           (waits forever if None).'''
+
+        while True:
+            if not run_until(lambda: len(self._queue) > 0, timeout):
+                return
+
+            yield self._queue.popleft()
+
+    def close(self):
+        for signal_match in self._modem_matches.values():
+            signal_match.remove()
+        for path in list(self._pending):
+            self._discard(path)
+
+        self._modem_matches.clear()
+
+    def _fetch(self, modem_path, messaging, path):
+        if path in self._pending:
+            return
+
+        pending = _PendingMessage(messaging._message(path))
+        self._pending[path] = (modem_path, messaging, pending)
+
+        def on_properties_changed(interface_name, changed_properties, invalidated_properties):
+            pending.properties.update(changed_properties)
+            if pending.loaded:
+                self._check_received(path)
+
+        def on_reply(properties):
+            pending.properties = dict(properties)
+            pending.loaded = True
+            self._check_received(path)
+
+        def on_error(error):
+            # The message was deleted (e.g. by another client) before it could be read
+            self._discard(path)
+
+        # Subscribe before reading the properties so that no change can be missed in between
+        pending.signal_match = pending.sms.connect_to_properties_changed(on_properties_changed)
+        messaging._get_all(pending.sms, reply_handler=on_reply, error_handler=on_error)
+
+    def _check_received(self, path):
+        if path not in self._pending:
+            return
+
+        modem_path, messaging, pending = self._pending[path]
+        state = pending.properties.get('State')
+        if state != SmsState.MM_SMS_STATE_RECEIVED:
+            # Sent, stored and draft messages (e.g. among the existing ones) never become received
+            if state != SmsState.MM_SMS_STATE_RECEIVING:
+                self._discard(path)
+            return
+
+        self._discard(path)
+
+        message = SmsMessage(path, modem_path, pending.properties)
+        self._queue.append(message)
+        for callback in self._callbacks:
+            callback(message)
+
+        if self._delete_received:
+            messaging.Delete(path, reply_handler=lambda: None, error_handler=lambda error: None)
+
+    def _discard(self, path):
+        entry = self._pending.pop(path, None)
+        if entry is None:
+            return
+
+        pending = entry[2]
+        if pending.signal_match is not None:
+            pending.signal_match.remove()
+            pending.signal_match = None
+
+
+_CreateSignatures = DictionarySignatures['org.freedesktop.ModemManager1.Modem.Messaging']['Create']
+
+# dbus-python classes of the basic D-Bus types, keyed by signature
+_DBusTypes = {
+    'b': dbus.Boolean,
+    'y': dbus.Byte,
+    'n': dbus.Int16,
+    'q': dbus.UInt16,
+    'i': dbus.Int32,
+    'u': dbus.UInt32,
+    'x': dbus.Int64,
+    't': dbus.UInt64,
+    'd': dbus.Double,
+    's': dbus.String,
+    'o': dbus.ObjectPath,
+    'ay': dbus.ByteArray,
+}
+
+
+def _typed_dictionary(signatures, values):
+    '''Builds an a{sv} dictionary whose values have the D-Bus types from `signatures` (keyed by
+       dictionary key) rather than the ones dbus-python would guess, e.g. Int32 for every int.
+       Values which already are dbus-python objects or whose key is not listed are kept as they
+       are.'''
+
+    typed = dbus.Dictionary({}, signature='sv')
+    for key, value in values.items():
+        signature = signatures.get(key)
+        if signature in _DBusTypes and type(value) not in _DBusTypes.values():
+            value = _DBusTypes[signature](value)
+        typed[key] = value
+
+    return typed
+
+
+class SendRequest:
+    '''Tracks a single SMS submitted to SendQueue. The `sms_path` is set as soon as the SMS has
+       been created and the `error` if either creating or sending it failed.'''
+
+    __slots__ = ('modem', 'number', 'text', 'properties', 'sms_path', 'error', 'queued_at',
+                 'started_at', 'elapsed', 'callback')
+
+    def __init__(self, modem, number, text, properties, callback):
+        self.modem = modem
+        self.number = number
+        self.text = text
+        self.properties = properties
+        self.sms_path = None
+        self.error = None
+        self.queued_at = time.monotonic()
+        self.started_at = None
+        self.elapsed = None
+        self.callback = callback
+
+    def __repr__(self):
+        outcome = f'error={self.error!r}' if self.error is not None else f'sms={self.sms_path}'
+        return f'SendRequest({self.modem}, to={self.number}, {outcome}, elapsed={self.elapsed})'
+
+    @property
+    def done(self):
+        return self.elapsed is not None
+
+    @property
+    def ok(self):
+        return self.done and self.error is None
+
+
+class SendQueue:
+    '''Sends SMS through any number of modems, keeping at most `max_in_flight` sends in progress per
+       modem and queueing the rest in order. Modems only send one message at a time over the air,
+       so a larger limit mostly queues the messages inside ModemManager instead. Each message is
+       created and sent with non-blocking calls, so the queue only progresses while the main loop
+       is running (see `wait`). If `delete_sent` is True, messages are deleted from the modem once
+       they have been sent.'''
+
+    def __init__(self, max_in_flight=1, timeout=None, delete_sent=False):
+        if max_in_flight < 1:
+            raise ValueError('The number of sends in flight must be at least 1')
+
+        self._max_in_flight = max_in_flight
+        self._timeout = timeout
+        self._delete_sent = delete_sent
+        self._queues = {}
+        self._in_flight = {}
+        # Paths of the modems whose queue is being filled
+        self._filling = set()
+
+    @property
+    def pending(self):
+        '''Number of messages which are either queued or being sent.'''
+
+        return sum(map(len, self._queues.values())) + sum(self._in_flight.values())
+
+    def send(self, modem, number, text, properties=None, callback=None):
+        '''Queues a message to `number` through `modem` and returns its SendRequest. The `callback`
+           is invoked with the SendRequest once it is done. Additional SMS properties (e.g.
+           'validity' or 'delivery-report-request') can be passed in `properties`.'''
+
+        request = SendRequest(modem, number, text, properties, callback)
+        self._queues.setdefault(modem.path, deque()).append(request)
+        self._fill(modem.path)
+        return request
+
+    def wait(self, timeout=None):
+        '''Dispatches the main loop until all the queued messages are done or `timeout` (in seconds)
+           expires. Returns True if they are all done.'''
+
+        return run_until(lambda: self.pending == 0, timeout)
+
+    def _fill(self, modem_path):
+        # A send which fails synchronously completes from within `_start`, so guard against
+        # re-entering the loop below from its completion
+        if modem_path in self._filling:
+            return
+
+        self._filling.add(modem_path)
+        try:
+            queue = self._queues.get(modem_path)
+            while queue and self._in_flight.get(modem_path, 0) < self._max_in_flight:
+                self._in_flight[modem_path] = self._in_flight.get(modem_path, 0) + 1
+                self._start(queue.popleft())
+
+            if not queue:
+                self._queues.pop(modem_path, None)
+        finally:
+            self._filling.discard(modem_path)
+
+    def _start(self, request):
+        request.started_at = time.monotonic()
+        kwargs = {} if self._timeout is None else {'timeout': self._timeout}
+
+        def on_sent():
+            if self._delete_sent:
+                try:
+                    messaging.Delete(request.sms_path, reply_handler=lambda: None,
+                                     error_handler=lambda error: None)
+                except Exception:
+                    pass
+            self._complete(request)
+
+        def on_created(sms):
+            request.sms_path = sms.path
+            try:
+                sms.Send(reply_handler=on_sent, error_handler=on_error, **kwargs)
+            except Exception as e:
+                on_error(e)
+
+        def on_error(error):
+            self._complete(request, error)
+
+        # Runs from main loop callbacks (e.g. io_add_watch), so every error has to complete the
+        # request instead of escaping and leaving it in flight
+        try:
+            messaging = request.modem.messaging_interface
+            props = _typed_dictionary(_CreateSignatures, request.properties or {})
+            props['number'] = dbus.String(request.number)
+            props['text'] = dbus.String(request.text)
+            messaging.Create(props, reply_handler=on_created, error_handler=on_error, **kwargs)
+        except Exception as e:
+            on_error(e)
+
+    def _complete(self, request, error=None):
+        request.error = error
+        request.elapsed = time.monotonic() - request.queued_at
+
+        modem_path = request.modem.path
+        self._in_flight[modem_path] -= 1
+        if request.callback is not None:
+            request.callback(request)
+
+        self._fill(modem_path)
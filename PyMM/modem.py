@@ -19,96 +19,52 @@
 import dbus
 
 from .sim import Sim
-from enum import IntEnum, unique
-from PyMM import ModemManagerBusName
 from PyMM.bearer import Bearer
+from PyMM.enums import ModemAccessTechnology, ModemState
+from PyMM.mainloop import run_until
+from PyMM.managed_object import ManagedObject
+from PyMM.properties import PropertiesInterfaceName, PropertyMode
 
 
-@unique
-class ModemState(IntEnum):
-    '''Enumeration which represents the current initialisation state of the modem. Corresponds
-       verbatim to the values from https://www.freedesktop.org/software/ModemManager/api/latest/gdbus-org.freedesktop.ModemManager1.Modem.html#gdbus-property-org-freedesktop-ModemManager1-Modem.State.'''
-
-    MM_MODEM_STATE_FAILED = -1,
-    MM_MODEM_STATE_UNKNOWN = 0,
-    MM_MODEM_STATE_INITIALIZING = 1,
-    MM_MODEM_STATE_LOCKED = 2,
-    MM_MODEM_STATE_DISABLED = 3,
-    MM_MODEM_STATE_DISABLING = 4,
-    MM_MODEM_STATE_ENABLING = 5,
-    MM_MODEM_STATE_ENABLED = 6,
-    MM_MODEM_STATE_SEARCHING = 7,
-    MM_MODEM_STATE_REGISTERED = 8,
-    MM_MODEM_STATE_DISCONNECTING = 9,
-    MM_MODEM_STATE_CONNECTING = 10,
-    MM_MODEM_STATE_CONNECTED = 11,
-
-
-@unique
-class ModemAccessTechnology(IntEnum):
-    '''Enumeration which represents the access technology supported by the modem. Corresponds
-       verbatim to the values from https://www.freedesktop.org/software/ModemManager/doc/latest/ModemManager/ModemManager-Flags-and-Enumerations.html#MMModemAccessTechnology.'''
-
-    MM_MODEM_ACCESS_TECHNOLOGY_UNKNOWN = 0,
-    MM_MODEM_ACCESS_TECHNOLOGY_POTS = 1 << 0,
-    MM_MODEM_ACCESS_TECHNOLOGY_GSM = 1 << 1,
-    MM_MODEM_ACCESS_TECHNOLOGY_GSM_COMPACT = 1 << 2,
-    MM_MODEM_ACCESS_TECHNOLOGY_GPRS = 1 << 3,
-    MM_MODEM_ACCESS_TECHNOLOGY_EDGE = 1 << 4,
-    MM_MODEM_ACCESS_TECHNOLOGY_UMTS = 1 << 5,
-    MM_MODEM_ACCESS_TECHNOLOGY_HSDPA = 1 << 6,
-    MM_MODEM_ACCESS_TECHNOLOGY_HSUPA = 1 << 7,
-    MM_MODEM_ACCESS_TECHNOLOGY_HSPA = 1 << 8,
-    MM_MODEM_ACCESS_TECHNOLOGY_HSPA_PLUS = 1 << 9,
-    MM_MODEM_ACCESS_TECHNOLOGY_1XRTT = 1 << 10,
-    MM_MODEM_ACCESS_TECHNOLOGY_EVDO0 = 1 << 11,
-    MM_MODEM_ACCESS_TECHNOLOGY_EVDOA = 1 << 12,
-    MM_MODEM_ACCESS_TECHNOLOGY_EVDOB = 1 << 13,
-    MM_MODEM_ACCESS_TECHNOLOGY_LTE = 1 << 14,
-    MM_MODEM_ACCESS_TECHNOLOGY_5GNR = 1 << 15,
-    MM_MODEM_ACCESS_TECHNOLOGY_LTE_CAT_M = 1 << 16,
-    MM_MODEM_ACCESS_TECHNOLOGY_LTE_NB_IOT = 1 << 17,
-    MM_MODEM_ACCESS_TECHNOLOGY_ANY = 0xFFFFFFFF,
-
-
-class ModemSimple:
+class ModemSimple(ManagedObject):
     '''Represents the simple interface for a modem managed by the ModemManager service'''
 
-    _modem_simple_interface_name = 'org.freedesktop.ModemManager1.Modem.Simple'
+    __slots__ = ()
 
-    def __init__(self, system_bus, path):
-        self._system_bus = system_bus
-        self._path = path
-        self._modem_simple_object = self._system_bus.get_object(ModemManagerBusName, self._path)
+    _interface_name = 'org.freedesktop.ModemManager1.Modem.Simple'
 
-    def GetStatus(self):
-        return self._modem_simple_object.GetStatus(dbus_interface=self._modem_simple_interface_name)
+    def GetStatus(self, **kwargs):
+        return self._call('GetStatus', **kwargs)
 
-    def Connect(self, props):
-        return self._modem_simple_object.Connect(props,
-                                                 dbus_interface=self._modem_simple_interface_name)
+    def get_decoded_status(self):
+        '''Returns the reply of GetStatus decoded into a SimpleStatus.'''
 
-    def Disconnect(self):
-        return self._modem_simple_object.Disconnect(
-            '/', dbus_interface=self._modem_simple_interface_name)
+        from PyMM.decoding import decode_simple_status
+        return decode_simple_status(self.GetStatus())
+
+    def Connect(self, props, **kwargs):
+        return self._call('Connect', props, **kwargs)
+
+    def Disconnect(self, **kwargs):
+        return self._call('Disconnect', '/', **kwargs)
         pass
 
 
-class Modem:
+class Modem(ManagedObject):
     '''Represents a single modem managed by the ModemManager service'''
 
-    _modem_interface_name = 'org.freedesktop.ModemManager1.Modem'
+    __slots__ = ('_modem', )
 
-    def __init__(self, system_bus, path, modem):
-        self._system_bus = system_bus
-        self._path = path
+    _interface_name = 'org.freedesktop.ModemManager1.Modem'
 
+    def __init__(self, system_bus, path, modem, property_mode=PropertyMode.DIRECT, max_age=None):
         if type(modem) is dbus.Dictionary:
-            self._modem = modem[self._modem_interface_name]
-            self._modem_object = self._system_bus.get_object(ModemManagerBusName, self._path)
+            self._modem = modem[self._interface_name]
         else:
             raise Exception()
 
+        super().__init__(system_bus, path, property_mode, self._modem, max_age)
+
     def __str__(self):
         return self._path
 
@@ -140,7 +96,12 @@ class Modem:
 
     @property
     def Sim(self):
-        return Sim(self._system_bus, self.get_property('Sim'))
+        return self._child(Sim, self.get_property('Sim'))
+
+    def sim_by_path(self, path):
+        '''Returns the Sim object at the specified path, without reading the Sim property.'''
+
+        return self._child(Sim, path)
 
     @property
     def EquipmentIdentifier(self):
@@ -148,21 +109,86 @@ class Modem:
 
     @property
     def Bearers(self):
-        return list(map(lambda x: Bearer(self._system_bus, x), self.get_property('Bearers')))
+        return list(map(lambda x: self._child(Bearer, x), self.get_property('Bearers')))
+
+    def bearer_by_path(self, path):
+        '''Returns the Bearer object at the specified path, without reading the Bearers property.'''
+
+        return self._child(Bearer, path)
 
     @property
     def Drivers(self):
         return self.get_property('Drivers')
 
-    def Reset(self):
-        return self._modem_object.Reset(dbus_interface=self._modem_interface_name)
+    def Reset(self, **kwargs):
+        return self._call('Reset', **kwargs)
+
+    def Enable(self, enable=True, **kwargs):
+        return self._call('Enable', enable, **kwargs)
+
+    def CreateBearer(self, props, **kwargs):
+        '''Creates a new bearer with the specified properties and returns it as a Bearer object. If
+           `reply_handler` is specified, it is the one which receives the Bearer object.'''
+
+        reply_handler = kwargs.get('reply_handler')
+        if reply_handler is not None:
+            kwargs['reply_handler'] = lambda path: reply_handler(self._child(Bearer, path))
+            return self._call('CreateBearer', props, **kwargs)
+
+        return self._child(Bearer, self._call('CreateBearer', props, **kwargs))
+
+    def DeleteBearer(self, bearer, **kwargs):
+        '''Deletes the specified Bearer object (or bearer path), disconnecting it first if
+           needed.'''
+
+        path = bearer.path if isinstance(bearer, Bearer) else bearer
+        self._pool.discard(path)
+        return self._call('DeleteBearer', path, **kwargs)
+
+    def Command(self, cmd, command_timeout, **kwargs):
+        '''Sends the AT command `cmd` to the modem and returns its response. ModemManager waits up
+           to `command_timeout` seconds for the response, so the D-Bus call timeout defaults to a
+           few seconds more than that. Only allowed if ModemManager runs in debug mode.'''
+
+        kwargs.setdefault('timeout', command_timeout + 5)
+        return self._call('Command', cmd, command_timeout, **kwargs)
+
+    def wait_for_state(self, target, timeout=None):
+        '''Blocks until the modem reaches the `target` ModemState (or any of the states if `target`
+           is a collection) and returns the state reached. Transitions are delivered by the
+           StateChanged signal, so this returns as soon as they arrive instead of polling. Raises
+           TimeoutError if `timeout` (in seconds) expires first and RuntimeError if the modem fails
+           while waiting.'''
 
-    def Enable(self, enable=True):
-        return self._modem_object.Enable(enable, dbus_interface=self._modem_interface_name)
+        targets = {target} if isinstance(target, ModemState) else set(target)
+        target_names = ', '.join(sorted(state.name for state in targets))
+        latest = {}
 
-    def CreateBearer(self, props):
-        print(props)
-        return self._modem_object.CreateBearer(props, dbus_interface=self._modem_interface_name)
+        def on_state_changed(old, new, reason):
+            latest['state'] = ModemState(new)
+
+        # Subscribe before reading the current state so that no transition can be missed. The state
+        # is read from the bus, because a snapshot may be arbitrarily old.
+        signal_match = self.connect_to_signal('StateChanged', on_state_changed)
+        try:
+            latest.setdefault('state', ModemState(self._read_property('State')))
+
+            def reached():
+                if latest['state'] in targets:
+                    return True
+                if latest['state'] == ModemState.MM_MODEM_STATE_FAILED:
+                    raise RuntimeError(
+                        f'Modem {self._path} failed while waiting for {target_names}')
+                return False
+
+            if not run_until(reached, timeout):
+                raise TimeoutError(
+                    f'Timed out waiting for modem {self._path} to reach {target_names}, '
+                    f'last state was {latest["state"].name}')
+
+            return latest['state']
+        finally:
+            signal_match.remove()
 
     @property
     def name(self):
@@ -170,13 +196,51 @@ class Modem:
 
     @property
     def simple_interface(self):
-        return ModemSimple(self._system_bus, self._path)
+        return self._pool.get_wrapper(ModemSimple, self._path)
+
+    @property
+    def signal_interface(self):
+        from PyMM.modem_signal import ModemSignal
+        return self._pool.get_wrapper(ModemSignal, self._path, property_mode=self._property_mode,
+                                      max_age=self._max_age)
+
+    @property
+    def modem_3gpp_interface(self):
+        from PyMM.modem_3gpp import Modem3gpp
+        return self._pool.get_wrapper(Modem3gpp, self._path, property_mode=self._property_mode,
+                                      max_age=self._max_age)
+
+    @property
+    def location_interface(self):
+        from PyMM.location import Location
+        return self._pool.get_wrapper(Location, self._path, property_mode=self._property_mode,
+                                      max_age=self._max_age)
+
+    @property
+    def messaging_interface(self):
+        from PyMM.messaging import Messaging
+        return self._pool.get_wrapper(Messaging, self._path, property_mode=self._property_mode,
+                                      max_age=self._max_age)
+
+    def get_interface(self, cls, property_mode=None):
+        '''Returns the wrapper of the `cls` interface (e.g. Location) of this modem in
+           `property_mode`, or in the property mode of the modem if None. Unlike the other modes,
+           the DIRECT mode does not read the properties, so the wrapper is built without any
+           call.'''
+
+        if property_mode is None:
+            property_mode = self._property_mode
+
+        return self._pool.get_wrapper(cls, self._path, property_mode=property_mode,
+                                      max_age=self._max_age)
 
     @property
     def all_properties(self):
-        return self._modem_object.GetAll(self._modem_interface_name,
-                                         dbus_interface='org.freedesktop.DBus.Properties')
+        if self._property_cache is not None:
+            return self._property_cache.values
+
+        return self._call('GetAll', self._interface_name, interface_name=PropertiesInterfaceName)
 
-    def get_property(self, property_name):
-        return self._modem_object.Get(self._modem_interface_name, property_name,
-                                      dbus_interface='org.freedesktop.DBus.Properties')
+    def _child(self, cls, path):
+        return self._pool.get_wrapper(cls, path, property_mode=self._property_mode,
+                                      max_age=self._max_age, owner=self._path)
@@ -0,0 +1,364 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Implementation of the modem_3gpp module, which wraps the 3GPP interface of the modems and runs
+   network scans without blocking, caching their results per modem'''
+
+import time
+
+from enum import IntEnum, unique
+from PyMM.mainloop import run_until
+from PyMM.managed_object import ManagedObject
+
+# ModemManager scans for several minutes on some modems, which is much longer than the default
+# D-Bus call timeout
+DefaultScanTimeout = 300
+
+
+@unique
+class Modem3gppRegistrationState(IntEnum):
+    '''Enumeration which represents the 3GPP registration state of the modem. Corresponds verbatim
+       to the values from https://www.freedesktop.org/software/ModemManager/api/latest/ModemManager-Flags-and-Enumerations.html#MMModem3gppRegistrationState.'''
+
+    MM_MODEM_3GPP_REGISTRATION_STATE_IDLE = 0,
+    MM_MODEM_3GPP_REGISTRATION_STATE_HOME = 1,
+    MM_MODEM_3GPP_REGISTRATION_STATE_SEARCHING = 2,
+    MM_MODEM_3GPP_REGISTRATION_STATE_DENIED = 3,
+    MM_MODEM_3GPP_REGISTRATION_STATE_UNKNOWN = 4,
+    MM_MODEM_3GPP_REGISTRATION_STATE_ROAMING = 5,
+    MM_MODEM_3GPP_REGISTRATION_STATE_HOME_SMS_ONLY = 6,
+    MM_MODEM_3GPP_REGISTRATION_STATE_ROAMING_SMS_ONLY = 7,
+    MM_MODEM_3GPP_REGISTRATION_STATE_EMERGENCY_ONLY = 8,
+    MM_MODEM_3GPP_REGISTRATION_STATE_HOME_CSFB_NOT_PREFERRED = 9,
+    MM_MODEM_3GPP_REGISTRATION_STATE_ROAMING_CSFB_NOT_PREFERRED = 10,
+    MM_MODEM_3GPP_REGISTRATION_STATE_ATTACHED_RLOS = 11,
+
+
+@unique
+class Modem3gppNetworkAvailability(IntEnum):
+    '''Enumeration which represents the availability of a network found by a scan. Corresponds
+       verbatim to the values from https://www.freedesktop.org/software/ModemManager/api/latest/ModemManager-Flags-and-Enumerations.html#MMModem3gppNetworkAvailability.'''
+
+    MM_MODEM_3GPP_NETWORK_AVAILABILITY_UNKNOWN = 0,
+    MM_MODEM_3GPP_NETWORK_AVAILABILITY_AVAILABLE = 1,
+    MM_MODEM_3GPP_NETWORK_AVAILABILITY_CURRENT = 2,
+    MM_MODEM_3GPP_NETWORK_AVAILABILITY_FORBIDDEN = 3,
+
+
+_Forbidden = Modem3gppNetworkAvailability.MM_MODEM_3GPP_NETWORK_AVAILABILITY_FORBIDDEN
+
+
+class NetworkInfo:
+    '''Single network found by a scan. When the results of several modems are merged, `seen_by`
+       contains the paths of all the modems which found it, `access_technology` the union of the
+       technologies they reported and `status` the most telling of their statuses.'''
+
+    __slots__ = ('operator_code', 'operator_long', 'operator_short', 'status', 'access_technology',
+                 'seen_by', 'scanned_at')
+
+    def __init__(self, operator_code, operator_long, operator_short, status, access_technology,
+                 seen_by, scanned_at):
+        self.operator_code = operator_code
+        self.operator_long = operator_long
+        self.operator_short = operator_short
+        self.status = status
+        # ModemAccessTechnology bitmask
+        self.access_technology = access_technology
+        self.seen_by = seen_by
+        self.scanned_at = scanned_at
+
+    def __repr__(self):
+        return f'NetworkInfo({self.operator_code} {self.operator_long}, {self.status.name})'
+
+    @classmethod
+    def from_scan_result(cls, modem_path, result, scanned_at):
+        return cls(str(result.get('operator-code', '')), str(result.get('operator-long', '')),
+                   str(result.get('operator-short', '')),
+                   Modem3gppNetworkAvailability(result.get('status', 0)),
+                   int(result.get('access-technology', 0)), {modem_path}, scanned_at)
+
+    def _merge(self, other):
+        # A forbidden network stays forbidden, otherwise CURRENT is more telling than AVAILABLE,
+        # which is more telling than UNKNOWN
+        if _Forbidden in (self.status, other.status):
+            self.status = _Forbidden
+        else:
+            self.status = max(self.status, other.status)
+
+        self.operator_long = self.operator_long or other.operator_long
+        self.operator_short = self.operator_short or other.operator_short
+        self.access_technology |= other.access_technology
+        self.seen_by |= other.seen_by
+        self.scanned_at = max(self.scanned_at, other.scanned_at)
+
+
+class ScanFuture:
+    '''Result of a network scan which may still be in progress. The scan progresses while the main
+       loop is running, which `result` does while it waits.'''
+
+    __slots__ = ('_done', '_result', '_error', '_callbacks')
+
+    def __init__(self):
+        self._done = False
+        self._result = None
+        self._error = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done
+
+    def result(self, timeout=None):
+        '''Waits for the scan to complete and returns the list of NetworkInfo it found, or raises
+           the error it failed with. Raises TimeoutError if `timeout` (in seconds) expires first.'''
+
+        if not run_until(self.done, timeout):
+            raise TimeoutError(f'Scan did not complete within {timeout} seconds')
+
+        if self._error is not None:
+            raise self._error
+
+        return self._result
+
+    def exception(self):
+        return self._error
+
+    def add_done_callback(self, callback):
+        '''Registers a callback, which will be invoked with this future once it is done (or
+           immediately if it already is).'''
+
+        if self._done:
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    def _set_result(self, result):
+        self._complete(result, None)
+
+    def _set_error(self, error):
+        self._complete(None, error)
+
+    def _complete(self, result, error):
+        self._result = result
+        self._error = error
+        self._done = True
+
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+class Modem3gpp(ManagedObject):
+    '''Represents the 3GPP interface of a modem managed by the ModemManager service'''
+
+    __slots__ = ()
+
+    _interface_name = 'org.freedesktop.ModemManager1.Modem.Modem3gpp'
+
+    @property
+    def Imei(self):
+        return self.get_property('Imei')
+
+    @property
+    def RegistrationState(self):
+        return Modem3gppRegistrationState(self.get_property('RegistrationState'))
+
+    @property
+    def OperatorCode(self):
+        return self.get_property('OperatorCode')
+
+    @property
+    def OperatorName(self):
+        return self.get_property('OperatorName')
+
+    @property
+    def EnabledFacilityLocks(self):
+        return self.get_property('EnabledFacilityLocks')
+
+    @property
+    def PacketServiceState(self):
+        return self.get_property('PacketServiceState')
+
+    def Register(self, operator_id, **kwargs):
+        '''Registers with the network of the specified operator (MCC/MNC) or lets the modem select
+           one automatically if `operator_id` is empty.'''
+
+        return self._call('Register', operator_id, **kwargs)
+
+    def Scan(self, **kwargs):
+        '''Scans for the available networks. Blocks for as long as the scan takes (which can be
+           minutes), so prefer `scan`, which does not.'''
+
+        kwargs.setdefault('timeout', DefaultScanTimeout)
+        return self._call('Scan', **kwargs)
+
+    def scan(self, timeout=DefaultScanTimeout):
+        '''Starts a scan without blocking and returns a ScanFuture, which resolves to the list of
+           NetworkInfo found.'''
+
+        future = ScanFuture()
+
+        def on_reply(results):
+            scanned_at = time.time()
+            future._set_result([
+                NetworkInfo.from_scan_result(self._path, result, scanned_at) for result in results
+            ])
+
+        try:
+            self.Scan(reply_handler=on_reply, error_handler=future._set_error, timeout=timeout)
+        except Exception as e:
+            future._set_error(e)
+
+        return future
+
+
+class NetworkScanner:
+    '''Caches the results of the network scans of any number of modems for `ttl` seconds, so that
+       operator selection does not make every modem rescan. Concurrent requests to scan the same
+       modem share a single scan and the results of the modems at the same site can be merged into
+       a single view of the networks available there.'''
+
+    def __init__(self, ttl=600, scan_timeout=DefaultScanTimeout):
+        self._ttl = ttl
+        self._scan_timeout = scan_timeout
+        # Time of the scan and the list of NetworkInfo it found, keyed by modem path
+        self._results = {}
+        self._in_flight = {}
+
+    def cached(self, modem, max_age=None):
+        '''Returns the list of NetworkInfo from the last scan of the modem or None if it has not
+           been scanned within `max_age` seconds (the TTL if None).'''
+
+        entry = self._results.get(modem.path)
+        max_age = self._ttl if max_age is None else max_age
+        if entry is None or time.monotonic() - entry[0] > max_age:
+            return None
+
+        return entry[1]
+
+    def invalidate(self, modem=None):
+        '''Drops the cached results of the modem (or of all the modems if None).'''
+
+        if modem is None:
+            self._results.clear()
+        else:
+            self._results.pop(modem.path, None)
+
+    def scan(self, modem, max_age=None):
+        '''Returns a ScanFuture for the networks visible to the modem, which is already resolved
+           if they were scanned within `max_age` seconds (the TTL if None). Otherwise a scan is
+           started, unless one is already in progress for the modem, whose future is returned.'''
+
+        cached = self.cached(modem, max_age)
+        if cached is not None:
+            future = ScanFuture()
+            future._set_result(cached)
+            return future
+
+        future = self._in_flight.get(modem.path)
+        if future is not None:
+            return future
+
+        future = modem.modem_3gpp_interface.scan(self._scan_timeout)
+        self._in_flight[modem.path] = future
+
+        def on_done(future):
+            self._in_flight.pop(modem.path, None)
+            if future.exception() is None:
+                self._results[modem.path] = (time.monotonic(), future.result())
+
+        future.add_done_callback(on_done)
+        return future
+
+    def scan_site(self, modems, max_age=None, scanners=1):
+        '''Returns a ScanFuture for the networks available at a site served by the specified
+           modems, merged with `merge`. If any of the modems was scanned within `max_age` seconds
+           (the TTL if None), only the cached results are used. Otherwise up to `scanners` modems
+           (the ones listed first) are scanned and the rest are left alone.'''
+
+        modems = list(modems)
+        site_future = ScanFuture()
+
+        if any(self.cached(modem, max_age) is not None for modem in modems):
+            site_future._set_result(self.merge(modems, max_age))
+            return site_future
+
+        futures = [self.scan(modem, max_age) for modem in modems[:scanners]]
+        if not futures:
+            site_future._set_result([])
+            return site_future
+
+        def on_done(future):
+            if site_future.done() or not all(future.done() for future in futures):
+                return
+
+            errors = [future.exception() for future in futures if future.exception() is not None]
+            if len(errors) == len(futures):
+                site_future._set_error(errors[0])
+            else:
+                site_future._set_result(self.merge(modems, max_age))
+
+        for future in futures:
+            future.add_done_callback(on_done)
+
+        return site_future
+
+    def merge(self, modems, max_age=None):
+        '''Merges the cached results of the specified modems which are not older than `max_age`
+           seconds (the TTL if None) into one NetworkInfo per operator code.'''
+
+        merged = {}
+        for modem in modems:
+            for network in self.cached(modem, max_age) or ():
+                existing = merged.get(network.operator_code)
+                if existing is None:
+                    merged[network.operator_code] = NetworkInfo(
+                        network.operator_code, network.operator_long,
+                        network.operator_short, network.status, network.access_technology,
+                        set(network.seen_by), network.scanned_at)
+                else:
+                    existing._merge(network)
+
+        return list(merged.values())
+
+    def register(self, modem, operator_id, site=None, max_age=None, **kwargs):
+        '''Registers the modem with the network of `operator_id` (or in automatic mode if it is
+           empty). If the cached scans of the `site` modems (or of the modem itself if None) show
+           that network as forbidden or do not show it at all, raises LookupError instead of sending
+           a registration which would fail. The keyword arguments are passed to
+           Modem3gpp.Register.'''
+
+        # An empty operator leaves the choice of the network to the modem
+        networks = self.merge(site or [modem], max_age) if operator_id else None
+        if networks:
+            network = next(
+                (network for network in networks if network.operator_code == operator_id), None)
+            if network is None:
+                raise LookupError(f'Network {operator_id} was not found by the last scan')
+            if network.status == _Forbidden:
+                raise LookupError(f'Network {operator_id} is forbidden')
+
+        return modem.modem_3gpp_interface.Register(operator_id, **kwargs)
+
+    def select_operator(self, modems, preferred, max_age=None):
+        '''Returns the first of the `preferred` operator codes which the cached scans of the modems
+           show as available (or current) or None if there is none.'''
+
+        usable = {
+            network.operator_code
+            for network in self.merge(modems, max_age) if network.status != _Forbidden
+        }
+
+        return next((operator_id for operator_id in preferred if operator_id in usable), None)
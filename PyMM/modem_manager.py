@@ -18,19 +18,66 @@
 
 import dbus
 
+from .fleet import for_each
 from .modem import Modem
-from PyMM import ModemManagerBusName
+from PyMM import ModemManagerBusName, mainloop as _mainloop
+from PyMM.properties import PropertiesInterfaceName, PropertyMode
+from PyMM.proxy_pool import ProxyPool
+from PyMM.shared_bus import SharedBus
+from PyMM.signatures import call_method
 
 
 class ModemManager:
-    '''Represents the top-level ModemManager D-Bus service'''
+    '''Represents the top-level ModemManager D-Bus service. The set of managed modems is loaded once
+       and is then kept current from the InterfacesAdded/InterfacesRemoved signals of the
+       ObjectManager, which are only delivered while the main loop is running.'''
 
     _modem_manager_interface_name = 'org.freedesktop.ModemManager1'
+    _object_manager_interface_name = 'org.freedesktop.DBus.ObjectManager'
 
-    def __init__(self):
-        self._system_bus = dbus.SystemBus()
-        self._modem_manager_object = self._system_bus.get_object(ModemManagerBusName,
-                                                                 '/org/freedesktop/ModemManager1')
+    def __init__(self, property_mode=PropertyMode.DIRECT, bus=None, mainloop='glib',
+                 bus_address=None, max_age=None):
+        '''The `property_mode` selects how the properties of the modems (and their SIMs and bearers)
+           returned by this object are read. See PropertyMode for the available choices. In the
+           CACHED and SNAPSHOT modes, `max_age` (in seconds) bounds how old a cached property can be
+           before it is re-read from the bus, see PropertyCache. The connection on which to talk to
+           ModemManager is either an existing connection `bus`, or one opened to `bus_address` or,
+           if neither is specified, to the system bus. All the ModemManager objects on the same bus
+           share the connection, see `PyMM.shared_bus`. The `mainloop` selects the main loop
+           integration, see `PyMM.mainloop.install`. With None, no signals are subscribed to, so
+           `subscribe` is unavailable, restarts of ModemManager are not followed and the set of
+           modems is only refreshed by `reload_modems`.'''
+
+        _mainloop.install(mainloop)
+
+        self._property_mode = property_mode
+        self._max_age = max_age
+        self._signals = mainloop is not None
+        self._shared_bus = SharedBus.acquire(bus, bus_address, watch=self._signals)
+
+        self._modems = {}
+        self._modems_by_equipment_identifier = {}
+        # EquipmentIdentifier under which each modem is indexed and its PropertiesChanged match,
+        # both keyed by modem path
+        self._equipment_identifiers = {}
+        self._modem_signal_matches = {}
+        self._modem_added_callbacks = []
+        self._modem_removed_callbacks = []
+        self._subscriptions = []
+        self._signal_matches = []
+
+        # Subscribe before the initial load so that no hot-plug event can be missed in between
+        self._bind(self._shared_bus.connection)
+        self._shared_bus.connect_reconnected(self._on_reconnected)
+        self._shared_bus.connect_service_restarted(self._on_service_restarted)
+
+        self.reload_modems()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def __str__(self):
         return f'ModemManager'
@@ -38,25 +85,241 @@ class ModemManager:
     def __repr__(self):
         return f'ModemManager'
 
+    @property
+    def bus(self):
+        '''Returns the bus connection on which this object talks to ModemManager.'''
+
+        return self._system_bus
+
     @property
     def Version(self):
         return self.get_property('Version')
 
     @property
     def all_properties(self):
-        return self._modem_manager_object.GetAll(self._modem_manager_interface_name,
-                                                 dbus_interface='org.freedesktop.DBus.Properties')
+        return call_method(self._modem_manager_object, PropertiesInterfaceName, 'GetAll',
+                           self._modem_manager_interface_name)
 
     @property
     def managed_modems(self):
         '''Returns a dictionary of the modems that are managed by this object.'''
 
-        managed_objects = self._modem_manager_object.GetManagedObjects(
-            dbus_interface='org.freedesktop.DBus.ObjectManager')
+        return dict(self._modems)
+
+    def modem_by_path(self, path):
+        '''Returns the modem with the specified object path or None if there is no such modem.'''
+
+        return self._modems.get(path)
+
+    def modem_by_equipment_identifier(self, equipment_identifier):
+        '''Returns the modem with the specified EquipmentIdentifier (IMEI, ESN or MEID) or None if
+           there is no such modem.'''
+
+        return self._modems_by_equipment_identifier.get(equipment_identifier)
+
+    def connect_modem_added(self, callback):
+        '''Registers a callback, which will be invoked with the Modem object every time a new modem
+           appears on the bus.'''
+
+        self._modem_added_callbacks.append(callback)
+
+    def connect_modem_removed(self, callback):
+        '''Registers a callback, which will be invoked with the Modem object every time a modem
+           disappears from the bus.'''
+
+        self._modem_removed_callbacks.append(callback)
+
+    def subscribe(self, filter, callback, coalesce_ms=100):
+        '''Registers `callback` for the property changes of all the ModemManager objects (modems,
+           SIMs, bearers etc.) which are accepted by `filter`, a ChangeFilter or None for all of
+           them. Changes are merged per object path and delivered at most once every `coalesce_ms`
+           milliseconds, so a burst of updates during registration results in a single call. Returns
+           a Subscription, whose `cancel` method unsubscribes it. See `PyMM.subscription`.'''
+
+        if not self._signals:
+            raise RuntimeError('Subscriptions require a main loop')
+
+        subscription = self._shared_bus.change_dispatcher.subscribe(filter, callback, coalesce_ms)
+        self._subscriptions.append(subscription)
+        return subscription
+
+    def for_each(self, modems, op, concurrency=None, timeout=None):
+        '''Runs `op` concurrently against the specified modems (or all managed modems if None) and
+           returns a dictionary of FleetResult keyed by modem path. See `PyMM.fleet.for_each`.'''
+
+        if modems is None:
+            modems = self._modems.values()
+
+        return for_each(modems, op, concurrency, timeout)
+
+    def bring_up(self, modems=None, timeout=None, **kwargs):
+        '''Takes the specified modems (or all managed modems if None) through unlock, enable,
+           register and connect and returns a dictionary of BringUpResult keyed by modem path. The
+           keyword arguments are passed to `PyMM.bringup.BringUp`.'''
+
+        if modems is None:
+            modems = self._modems.values()
+
+        from PyMM.bringup import BringUp
+
+        return BringUp(modems, **kwargs).run(timeout)
+
+    def reload_modems(self):
+        '''Reconciles the set of managed modems (and their EquipmentIdentifier) with a single
+           GetManagedObjects call. Only needed if hot-plug signals could not be delivered, because
+           the main loop was not running.'''
+
+        managed_objects = call_method(self._modem_manager_object,
+                                      self._object_manager_interface_name, 'GetManagedObjects')
+
+        for path in list(self._modems):
+            if path not in managed_objects:
+                self._remove_modem(path)
+
+        for path, interfaces_and_properties in managed_objects.items():
+            if Modem._interface_name not in interfaces_and_properties:
+                continue
 
-        return dict(
-            map(lambda x: (x[0], Modem(self._system_bus, x[0], x[1])), managed_objects.items()))
+            if path in self._modems:
+                self._index_equipment_identifier(
+                    path,
+                    interfaces_and_properties[Modem._interface_name].get('EquipmentIdentifier'))
+            else:
+                self._add_modem(path, interfaces_and_properties)
+
+    def close(self):
+        '''Removes the signal matches and cancels the change subscriptions of this object and gives
+           back its reference to the shared connection. The modems which it returned must not be
+           used afterwards.'''
+
+        if self._shared_bus is None:
+            return
+
+        for signal_match in self._signal_matches:
+            signal_match.remove()
+        self._signal_matches = []
+
+        for subscription in self._subscriptions:
+            subscription.cancel()
+        self._subscriptions = []
+
+        self._shared_bus.remove_callback(self._on_reconnected)
+        self._shared_bus.remove_callback(self._on_service_restarted)
+        self._shared_bus.release()
+        self._shared_bus = None
+
+        for signal_match in self._modem_signal_matches.values():
+            signal_match.remove()
+        self._modem_signal_matches.clear()
+
+        self._modems.clear()
+        self._modems_by_equipment_identifier.clear()
+        self._equipment_identifiers.clear()
 
     def get_property(self, property_name):
-        return self._modem_manager_object.Get(self._modem_manager_interface_name, property_name,
-                                              dbus_interface='org.freedesktop.DBus.Properties')
+        return call_method(self._modem_manager_object, PropertiesInterfaceName, 'Get',
+                           self._modem_manager_interface_name, property_name)
+
+    def _bind(self, bus):
+        self._system_bus = bus
+        self._proxy_pool = ProxyPool.for_bus(bus)
+        self._modem_manager_object = self._proxy_pool.get_object('/org/freedesktop/ModemManager1')
+
+        if not self._signals:
+            return
+
+        # Matched on the well-known name rather than through the proxy, which is bound to the unique
+        # name of the current owner, so that the subscriptions survive a restart of ModemManager
+        self._signal_matches = [
+            bus.add_signal_receiver(handler, signal_name, self._object_manager_interface_name,
+                                    ModemManagerBusName, '/org/freedesktop/ModemManager1')
+            for signal_name, handler in (('InterfacesAdded', self._on_interfaces_added),
+                                         ('InterfacesRemoved', self._on_interfaces_removed))
+        ]
+
+    def _rebuild(self, reload=True):
+        for path in list(self._modems):
+            self._remove_modem(path)
+
+        if not reload:
+            return
+
+        self._modem_manager_object = self._proxy_pool.get_object('/org/freedesktop/ModemManager1')
+        try:
+            self.reload_modems()
+        except dbus.exceptions.DBusException:
+            # ModemManager is not running (yet), the modems are loaded when its name is owned again
+            pass
+
+    def _on_reconnected(self, bus):
+        self._bind(bus)
+        self._rebuild()
+
+    def _on_service_restarted(self, name_owner):
+        # While the name has no owner there is nothing to load
+        self._rebuild(reload=bool(name_owner))
+
+    def _add_modem(self, path, interfaces_and_properties):
+        modem = self._proxy_pool.get_wrapper(Modem, path, interfaces_and_properties,
+                                             property_mode=self._property_mode,
+                                             max_age=self._max_age)
+
+        self._modems[path] = modem
+        self._index_equipment_identifier(
+            path, interfaces_and_properties[Modem._interface_name].get('EquipmentIdentifier'))
+
+        # Modems which are still initialising when they appear report an empty EquipmentIdentifier
+        # and only announce the real one later
+        if self._signals:
+
+            def on_properties_changed(interface_name, changed_properties, invalidated_properties):
+                if 'EquipmentIdentifier' in changed_properties:
+                    self._index_equipment_identifier(path,
+                                                     changed_properties['EquipmentIdentifier'])
+
+            self._modem_signal_matches[path] = modem.connect_to_properties_changed(
+                on_properties_changed)
+
+        for callback in self._modem_added_callbacks:
+            callback(modem)
+
+    def _remove_modem(self, path):
+        self._index_equipment_identifier(path, None)
+        modem = self._modems.pop(path)
+
+        signal_match = self._modem_signal_matches.pop(path, None)
+        if signal_match is not None:
+            try:
+                signal_match.remove()
+            except dbus.exceptions.DBusException:
+                # The connection on which it was added is already gone after a reconnect
+                pass
+
+        self._proxy_pool.discard(path)
+
+        for callback in self._modem_removed_callbacks:
+            callback(modem)
+
+    def _index_equipment_identifier(self, path, equipment_identifier):
+        previous = self._equipment_identifiers.pop(path, None)
+        if (previous is not None
+                and self._modems_by_equipment_identifier.get(previous) is self._modems.get(path)):
+            del self._modems_by_equipment_identifier[previous]
+
+        if equipment_identifier and path in self._modems:
+            self._equipment_identifiers[path] = equipment_identifier
+            self._modems_by_equipment_identifier[equipment_identifier] = self._modems[path]
+
+    def _on_interfaces_added(self, path, interfaces_and_properties):
+        if Modem._interface_name not in interfaces_and_properties:
+            return
+
+        # The modem interface re-appearing on a known path means the modem was re-probed
+        if path in self._modems:
+            self._remove_modem(path)
+
+        self._add_modem(path, interfaces_and_properties)
+
+    def _on_interfaces_removed(self, path, interfaces):
+        if Modem._interface_name in interfaces and path in self._modems:
+            self._remove_modem(path)
@@ -0,0 +1,209 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Implementation of the modem_signal module, which wraps the extended signal quality interface of
+   the modems and samples it into per-modem ring buffers'''
+
+import time
+
+from PyMM.managed_object import ManagedObject
+from PyMM.modem import ModemAccessTechnology
+from PyMM.ring_buffer import ColumnarRingBuffer, aggregate
+
+_NaN = float('nan')
+
+
+class ModemSignal(ManagedObject):
+    '''Represents the extended signal quality interface of a modem managed by the ModemManager
+       service'''
+
+    __slots__ = ()
+
+    _interface_name = 'org.freedesktop.ModemManager1.Modem.Signal'
+
+    @property
+    def Rate(self):
+        return self.get_property('Rate')
+
+    @property
+    def Cdma(self):
+        return self.get_property('Cdma')
+
+    @property
+    def Evdo(self):
+        return self.get_property('Evdo')
+
+    @property
+    def Gsm(self):
+        return self.get_property('Gsm')
+
+    @property
+    def Umts(self):
+        return self.get_property('Umts')
+
+    @property
+    def Lte(self):
+        return self.get_property('Lte')
+
+    @property
+    def Nr5g(self):
+        return self.get_property('Nr5g')
+
+    def Setup(self, rate, **kwargs):
+        return self._call('Setup', rate, **kwargs)
+
+    def SetupThresholds(self, settings, **kwargs):
+        return self._call('SetupThresholds', settings, **kwargs)
+
+
+class SignalSampler:
+    '''Records the RSSI, RSRP, RSRQ and SINR (the SNR for LTE and 5GNR) reported by the
+       Modem.Signal interface of many modems. The modems are asked to refresh their measurements
+       every `rate` seconds and every refresh is delivered by PropertiesChanged, so no polling is
+       involved. Samples are stored per modem and access technology in ColumnarRingBuffer
+       instances of `capacity` rows each, which are only allocated for the technologies actually
+       reported by a modem. Their timestamps come from `time.monotonic()`, so that they never go
+       backwards when the system clock is set, and the wall-clock time of every sample is kept in
+       the 'wall_time' column.'''
+
+    # Maps the properties of the Signal interface to the access technology which they describe
+    _technologies = {
+        'Cdma': ModemAccessTechnology.MM_MODEM_ACCESS_TECHNOLOGY_1XRTT,
+        'Evdo': ModemAccessTechnology.MM_MODEM_ACCESS_TECHNOLOGY_EVDO0,
+        'Gsm': ModemAccessTechnology.MM_MODEM_ACCESS_TECHNOLOGY_GSM,
+        'Umts': ModemAccessTechnology.MM_MODEM_ACCESS_TECHNOLOGY_UMTS,
+        'Lte': ModemAccessTechnology.MM_MODEM_ACCESS_TECHNOLOGY_LTE,
+        'Nr5g': ModemAccessTechnology.MM_MODEM_ACCESS_TECHNOLOGY_5GNR,
+    }
+
+    metrics = ('rssi', 'rsrp', 'rsrq', 'sinr')
+
+    def __init__(self, capacity=3600, rate=1):
+        self._capacity = capacity
+        self._rate = rate
+        self._columns = [(metric, 'f') for metric in self.metrics] + [('wall_time', 'd')]
+
+        self._buffers = {}
+        self._signal_matches = {}
+        self._errors = {}
+
+    def attach(self, modem_manager):
+        '''Samples all the modems of `modem_manager`, including the ones which appear later.'''
+
+        for modem in modem_manager.managed_modems.values():
+            self.add_modem(modem)
+
+        modem_manager.connect_modem_added(self.add_modem)
+        modem_manager.connect_modem_removed(lambda modem: self.remove_modem(modem, False))
+
+    def add_modem(self, modem):
+        '''Samples the modem, which is set up with a non-blocking call. If it fails (e.g. because
+           the modem does not implement the Signal interface), the error is kept for `error` and the
+           other modems are not affected.'''
+
+        if modem.path in self._signal_matches:
+            return
+
+        self._errors.pop(modem.path, None)
+
+        def on_error(error):
+            self._errors[modem.path] = error
+
+        try:
+            modem_signal = modem.signal_interface
+            self._signal_matches[modem.path] = modem_signal.connect_to_properties_changed(
+                lambda interface_name, changed, invalidated: self._record(modem.path, changed))
+            self._buffers.setdefault(modem.path, {})
+
+            modem_signal.Setup(self._rate, reply_handler=lambda: None, error_handler=on_error)
+        except Exception as e:
+            on_error(e)
+
+    def remove_modem(self, modem, disable=True):
+        '''Stops sampling the modem and drops its history. If `disable` is True, the modem is also
+           asked to stop refreshing its extended signal information.'''
+
+        signal_match = self._signal_matches.pop(modem.path, None)
+        if signal_match is None:
+            return
+
+        signal_match.remove()
+        self._buffers.pop(modem.path, None)
+        if disable:
+            modem.signal_interface.Setup(0, reply_handler=lambda: None,
+                                         error_handler=lambda error: None)
+
+    def close(self):
+        for signal_match in self._signal_matches.values():
+            signal_match.remove()
+
+        self._signal_matches.clear()
+
+    @property
+    def nbytes(self):
+        return sum(buffer.nbytes for buffers in self._buffers.values()
+                   for buffer in buffers.values())
+
+    def error(self, modem_path):
+        '''Returns the error which the setup of the modem failed with, if any.'''
+
+        return self._errors.get(modem_path)
+
+    def technologies(self, modem_path):
+        '''Returns the access technologies for which the modem has reported any samples.'''
+
+        return list(self._buffers.get(modem_path, {}))
+
+    def buffer(self, modem_path, access_technology):
+        '''Returns the ColumnarRingBuffer with the samples of the modem for the specified
+           ModemAccessTechnology or None if there are none.'''
+
+        return self._buffers.get(modem_path, {}).get(access_technology)
+
+    def statistics(self, modem_path, access_technology, metric, window=None,
+                   percentiles=(50, 90, 99)):
+        '''Computes the aggregates of `metric` (one of `metrics`) for the modem and access
+           technology over the last `window` seconds (or the entire history if None).'''
+
+        buffer = self.buffer(modem_path, access_technology)
+        if buffer is None:
+            return {'count': 0}
+
+        since = None if window is None else time.monotonic() - window
+        return aggregate(buffer.column(metric, since=since), percentiles)
+
+    def _record(self, modem_path, changed_properties):
+        buffers = self._buffers.get(modem_path)
+        if buffers is None:
+            return
+
+        timestamp = time.monotonic()
+        wall_time = time.time()
+        for property_name, access_technology in self._technologies.items():
+            values = changed_properties.get(property_name)
+            if not values:
+                continue
+
+            buffer = buffers.get(access_technology)
+            if buffer is None:
+                buffer = ColumnarRingBuffer(self._capacity, self._columns)
+                buffers[access_technology] = buffer
+
+            # EVDO reports the signal to interference plus noise ratio as 'sinr', while LTE and 5GNR
+            # report the signal to noise ratio as 'snr'
+            sinr = values.get('sinr' if property_name == 'Evdo' else 'snr', _NaN)
+            buffer.append(timestamp, values.get('rssi', _NaN), values.get('rsrp', _NaN),
+                          values.get('rsrq', _NaN), sinr, wall_time)
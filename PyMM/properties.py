@@ -0,0 +1,170 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Implementation of the properties module'''
+
+import time
+
+from enum import IntEnum, unique
+from PyMM.signatures import call_method
+
+PropertiesInterfaceName = 'org.freedesktop.DBus.Properties'
+
+
+@unique
+class PropertyMode(IntEnum):
+    '''Enumeration which selects how the PyMM objects read the D-Bus properties of the ModemManager
+       object which they represent.'''
+
+    # Every property read is a blocking org.freedesktop.DBus.Properties.Get call
+    DIRECT = 0,
+    # All properties are loaded with a single GetAll call and are then kept current from the
+    # PropertiesChanged signal
+    CACHED = 1,
+    # Properties are served from the last snapshot of the object, which is either the payload of
+    # the GetManagedObjects call which discovered it or the result of an explicit refresh
+    SNAPSHOT = 2,
+
+
+class PropertyCache:
+    '''Local copy of the properties of a single interface of a ModemManager object. It is populated
+       with one GetAll call and is kept current from the PropertiesChanged signal, so reads are
+       served from memory. Signals are only delivered while the main loop is running, which is why
+       the age of the entries is exposed and they can be invalidated or reloaded explicitly.'''
+
+    __slots__ = ('_dbus_object', '_interface_name', '_max_age', '_values', '_updated_at',
+                 '_refreshed_at', '_signal_match')
+
+    def __init__(self, dbus_object, interface_name, max_age=None, properties=None):
+        '''If `max_age` (in seconds) is specified, entries which have not been updated for longer
+           than that are considered stale and are re-read from the bus on the next access. If
+           `properties` is specified, the cache is populated from it instead of calling GetAll.'''
+
+        self._dbus_object = dbus_object
+        self._interface_name = interface_name
+        self._max_age = max_age
+
+        self._values = {}
+        self._updated_at = {}
+        self._refreshed_at = None
+
+        self._signal_match = self._subscribe()
+
+        if properties is None:
+            self.refresh()
+        else:
+            self._load(properties)
+
+    def __contains__(self, property_name):
+        return property_name in self._values
+
+    @property
+    def values(self):
+        '''Returns a copy of all the currently cached properties.'''
+
+        return dict(self._values)
+
+    def get(self, property_name):
+        '''Returns the cached value of the property, reading it from the bus only if it has been
+           invalidated or has become stale.'''
+
+        if property_name not in self._values or self.is_stale(property_name):
+            self._store(
+                property_name,
+                call_method(self._dbus_object, PropertiesInterfaceName, 'Get', self._interface_name,
+                            property_name))
+
+        return self._values[property_name]
+
+    def refresh(self):
+        '''Reloads all the properties of the interface with a single GetAll call.'''
+
+        self._load(
+            call_method(self._dbus_object, PropertiesInterfaceName, 'GetAll', self._interface_name))
+
+    def invalidate(self, property_name=None):
+        '''Drops the specified property (or all properties if None) from the cache, so that the next
+           read goes to the bus.'''
+
+        if property_name is None:
+            self._values.clear()
+            self._updated_at.clear()
+        else:
+            self._values.pop(property_name, None)
+            self._updated_at.pop(property_name, None)
+
+    def age(self, property_name=None):
+        '''Returns the number of seconds since the specified property (or the entire cache if None)
+           was last updated or None if it is not currently cached.'''
+
+        updated_at = self._refreshed_at if property_name is None else self._updated_at.get(
+            property_name)
+
+        return None if updated_at is None else time.monotonic() - updated_at
+
+    def is_stale(self, property_name):
+        if self._max_age is None:
+            return False
+
+        age = self.age(property_name)
+        return age is None or age > self._max_age
+
+    def close(self):
+        '''Stops listening for property changes. The cached values remain readable, but are no
+           longer kept current.'''
+
+        if self._signal_match is not None:
+            self._signal_match.remove()
+            self._signal_match = None
+
+    def _subscribe(self):
+        return self._dbus_object.connect_to_signal('PropertiesChanged', self._on_properties_changed,
+                                                   dbus_interface=PropertiesInterfaceName,
+                                                   arg0=self._interface_name)
+
+    def _load(self, properties):
+        self._values.clear()
+        self._updated_at.clear()
+        for property_name, value in properties.items():
+            self._store(property_name, value)
+
+        self._refreshed_at = time.monotonic()
+
+    def _store(self, property_name, value):
+        self._values[property_name] = value
+        self._updated_at[property_name] = time.monotonic()
+
+    def _on_properties_changed(self, interface_name, changed_properties, invalidated_properties):
+        if interface_name != self._interface_name:
+            return
+
+        for property_name, value in changed_properties.items():
+            self._store(property_name, value)
+
+        for property_name in invalidated_properties:
+            self.invalidate(property_name)
+
+
+class PropertySnapshot(PropertyCache):
+    '''Point-in-time copy of the properties of a single interface of a ModemManager object. Unlike
+       PropertyCache it does not listen for PropertiesChanged, so it costs no match rules and
+       changes only become visible after an explicit `refresh`. Use `age` to decide when to do
+       that.'''
+
+    __slots__ = ()
+
+    def _subscribe(self):
+        return None
@@ -0,0 +1,111 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Implementation of the proxy_pool module'''
+
+from PyMM import ModemManagerBusName
+from PyMM.properties import PropertyMode
+
+
+class ProxyPool:
+    '''Identity map of the D-Bus proxies and PyMM wrapper objects created on a single bus
+       connection. Every object path gets exactly one proxy and every (object path, interface) pair
+       exactly one wrapper per property mode, so repeated accesses such as Modem.Sim reuse them
+       instead of creating new proxies (with their own introspection and match rules) every time.'''
+
+    __slots__ = ('_bus', '_proxies', '_wrappers', '_owned_paths')
+
+    _pools = {}
+
+    @classmethod
+    def for_bus(cls, bus):
+        '''Returns the pool which belongs to the specified bus connection, creating it if needed.'''
+
+        pool = cls._pools.get(bus)
+        if pool is None:
+            pool = cls(bus)
+            cls._pools[bus] = pool
+
+        return pool
+
+    @classmethod
+    def release(cls, bus):
+        '''Discards the pool of the specified bus connection, if any, together with its wrappers.'''
+
+        pool = cls._pools.pop(bus, None)
+        if pool is not None:
+            pool.clear()
+
+    def __init__(self, bus):
+        self._bus = bus
+        self._proxies = {}
+        self._wrappers = {}
+        self._owned_paths = {}
+
+    def __len__(self):
+        return len(self._wrappers)
+
+    def get_object(self, path):
+        '''Returns the proxy for the ModemManager object at the specified path. Proxies are created
+           without introspection, so methods must be invoked through `signatures.call_method`.'''
+
+        proxy = self._proxies.get(path)
+        if proxy is None:
+            proxy = self._bus.get_object(ModemManagerBusName, path, introspect=False)
+            self._proxies[path] = proxy
+
+        return proxy
+
+    def get_wrapper(self, cls, path, *args, property_mode=PropertyMode.DIRECT, max_age=None,
+                    owner=None):
+        '''Returns the instance of the ManagedObject subclass `cls` for the object at the specified
+           path, constructing it with the rest of the arguments if it does not exist yet. If `owner`
+           is specified, the wrapper is discarded together with the owner's path.'''
+
+        key = (path, cls._interface_name, property_mode, max_age)
+
+        wrapper = self._wrappers.get(key)
+        if wrapper is None:
+            wrapper = cls(self._bus, path, *args, property_mode=property_mode, max_age=max_age)
+            self._wrappers[key] = wrapper
+            if owner is not None:
+                self._owned_paths.setdefault(owner, set()).add(path)
+
+        return wrapper
+
+    def discard(self, path):
+        '''Drops the proxy and all the wrappers of the object at the specified path and of all the
+           objects which it owns. Must be called when ModemManager removes the object.'''
+
+        for owned_path in self._owned_paths.pop(path, ()):
+            self.discard(owned_path)
+
+        for key in [key for key in self._wrappers if key[0] == path]:
+            self._wrappers.pop(key).close()
+
+        self._proxies.pop(path, None)
+
+    def clear(self):
+        '''Drops all the proxies and wrappers. Must be called when the ModemManager service is
+           restarted, because the proxies are bound to the unique bus name of its previous
+           instance.'''
+
+        wrappers, self._wrappers = self._wrappers, {}
+        for wrapper in wrappers.values():
+            wrapper.close()
+
+        self._proxies.clear()
+        self._owned_paths.clear()
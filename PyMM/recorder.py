@@ -0,0 +1,570 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Implementation of the recorder module, which records the D-Bus traffic between PyMM and
+   ModemManager into a compact binary log and replays it as a local D-Bus service.
+
+   The log starts with a fixed header, followed by one frame per method call or signal. Each frame
+   has a fixed prefix with its kind, its time since the start of the recording and the length of its
+   payload, which holds the values in a tagged binary encoding preserving their exact D-Bus types.
+   Frames are only ever appended, so a recording can be resumed and a truncated log is readable up
+   to its last complete frame.
+
+   The replayer can be run as `python -m PyMM.recorder --address <bus address> --log <path>`, or
+   from Python through ReplayProcess, for example on a PrivateBus from `PyMM.fake_modem_manager`.'''
+
+import argparse
+import dbus
+import dbus.lowlevel
+import os
+import struct
+import subprocess
+import sys
+import time
+
+from collections import deque
+from PyMM import ModemManagerBusName, instrumentation
+from PyMM.signatures import ReplySignatures, SignalSignatures
+
+LogMagic = b'PyMMREC\0'
+LogFormatVersion = 1
+
+# magic, format version, wall-clock time of the start of the recording
+_Header = struct.Struct('<8sId')
+# kind, seconds since the start of the recording, length of the payload
+_Frame = struct.Struct('<BdI')
+_Double = struct.Struct('<d')
+
+CallRecord = 1
+SignalRecord = 2
+
+
+class LogEntry:
+    '''Single method call or signal read from a log. For calls, `member` is the method name, `args`
+       its arguments and exactly one of `result` and `error_name` is meaningful. For signals,
+       `member` is the signal name and `args` its arguments.'''
+
+    __slots__ = ('kind', 'timestamp', 'path', 'interface_name', 'member', 'args', 'result',
+                 'error_name', 'error_message', 'elapsed')
+
+    def __init__(self, kind, timestamp, path, interface_name, member, args, result=None,
+                 error_name='', error_message='', elapsed=0.0):
+        self.kind = kind
+        self.timestamp = timestamp
+        self.path = path
+        self.interface_name = interface_name
+        self.member = member
+        self.args = args
+        self.result = result
+        self.error_name = error_name
+        self.error_message = error_message
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        kind = 'call' if self.kind == CallRecord else 'signal'
+        return (f'LogEntry({kind} {self.path} {self.interface_name}.{self.member} '
+                f'@ {self.timestamp:.3f})')
+
+
+###
+### Encoding of the values
+###
+
+
+def _write_varint(out, value):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def _write_string(out, value):
+    encoded = value.encode('utf-8')
+    _write_varint(out, len(encoded))
+    out += encoded
+
+
+def _read_string(data, offset):
+    length, offset = _read_varint(data, offset)
+    return bytes(data[offset:offset + length]).decode('utf-8'), offset + length
+
+
+# Tag and constructor of each of the dbus-python integer types. Integers are stored zig-zag encoded.
+_IntegerTags = {
+    dbus.Byte: b'y',
+    dbus.Int16: b'n',
+    dbus.UInt16: b'q',
+    dbus.Int32: b'i',
+    dbus.UInt32: b'u',
+    dbus.Int64: b'x',
+    dbus.UInt64: b't',
+}
+_IntegerTypes = {tag[0]: cls for cls, tag in _IntegerTags.items()}
+
+_StringTags = {
+    dbus.String: b's',
+    dbus.ObjectPath: b'o',
+    dbus.Signature: b'g',
+}
+_StringTypes = {tag[0]: cls for cls, tag in _StringTags.items()}
+
+
+def encode_value(out, value):
+    '''Appends the tagged encoding of a dbus-python (or plain Python) value to the `out`
+       bytearray.'''
+
+    variant_level = getattr(value, 'variant_level', 0)
+    if variant_level:
+        out += b'V'
+        _write_varint(out, variant_level)
+
+    value_type = type(value)
+    if value is None:
+        out += b'N'
+    elif value_type in _StringTags:
+        out += _StringTags[value_type]
+        _write_string(out, value)
+    elif isinstance(value, str):
+        out += b's'
+        _write_string(out, value)
+    elif isinstance(value, bool) or value_type is dbus.Boolean:
+        out += b'b'
+        out.append(1 if value else 0)
+    elif isinstance(value, int):
+        out += _IntegerTags.get(value_type, b'x')
+        _write_varint(out, (value << 1) ^ -1 if value < 0 else value << 1)
+    elif isinstance(value, float):
+        out += b'd'
+        out += _Double.pack(value)
+    elif isinstance(value, (bytes, bytearray)):
+        out += b'B'
+        _write_varint(out, len(value))
+        out += value
+    elif isinstance(value, dict):
+        out += b'e'
+        _write_string(out, getattr(value, 'signature', None) or '')
+        _write_varint(out, len(value))
+        for key, item in value.items():
+            encode_value(out, key)
+            encode_value(out, item)
+    elif isinstance(value, tuple):
+        out += b'r'
+        _write_varint(out, len(value))
+        for item in value:
+            encode_value(out, item)
+    elif isinstance(value, list):
+        out += b'a'
+        _write_string(out, getattr(value, 'signature', None) or '')
+        _write_varint(out, len(value))
+        for item in value:
+            encode_value(out, item)
+    else:
+        raise TypeError(f'Cannot encode {value!r}')
+
+
+def decode_value(data, offset=0):
+    '''Decodes the value encoded at `offset` into the equivalent dbus-python value and returns it
+       together with the offset past its end.'''
+
+    variant_level = 0
+    tag = data[offset]
+    offset += 1
+    if tag == ord('V'):
+        variant_level, offset = _read_varint(data, offset)
+        tag = data[offset]
+        offset += 1
+
+    kwargs = {'variant_level': variant_level} if variant_level else {}
+
+    if tag == ord('N'):
+        return None, offset
+    if tag in _StringTypes:
+        value, offset = _read_string(data, offset)
+        return _StringTypes[tag](value, **kwargs), offset
+    if tag == ord('b'):
+        return dbus.Boolean(data[offset], **kwargs), offset + 1
+    if tag in _IntegerTypes:
+        value, offset = _read_varint(data, offset)
+        value = ~(value >> 1) if value & 1 else value >> 1
+        return _IntegerTypes[tag](value, **kwargs), offset
+    if tag == ord('d'):
+        return dbus.Double(_Double.unpack_from(data, offset)[0], **kwargs), offset + _Double.size
+    if tag == ord('B'):
+        length, offset = _read_varint(data, offset)
+        return dbus.ByteArray(bytes(data[offset:offset + length]), **kwargs), offset + length
+    if tag == ord('e'):
+        signature, offset = _read_string(data, offset)
+        length, offset = _read_varint(data, offset)
+        items = {}
+        for _ in range(length):
+            key, offset = decode_value(data, offset)
+            items[key], offset = decode_value(data, offset)
+        return dbus.Dictionary(items, signature=signature or None, **kwargs), offset
+    if tag == ord('r'):
+        length, offset = _read_varint(data, offset)
+        items = []
+        for _ in range(length):
+            item, offset = decode_value(data, offset)
+            items.append(item)
+        return dbus.Struct(items, **kwargs), offset
+    if tag == ord('a'):
+        signature, offset = _read_string(data, offset)
+        length, offset = _read_varint(data, offset)
+        items = []
+        for _ in range(length):
+            item, offset = decode_value(data, offset)
+            items.append(item)
+        return dbus.Array(items, signature=signature or None, **kwargs), offset
+
+    raise ValueError(f'Unknown tag {chr(tag)!r} at offset {offset - 1}')
+
+
+###
+### Recording
+###
+
+
+class LogWriter:
+    '''Appends frames to a log, creating it if it does not exist. Appending to an existing log
+       continues its timeline.'''
+
+    __slots__ = ('_file', '_started_at')
+
+    def __init__(self, path):
+        self._file = open(path, 'ab+')
+        self._file.seek(0)
+        header = self._file.read(_Header.size)
+        if header:
+            magic, version, self._started_at = _Header.unpack(header)
+            if magic != LogMagic or version != LogFormatVersion:
+                self._file.close()
+                raise ValueError(f'{path} is not a PyMM log of version {LogFormatVersion}')
+        else:
+            self._started_at = time.time()
+            self._file.write(_Header.pack(LogMagic, LogFormatVersion, self._started_at))
+
+    def write(self, kind, timestamp, *fields):
+        payload = bytearray()
+        for field in fields:
+            encode_value(payload, field)
+
+        self._file.write(_Frame.pack(kind, timestamp - self._started_at, len(payload)) + payload)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def read_log(path):
+    '''Generator which yields a LogEntry for every complete frame of the log.'''
+
+    with open(path, 'rb') as log:
+        data = log.read()
+
+    magic, version, _ = _Header.unpack_from(data, 0)
+    if magic != LogMagic or version != LogFormatVersion:
+        raise ValueError(f'{path} is not a PyMM log of version {LogFormatVersion}')
+
+    offset = _Header.size
+    while offset + _Frame.size <= len(data):
+        kind, timestamp, length = _Frame.unpack_from(data, offset)
+        offset += _Frame.size
+        if offset + length > len(data):
+            # Truncated by a recorder which did not close the log
+            return
+
+        fields = []
+        field_offset = offset
+        while field_offset < offset + length:
+            field, field_offset = decode_value(data, field_offset)
+            fields.append(field)
+        offset += length
+
+        if kind == CallRecord:
+            path, interface_name, member, args, result, error_name, error_message, elapsed = fields
+            yield LogEntry(kind, timestamp, path, interface_name, member, tuple(args), result,
+                           error_name, error_message, elapsed)
+        elif kind == SignalRecord:
+            path, interface_name, member, args = fields
+            yield LogEntry(kind, timestamp, path, interface_name, member, tuple(args))
+
+
+class Recorder:
+    '''Records the method calls which PyMM makes (through the post-call hook of
+       `PyMM.instrumentation`, which it enables) and all the signals which ModemManager emits
+       (through a single match rule) into the log at `path`. Use it as a context manager or call
+       `close` to stop recording.'''
+
+    def __init__(self, path):
+        self._writer = LogWriter(path)
+        self._signal_match = None
+        self._enabled_instrumentation = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def attach(self, modem_manager):
+        '''Starts recording the traffic of `modem_manager`.'''
+
+        self._signal_match = modem_manager.bus.add_signal_receiver(
+            self._on_signal, bus_name=ModemManagerBusName, path_keyword='path',
+            interface_keyword='interface_name', member_keyword='member')
+
+        instrumentation.add_post_call_hook(self._on_call)
+        if not instrumentation.enabled:
+            instrumentation.enable()
+            self._enabled_instrumentation = True
+
+    def close(self):
+        if self._signal_match is not None:
+            self._signal_match.remove()
+            self._signal_match = None
+
+        instrumentation.remove_hook(self._on_call)
+        if self._enabled_instrumentation:
+            instrumentation.disable()
+            self._enabled_instrumentation = False
+
+        self._writer.close()
+
+    def _on_call(self, call_info):
+        error_name = ''
+        error_message = ''
+        if call_info.error is not None:
+            error_name = instrumentation._error_name(call_info.error)
+            error_message = str(call_info.error)
+
+        self._writer.write(CallRecord,
+                           time.time() - call_info.elapsed,
+                           call_info.path, call_info.interface_name, call_info.method_name,
+                           list(call_info.args), call_info.result, error_name, error_message,
+                           call_info.elapsed)
+
+    def _on_signal(self, *args, path=None, interface_name=None, member=None):
+        self._writer.write(SignalRecord, time.time(), path, interface_name, member, list(args))
+
+
+###
+### Replay
+###
+
+
+def _native(value):
+    '''Converts a dbus-python (or plain Python) value into the equivalent plain Python value, so
+       that the arguments recorded as PyMM passed them compare equal to the ones received from the
+       bus, whose types are the ones of the method signature.'''
+
+    if isinstance(value, bool) or type(value) is dbus.Boolean:
+        return bool(value)
+    if isinstance(value, str):
+        return str(value)
+    if isinstance(value, int):
+        return int(value)
+    if isinstance(value, float):
+        return float(value)
+    if isinstance(value, (bytes, bytearray)):
+        return list(value)
+    if isinstance(value, dict):
+        return sorted(((_native(key), _native(item)) for key, item in value.items()), key=repr)
+    if isinstance(value, (list, tuple)):
+        return [_native(item) for item in value]
+
+    return value
+
+
+def _key(path, interface_name, member, args):
+    return (path, interface_name, member, repr(_native(list(args))))
+
+
+class Replayer:
+    '''Serves a log as the ModemManager service on `bus`. Every method call is answered with the
+       reply which was recorded for the same object, method and arguments (in the recorded order,
+       repeating the last one once they are exhausted), or otherwise with the last reply recorded
+       for the same object and method. If `replay_latency` is True, replies are delayed by the
+       recorded call duration. Signals are emitted on the recorded timeline, sped up by `speed`.'''
+
+    def __init__(self, bus, log_path, speed=1.0, replay_latency=True):
+        self._bus = bus
+        self._speed = speed
+        self._replay_latency = replay_latency
+
+        self._replies = {}
+        self._fallback_replies = {}
+        self._signals = []
+        for entry in read_log(log_path):
+            if entry.kind == CallRecord:
+                self._replies.setdefault(
+                    _key(entry.path, entry.interface_name, entry.member, entry.args),
+                    deque()).append(entry)
+                self._fallback_replies[(entry.path, entry.interface_name, entry.member)] = entry
+            else:
+                self._signals.append(entry)
+
+        self._signals.sort(key=lambda entry: entry.timestamp)
+        self._next_signal = 0
+        self._started_at = None
+
+        self.calls = 0
+        self.unanswered = 0
+
+    @property
+    def done(self):
+        '''Whether all the recorded signals have been emitted.'''
+
+        return self._next_signal == len(self._signals)
+
+    def start(self):
+        '''Starts answering calls and emitting the signals. Requires a running GLib main loop.'''
+
+        from gi.repository import GLib
+
+        self._bus.add_message_filter(self._on_message)
+        self._bus.request_name(ModemManagerBusName)
+
+        self._started_at = time.monotonic()
+        origin = self._signals[0].timestamp if self._signals else 0
+
+        def emit_due():
+            elapsed = (time.monotonic() - self._started_at) * self._speed
+            while not self.done and self._signals[self._next_signal].timestamp - origin <= elapsed:
+                self._emit(self._signals[self._next_signal])
+                self._next_signal += 1
+
+            if not self.done:
+                delay = (self._signals[self._next_signal].timestamp - origin -
+                         elapsed) / self._speed
+                GLib.timeout_add(max(int(delay * 1000), 1), emit_due)
+
+            return False
+
+        GLib.idle_add(emit_due)
+
+    def _emit(self, entry):
+        signal = dbus.lowlevel.SignalMessage(entry.path, entry.interface_name, entry.member)
+        signal.append(*entry.args, signature=SignalSignatures.get(entry.interface_name,
+                                                                  {}).get(entry.member))
+        self._bus.send_message(signal)
+
+    def _on_message(self, connection, message):
+        if (not isinstance(message, dbus.lowlevel.MethodCallMessage)
+                or not message.get_path().startswith('/org/freedesktop/ModemManager1')):
+            return dbus.lowlevel.HANDLER_RESULT_NOT_YET_HANDLED
+
+        from gi.repository import GLib
+
+        self.calls += 1
+        path, interface_name, member = message.get_path(), message.get_interface(
+        ), message.get_member()
+
+        replies = self._replies.get(_key(path, interface_name, member, message.get_args_list()))
+        if replies:
+            entry = replies.popleft() if len(replies) > 1 else replies[0]
+        else:
+            entry = self._fallback_replies.get((path, interface_name, member))
+
+        if entry is None:
+            self.unanswered += 1
+            reply = dbus.lowlevel.ErrorMessage(message, 'org.freedesktop.DBus.Error.UnknownMethod',
+                                               f'{interface_name}.{member} was not recorded')
+        elif entry.error_name:
+            reply = dbus.lowlevel.ErrorMessage(message, entry.error_name, entry.error_message)
+        else:
+            reply = dbus.lowlevel.MethodReturnMessage(message)
+            signature = ReplySignatures.get(interface_name, {}).get(member)
+            if signature is not None and entry.result is not None:
+                reply.append(entry.result, signature=signature)
+
+        if entry is not None and self._replay_latency and entry.elapsed > 0:
+            GLib.timeout_add(max(int(entry.elapsed / self._speed * 1000), 1),
+                             lambda: connection.send_message(reply) and False)
+        else:
+            connection.send_message(reply)
+
+        return dbus.lowlevel.HANDLER_RESULT_HANDLED
+
+
+class ReplayProcess:
+    '''Runs Replayer in a child process attached to the bus at `address`, so that its replies are
+       not serialised with the main loop of the process under test.'''
+
+    def __init__(self, address, log_path, speed=1.0, replay_latency=True, timeout=30):
+        from PyMM.fake_modem_manager import wait_for_service
+
+        command = [
+            sys.executable, '-m', 'PyMM.recorder', '--address', address, '--log', log_path,
+            '--speed',
+            str(speed)
+        ]
+        if not replay_latency:
+            command.append('--no-latency')
+
+        self._process = subprocess.Popen(command, env=dict(os.environ,
+                                                           PYTHONPATH=os.pathsep.join(sys.path)))
+        if not wait_for_service(address, self._process, timeout):
+            self.close()
+            raise RuntimeError('The replay service failed to start')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._process.poll() is None:
+            self._process.terminate()
+            self._process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replays a PyMM log as the ModemManager service')
+    parser.add_argument('--address', required=True, help='Address of the bus to attach to')
+    parser.add_argument('--log', required=True, help='Path of the log to replay')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Factor by which to speed up the recorded timeline')
+    parser.add_argument('--no-latency', action='store_true',
+                        help='Reply immediately instead of after the recorded call duration')
+    args = parser.parse_args()
+
+    from gi.repository import GLib
+    from PyMM.mainloop import install as install_mainloop
+
+    install_mainloop('glib')
+    bus = dbus.bus.BusConnection(args.address)
+
+    Replayer(bus, args.log, args.speed, not args.no_latency).start()
+    GLib.MainLoop().run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Implementation of the ring_buffer module'''
+
+import math
+
+from array import array
+from bisect import bisect_left
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class ColumnarRingBuffer:
+    '''Fixed-capacity ring buffer of rows with numeric columns, where every column is stored in its
+       own contiguous `array`. The first column is the timestamp of the row and must not decrease,
+       which allows time windows to be located with a binary search. Once full, the oldest rows are
+       overwritten, so the memory footprint is fixed at construction.'''
+
+    __slots__ = ('_capacity', '_names', '_columns', '_next', '_size')
+
+    def __init__(self, capacity, columns, timestamp_typecode='d'):
+        '''The `columns` is a sequence of (name, typecode) pairs for the value columns, where the
+           typecode is one of those supported by `array`, for example 'f' for float32.'''
+
+        self._capacity = capacity
+        self._names = ['timestamp'] + [name for name, _ in columns]
+        self._columns = [
+            array(timestamp_typecode, bytes(array(timestamp_typecode).itemsize * capacity))
+        ]
+        for _, typecode in columns:
+            self._columns.append(array(typecode, bytes(array(typecode).itemsize * capacity)))
+
+        self._next = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def names(self):
+        return list(self._names)
+
+    @property
+    def nbytes(self):
+        return sum(column.itemsize * len(column) for column in self._columns)
+
+    def append(self, timestamp, *values):
+        for column, value in zip(self._columns, (timestamp, ) + values):
+            column[self._next] = value
+
+        self._next = (self._next + 1) % self._capacity
+        self._size = min(self._size + 1, self._capacity)
+
+    def column(self, name, since=None, until=None):
+        '''Returns a copy of the specified column in chronological order, optionally restricted to
+           the rows with `since` <= timestamp < `until`.'''
+
+        first, last = self._window(since, until)
+        return self._ordered(self._columns[self._names.index(name)])[first:last]
+
+    def rows(self, since=None, until=None):
+        '''Yields the rows in chronological order as tuples, starting with the timestamp.'''
+
+        first, last = self._window(since, until)
+        columns = [self._ordered(column)[first:last] for column in self._columns]
+        return zip(*columns)
+
+    def last(self):
+        '''Returns the most recent row as a tuple or None if the buffer is empty.'''
+
+        if self._size == 0:
+            return None
+
+        index = (self._next - 1) % self._capacity
+        return tuple(column[index] for column in self._columns)
+
+    def _ordered(self, column):
+        if self._size < self._capacity:
+            return column[:self._size]
+
+        return column[self._next:] + column[:self._next]
+
+    def _window(self, since, until):
+        if since is None and until is None:
+            return 0, self._size
+
+        timestamps = self._ordered(self._columns[0])
+        first = 0 if since is None else bisect_left(timestamps, since)
+        last = len(timestamps) if until is None else bisect_left(timestamps, until)
+        return first, last
+
+
+def aggregate(values, percentiles=(50, 90, 99)):
+    '''Computes the count, min, max, mean and the requested percentiles of an `array` of samples,
+       ignoring NaN entries which denote missing measurements. Uses numpy over the buffer of the
+       array without copying it if numpy is available.'''
+
+    if numpy is not None:
+        samples = numpy.frombuffer(values, dtype=values.typecode)
+        samples = samples[~numpy.isnan(samples)]
+        if samples.size == 0:
+            return {'count': 0}
+
+        result = {
+            'count': int(samples.size),
+            'min': float(samples.min()),
+            'max': float(samples.max()),
+            'mean': float(samples.mean()),
+        }
+        for percentile, value in zip(percentiles, numpy.percentile(samples, percentiles)):
+            result[f'p{percentile}'] = float(value)
+
+        return result
+
+    samples = sorted(value for value in values if not math.isnan(value))
+    if not samples:
+        return {'count': 0}
+
+    result = {
+        'count': len(samples),
+        'min': samples[0],
+        'max': samples[-1],
+        'mean': math.fsum(samples) / len(samples),
+    }
+    for percentile in percentiles:
+        # Linear interpolation between the closest ranks, which is also what numpy does by default
+        rank = (len(samples) - 1) * percentile / 100
+        lower = math.floor(rank)
+        upper = min(lower + 1, len(samples) - 1)
+        result[f'p{percentile}'] = samples[lower] + (samples[upper] - samples[lower]) * (rank -
+                                                                                         lower)
+
+    return result
@@ -0,0 +1,205 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Implementation of the shared_bus module, which shares one reference-counted bus connection (with
+   its proxy pool and match rules) between all the ModemManager objects of a process which talk to
+   the same bus, and keeps it working across restarts of the dbus-daemon and of ModemManager'''
+
+import dbus
+import dbus.bus
+
+from PyMM import ModemManagerBusName
+from PyMM.proxy_pool import ProxyPool
+
+
+class SharedBus:
+    '''Bus connection shared by everything in the process which acquires it with the same `bus` or
+       `bus_address`. Connections opened here (to the system bus if neither is specified, or to
+       `bus_address`) are closed when the last reference is released and are reopened if the
+       dbus-daemon drops them. Connections passed in as `bus` belong to the caller, so they are
+       neither closed nor reopened.
+
+       A change of the owner of the ModemManager bus name (a restart of ModemManager) invalidates
+       all the proxies, which are bound to the unique name of the previous owner, so the proxy
+       pool is emptied and the `connect_service_restarted` callbacks are invoked with the new owner
+       (an empty string while there is none). After reconnecting to the dbus-daemon, the
+       `connect_reconnected` callbacks are invoked with the new connection. Both require a main
+       loop, so the owner of the name is only watched once the connection is acquired with `watch`
+       set.'''
+
+    _shared = {}
+
+    InitialReconnectDelay = 0.5
+    MaxReconnectDelay = 30
+
+    @classmethod
+    def acquire(cls, bus=None, bus_address=None, watch=True):
+        '''Returns the shared connection for the specified bus with an additional reference, which
+           must be given back with `release`. If `watch` is True, restarts of ModemManager are
+           watched for, which requires the connection to be attached to a main loop.'''
+
+        if bus is not None and bus_address is not None:
+            raise ValueError('Only one of bus and bus_address can be specified')
+
+        key = bus if bus is not None else bus_address
+        shared_bus = cls._shared.get(key)
+        if shared_bus is None:
+            shared_bus = cls(key, bus, bus_address)
+            cls._shared[key] = shared_bus
+
+        shared_bus._references += 1
+        if watch and shared_bus._name_owner_watch is None:
+            shared_bus._watch(shared_bus._connection)
+
+        return shared_bus
+
+    def __init__(self, key, bus, bus_address):
+        self._key = key
+        self._bus_address = bus_address
+        self._owned = bus is None
+        self._references = 0
+        self._reconnected_callbacks = []
+        self._service_restarted_callbacks = []
+        self._name_owner = None
+        self._name_owner_watch = None
+        self._reconnect_delay = self.InitialReconnectDelay
+        self._reconnect_timer_id = None
+
+        self._connection = self._open() if self._owned else bus
+        self._change_dispatcher = None
+
+    @property
+    def connection(self):
+        '''Returns the current connection, which changes after reconnecting.'''
+
+        return self._connection
+
+    @property
+    def change_dispatcher(self):
+        '''Returns the ChangeDispatcher of the connection, creating it on first use.'''
+
+        if self._change_dispatcher is None:
+            from PyMM.subscription import ChangeDispatcher
+
+            self._change_dispatcher = ChangeDispatcher(self._connection)
+
+        return self._change_dispatcher
+
+    @property
+    def references(self):
+        return self._references
+
+    def connect_reconnected(self, callback):
+        self._reconnected_callbacks.append(callback)
+
+    def connect_service_restarted(self, callback):
+        self._service_restarted_callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        '''Unregisters a callback registered by any of the `connect_*` methods.'''
+
+        for callbacks in (self._reconnected_callbacks, self._service_restarted_callbacks):
+            if callback in callbacks:
+                callbacks.remove(callback)
+
+    def release(self):
+        '''Gives back a reference obtained from `acquire`. The last one releases the proxy pool and
+           the match rules and closes the connection if it was opened here.'''
+
+        self._references -= 1
+        if self._references > 0:
+            return
+
+        if self._shared.get(self._key) is self:
+            del self._shared[self._key]
+
+        if self._reconnect_timer_id is not None:
+            from gi.repository import GLib
+
+            GLib.source_remove(self._reconnect_timer_id)
+            self._reconnect_timer_id = None
+
+        self._unwatch()
+        if self._change_dispatcher is not None:
+            self._change_dispatcher.close()
+        ProxyPool.release(self._connection)
+
+        if self._owned:
+            self._connection.close()
+
+    def _open(self):
+        connection = dbus.bus.BusConnection(
+            dbus.bus.BusConnection.TYPE_SYSTEM if self._bus_address is None else self._bus_address)
+        connection.set_exit_on_disconnect(False)
+        connection.call_on_disconnection(self._on_disconnected)
+        return connection
+
+    def _watch(self, connection):
+        self._name_owner = None
+        self._name_owner_watch = connection.watch_name_owner(ModemManagerBusName,
+                                                             self._on_name_owner_changed)
+
+    def _unwatch(self):
+        if self._name_owner_watch is not None:
+            self._name_owner_watch.cancel()
+            self._name_owner_watch = None
+
+    def _on_name_owner_changed(self, name_owner):
+        previous_name_owner, self._name_owner = self._name_owner, name_owner
+
+        # The first notification reports the owner at the time the watch was added
+        if previous_name_owner is None or previous_name_owner == name_owner:
+            return
+
+        ProxyPool.for_bus(self._connection).clear()
+
+        for callback in list(self._service_restarted_callbacks):
+            callback(name_owner)
+
+    def _on_disconnected(self, connection):
+        if connection is not self._connection or self._references == 0:
+            return
+
+        self._unwatch()
+        self._schedule_reconnect()
+
+    def _schedule_reconnect(self):
+        from gi.repository import GLib
+
+        self._reconnect_timer_id = GLib.timeout_add(int(self._reconnect_delay * 1000),
+                                                    self._reconnect)
+        self._reconnect_delay = min(self._reconnect_delay * 2, self.MaxReconnectDelay)
+
+    def _reconnect(self):
+        self._reconnect_timer_id = None
+
+        try:
+            connection = self._open()
+        except dbus.exceptions.DBusException:
+            self._schedule_reconnect()
+            return False
+
+        ProxyPool.release(self._connection)
+        self._connection = connection
+        self._reconnect_delay = self.InitialReconnectDelay
+        if self._change_dispatcher is not None:
+            self._change_dispatcher.rebind(connection)
+        self._watch(connection)
+
+        for callback in list(self._reconnected_callbacks):
+            callback(connection)
+
+        return False
@@ -0,0 +1,511 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Implementation of the shared_state module, which publishes the state of all the modems to a
+   memory-mapped file, so that any number of processes on the same host can read it without talking
+   to ModemManager at all.
+
+   The file starts with a fixed header, followed by `capacity` fixed-size records, one per modem.
+   Every record begins with its own sequence number, which the (single) writer makes odd while it
+   updates the record and even again once it is done. Readers copy the record and accept it only if
+   the sequence number was even and unchanged around the copy (a seqlock), so neither side ever
+   waits for a lock. The header carries a generation number, which is incremented after every
+   update, so readers can cheaply tell whether anything changed since their last read.'''
+
+import argparse
+import mmap
+import os
+import struct
+import time
+
+# Identifies the file format, followed by its version, which is bumped on every incompatible change
+# of the layout of the header or of the records
+FileMagic = b'PyMMSHM\0'
+FileFormatVersion = 1
+
+# magic, format version, record size, capacity, writer pid, generation, updated at (wall clock)
+_Header = struct.Struct('<8sIIIIQd24x')
+_Generation = struct.Struct('<Q')
+_GenerationOffset = 24
+_UpdatedAt = struct.Struct('<d')
+_UpdatedAtOffset = 32
+
+# Sequence number of the record, followed by its body: in use, connected, object path, equipment
+# identifier, manufacturer, model, operator name, state, access technologies, signal quality,
+# signal quality recent, rx bytes, tx bytes, updated at (wall clock)
+_Sequence = struct.Struct('<I')
+_RecordBody = struct.Struct('<BBxx64s32s32s32s32siIIBxxxQQd')
+_RecordSize = _Sequence.size + _RecordBody.size
+
+
+def _encode(value, size):
+    return (value or '').encode('utf-8')[:size]
+
+
+def _decode(value):
+    return value.split(b'\0', 1)[0].decode('utf-8', 'replace')
+
+
+class ModemRecord:
+    '''State of a single modem as read from the shared state file. The `state` is a ModemState
+       value and `access_technologies` a ModemAccessTechnology bitmask, both kept as plain integers
+       so that readers do not need dbus-python. The `rx_bytes` and `tx_bytes` are the totals over
+       all the bearers of the modem.'''
+
+    __slots__ = ('path', 'equipment_identifier', 'manufacturer', 'model', 'operator_name', 'state',
+                 'access_technologies', 'signal_quality', 'signal_quality_recent', 'connected',
+                 'rx_bytes', 'tx_bytes', 'updated_at')
+
+    def __init__(self, path, equipment_identifier='', manufacturer='', model='', operator_name='',
+                 state=0, access_technologies=0, signal_quality=0, signal_quality_recent=False,
+                 connected=False, rx_bytes=0, tx_bytes=0, updated_at=0.0):
+        self.path = path
+        self.equipment_identifier = equipment_identifier
+        self.manufacturer = manufacturer
+        self.model = model
+        self.operator_name = operator_name
+        self.state = state
+        self.access_technologies = access_technologies
+        self.signal_quality = signal_quality
+        self.signal_quality_recent = signal_quality_recent
+        self.connected = connected
+        self.rx_bytes = rx_bytes
+        self.tx_bytes = tx_bytes
+        self.updated_at = updated_at
+
+    def __repr__(self):
+        return (f'ModemRecord({self.path}, state={self.state}, signal={self.signal_quality}, '
+                f'connected={self.connected})')
+
+    def _pack_into(self, buffer, offset):
+        _RecordBody.pack_into(buffer, offset, 1, bool(self.connected), _encode(self.path, 64),
+                              _encode(self.equipment_identifier, 32),
+                              _encode(self.manufacturer, 32), _encode(self.model, 32),
+                              _encode(self.operator_name, 32), int(self.state),
+                              int(self.access_technologies), int(self.signal_quality),
+                              bool(self.signal_quality_recent), int(self.rx_bytes),
+                              int(self.tx_bytes), self.updated_at)
+
+    @classmethod
+    def _unpack(cls, values):
+        (in_use, connected, path, equipment_identifier, manufacturer, model, operator_name, state,
+         access_technologies, signal_quality, signal_quality_recent, rx_bytes, tx_bytes,
+         updated_at) = values
+        if not in_use:
+            return None
+
+        return cls(_decode(path), _decode(equipment_identifier), _decode(manufacturer),
+                   _decode(model), _decode(operator_name),
+                   state, access_technologies, signal_quality, bool(signal_quality_recent),
+                   bool(connected), rx_bytes, tx_bytes, updated_at)
+
+
+class SharedStateWriter:
+    '''Creates the shared state file and updates its records. There must be a single writer per
+       file. The file is created under a temporary name and renamed into place, so readers never
+       observe a partially initialised file.'''
+
+    __slots__ = ('_path', '_capacity', '_file', '_map', '_generation')
+
+    def __init__(self, path, capacity=256):
+        self._path = path
+        self._capacity = capacity
+        self._generation = 0
+
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        self._file = open(temporary_path, 'w+b')
+        self._file.truncate(_Header.size + capacity * _RecordSize)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        _Header.pack_into(self._map, 0, FileMagic, FileFormatVersion, _RecordSize, capacity,
+                          os.getpid(), 0, time.time())
+        self._map.flush()
+        os.replace(temporary_path, path)
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def write(self, slot, record):
+        '''Stores the ModemRecord into the specified slot.'''
+
+        self._update(slot, lambda offset: record._pack_into(self._map, offset))
+
+    def clear(self, slot):
+        '''Marks the specified slot as unused.'''
+
+        def clear_body(offset):
+            self._map[offset:offset + _RecordBody.size] = bytes(_RecordBody.size)
+
+        self._update(slot, clear_body)
+
+    def close(self, unlink=True):
+        '''Releases the file and (unless `unlink` is False) removes it. Readers which have it open
+           keep reading the last published state.'''
+
+        self._map.close()
+        self._file.close()
+        if unlink:
+            try:
+                os.unlink(self._path)
+            except FileNotFoundError:
+                pass
+
+    def _update(self, slot, write_body):
+        if not 0 <= slot < self._capacity:
+            raise IndexError(f'Slot {slot} is outside of the capacity of {self._capacity}')
+
+        offset = _Header.size + slot * _RecordSize
+        sequence = _Sequence.unpack_from(self._map, offset)[0]
+        _Sequence.pack_into(self._map, offset, (sequence + 1) & 0xffffffff)
+        write_body(offset + _Sequence.size)
+        _Sequence.pack_into(self._map, offset, (sequence + 2) & 0xffffffff)
+
+        self._generation += 1
+        _UpdatedAt.pack_into(self._map, _UpdatedAtOffset, time.time())
+        _Generation.pack_into(self._map, _GenerationOffset, self._generation)
+
+
+class SharedStateReader:
+    '''Reads the shared state file published by SharedStateCollector (or any SharedStateWriter).
+       Reads are served directly from the shared mapping of the file without any system call, lock
+       or D-Bus traffic, so their cost does not depend on the number of readers.'''
+
+    __slots__ = ('_path', '_file', '_map', '_capacity', '_writer_pid', '_inode')
+
+    def __init__(self, path):
+        self._path = path
+        self._file = None
+        self._map = None
+        self._open()
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def writer_pid(self):
+        return self._writer_pid
+
+    @property
+    def generation(self):
+        '''Number of updates published so far, which changes whenever any record changes.'''
+
+        return _Generation.unpack_from(self._map, _GenerationOffset)[0]
+
+    @property
+    def updated_at(self):
+        '''Wall-clock time of the last update.'''
+
+        return _UpdatedAt.unpack_from(self._map, _UpdatedAtOffset)[0]
+
+    def records(self):
+        '''Returns a consistent ModemRecord for every modem in the file.'''
+
+        records = []
+        for slot in range(self._capacity):
+            record = self.read(slot)
+            if record is not None:
+                records.append(record)
+
+        return records
+
+    def record(self, modem_path):
+        '''Returns the ModemRecord of the modem with the specified object path or None.'''
+
+        for record in self.records():
+            if record.path == modem_path:
+                return record
+
+        return None
+
+    def read(self, slot, timeout=1.0):
+        '''Returns the ModemRecord stored in the specified slot or None if it is unused. Retries
+           while the writer is updating the record, which only takes a few microseconds, and raises
+           TimeoutError if no consistent copy could be read within `timeout` seconds (for example
+           because the writer died in the middle of an update).'''
+
+        offset = _Header.size + slot * _RecordSize
+        deadline = time.monotonic() + timeout
+        while True:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'Slot {slot} of {self._path} is being updated for more than '
+                                   f'{timeout} seconds')
+
+            sequence = _Sequence.unpack_from(self._map, offset)[0]
+            if sequence & 1:
+                time.sleep(0)
+                continue
+
+            values = _RecordBody.unpack_from(self._map, offset + _Sequence.size)
+            if _Sequence.unpack_from(self._map, offset)[0] == sequence:
+                return ModemRecord._unpack(values)
+
+    def reopen_if_replaced(self):
+        '''Re-opens the file if the collector was restarted and has published a new one. Returns
+           True if it did.'''
+
+        try:
+            inode = os.stat(self._path).st_ino
+        except FileNotFoundError:
+            return False
+
+        if inode == self._inode:
+            return False
+
+        self.close()
+        self._open()
+        return True
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = None
+            self._file = None
+
+    def _open(self):
+        self._file = open(self._path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, record_size, capacity, writer_pid, _, _ = _Header.unpack_from(
+                self._map, 0)
+            if magic != FileMagic or version != FileFormatVersion or record_size != _RecordSize:
+                raise ValueError(f'{self._path} is not a PyMM shared state file of version '
+                                 f'{FileFormatVersion}')
+        except Exception:
+            if self._map is not None:
+                self._map.close()
+            self._file.close()
+            self._map = None
+            self._file = None
+            raise
+
+        self._capacity = capacity
+        self._writer_pid = writer_pid
+        self._inode = os.fstat(self._file.fileno()).st_ino
+
+
+class SharedStateCollector:
+    '''Keeps the shared state file current with the state of all the modems of a ModemManager
+       object. The modem, SIM and bearer properties are read once when a modem appears (or when
+       its SIM changes) and are then updated from a single coalesced subscription (see
+       `ModemManager.subscribe`), so the cost on ModemManager is the same no matter how many
+       processes read the file. Updates are only published while the main loop is running.'''
+
+    def __init__(self, path, capacity=256, coalesce_ms=100):
+        self._writer = SharedStateWriter(path, capacity)
+        self._modems = {}
+        self._records = {}
+        self._slots = {}
+        self._free_slots = list(range(capacity - 1, -1, -1))
+        # Modem path which owns each tracked bearer and the last reported state of the bearer
+        self._bearer_owners = {}
+        self._bearer_states = {}
+        # Modem path which owns each tracked SIM
+        self._sim_owners = {}
+        self._coalesce_ms = coalesce_ms
+        self._subscription = None
+
+    @property
+    def path(self):
+        return self._writer.path
+
+    def attach(self, modem_manager):
+        '''Publishes the state of all the modems of `modem_manager`, including the modems which
+           appear later.'''
+
+        self._subscription = modem_manager.subscribe(None, self._on_changes, self._coalesce_ms)
+
+        for modem in modem_manager.managed_modems.values():
+            self.add_modem(modem)
+
+        modem_manager.connect_modem_added(self.add_modem)
+        modem_manager.connect_modem_removed(self.remove_modem)
+
+    def add_modem(self, modem):
+        if modem.path in self._slots or self._writer is None:
+            return
+
+        if not self._free_slots:
+            raise RuntimeError(f'The shared state file has no room for modem {modem.path}')
+
+        properties = modem.all_properties
+        record = ModemRecord(modem.path, properties.get('EquipmentIdentifier'),
+                             properties.get('Manufacturer'), properties.get('Model'))
+        self._update_modem(record, properties)
+
+        self._slots[modem.path] = self._free_slots.pop()
+        self._modems[modem.path] = modem
+        self._records[modem.path] = record
+        self._track_sim(modem, properties.get('Sim'))
+        for bearer in modem.Bearers:
+            self._track_bearer(modem.path, bearer.path, bearer.Connected, bearer.Stats)
+
+        self._publish(modem.path)
+
+    def remove_modem(self, modem):
+        slot = self._slots.pop(modem.path, None)
+        if slot is None:
+            return
+
+        del self._modems[modem.path]
+        del self._records[modem.path]
+        self._untrack_sim(modem.path)
+        for bearer_path in [
+                bearer_path for bearer_path, owner in self._bearer_owners.items()
+                if owner == modem.path
+        ]:
+            del self._bearer_owners[bearer_path]
+            del self._bearer_states[bearer_path]
+
+        if self._writer is not None:
+            self._writer.clear(slot)
+        self._free_slots.append(slot)
+
+    def close(self, unlink=True):
+        '''Stops publishing and (unless `unlink` is False) removes the file.'''
+
+        if self._subscription is not None:
+            self._subscription.cancel()
+            self._subscription = None
+
+        if self._writer is not None:
+            self._writer.close(unlink)
+            self._writer = None
+
+    def _track_sim(self, modem, sim_path):
+        self._untrack_sim(modem.path)
+
+        record = self._records[modem.path]
+        record.operator_name = ''
+        if not sim_path or sim_path == '/':
+            return
+
+        self._sim_owners[sim_path] = modem.path
+        try:
+            record.operator_name = modem.sim_by_path(sim_path).OperatorName
+        except Exception:
+            pass
+
+    def _untrack_sim(self, modem_path):
+        for sim_path in [
+                sim_path for sim_path, owner in self._sim_owners.items() if owner == modem_path
+        ]:
+            del self._sim_owners[sim_path]
+
+    def _track_bearer(self, modem_path, bearer_path, connected, stats):
+        self._bearer_owners[bearer_path] = modem_path
+        self._bearer_states[bearer_path] = [
+            bool(connected),
+            int(stats.get('rx-bytes', 0)),
+            int(stats.get('tx-bytes', 0))
+        ]
+
+    def _update_modem(self, record, properties):
+        # Invalidated properties are reported as None and keep their last known value
+        if properties.get('State') is not None:
+            record.state = properties['State']
+        if properties.get('AccessTechnologies') is not None:
+            record.access_technologies = properties['AccessTechnologies']
+        if properties.get('SignalQuality') is not None:
+            record.signal_quality, record.signal_quality_recent = properties['SignalQuality']
+
+    def _on_changes(self, changes):
+        changed_modems = set()
+
+        for path, interfaces in changes.items():
+            modem_properties = interfaces.get('org.freedesktop.ModemManager1.Modem')
+            if modem_properties is not None and path in self._records:
+                self._update_modem(self._records[path], modem_properties)
+                changed_modems.add(path)
+
+                if modem_properties.get('Sim') is not None:
+                    self._track_sim(self._modems[path], modem_properties['Sim'])
+
+                bearer_paths = modem_properties.get('Bearers')
+                if bearer_paths is not None:
+                    for bearer_path in set(self._bearer_owners) - set(bearer_paths):
+                        if self._bearer_owners[bearer_path] == path:
+                            del self._bearer_owners[bearer_path]
+                            del self._bearer_states[bearer_path]
+                    for bearer_path in bearer_paths:
+                        if bearer_path not in self._bearer_owners:
+                            self._track_bearer(path, bearer_path, False, {})
+
+            sim_properties = interfaces.get('org.freedesktop.ModemManager1.Sim')
+            if sim_properties is not None and path in self._sim_owners:
+                if sim_properties.get('OperatorName') is not None:
+                    modem_path = self._sim_owners[path]
+                    self._records[modem_path].operator_name = sim_properties['OperatorName']
+                    changed_modems.add(modem_path)
+
+            bearer_properties = interfaces.get('org.freedesktop.ModemManager1.Bearer')
+            if bearer_properties is not None and path in self._bearer_owners:
+                state = self._bearer_states[path]
+                if bearer_properties.get('Connected') is not None:
+                    state[0] = bool(bearer_properties['Connected'])
+                stats = bearer_properties.get('Stats')
+                if stats:
+                    state[1] = int(stats.get('rx-bytes', state[1]))
+                    state[2] = int(stats.get('tx-bytes', state[2]))
+                changed_modems.add(self._bearer_owners[path])
+
+        for modem_path in changed_modems:
+            self._publish(modem_path)
+
+    def _publish(self, modem_path):
+        if self._writer is None:
+            return
+
+        record = self._records[modem_path]
+        bearer_states = [
+            self._bearer_states[bearer_path] for bearer_path, owner in self._bearer_owners.items()
+            if owner == modem_path
+        ]
+        record.connected = any(state[0] for state in bearer_states)
+        record.rx_bytes = sum(state[1] for state in bearer_states)
+        record.tx_bytes = sum(state[2] for state in bearer_states)
+        record.updated_at = time.time()
+
+        self._writer.write(self._slots[modem_path], record)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Publishes the state of all the modems to a shared memory file')
+    parser.add_argument('--path', default='/run/pymm/state', help='Path of the shared state file')
+    parser.add_argument('--capacity', type=int, default=256, help='Maximum number of modems')
+    parser.add_argument('--coalesce-ms', type=int, default=100,
+                        help='Milliseconds over which property changes are merged')
+    args = parser.parse_args()
+
+    from gi.repository import GLib
+    from PyMM import ModemManager, PropertyMode
+
+    collector = SharedStateCollector(args.path, args.capacity, args.coalesce_ms)
+    collector.attach(ModemManager(PropertyMode.CACHED))
+    try:
+        GLib.MainLoop().run()
+    finally:
+        collector.close()
+
+
+if __name__ == '__main__':
+    main()
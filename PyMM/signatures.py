@@ -0,0 +1,353 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Static signatures of the D-Bus interfaces wrapped by PyMM, which correspond to the ModemManager
+   API version 1.20 (https://www.freedesktop.org/software/ModemManager/api/1.20.0/ref-dbus.html).
+   They allow the proxies to be created without introspection, which would otherwise cost an extra
+   Introspect round trip and an XML parse for every new proxy before its first method call.'''
+
+from PyMM import instrumentation
+
+# Input signature of every method, keyed by interface name and then by method name
+MethodSignatures = {
+    'org.freedesktop.DBus.Properties': {
+        'Get': 'ss',
+        'GetAll': 's',
+        'Set': 'ssv',
+    },
+    'org.freedesktop.DBus.ObjectManager': {
+        'GetManagedObjects': '',
+    },
+    'org.freedesktop.ModemManager1': {
+        'ScanDevices': '',
+        'SetLogging': 's',
+        'ReportKernelEvent': 'a{sv}',
+        'InhibitDevice': 'sb',
+    },
+    'org.freedesktop.ModemManager1.Modem': {
+        'Enable': 'b',
+        'ListBearers': '',
+        'CreateBearer': 'a{sv}',
+        'DeleteBearer': 'o',
+        'Reset': '',
+        'FactoryReset': 's',
+        'SetPowerState': 'u',
+        'SetCurrentCapabilities': 'u',
+        'SetCurrentModes': '(uu)',
+        'SetCurrentBands': 'au',
+        'SetPrimarySimSlot': 'u',
+        'GetCellInfo': '',
+        'Command': 'su',
+    },
+    'org.freedesktop.ModemManager1.Modem.Simple': {
+        'Connect': 'a{sv}',
+        'Disconnect': 'o',
+        'GetStatus': '',
+    },
+    'org.freedesktop.ModemManager1.Modem.Modem3gpp': {
+        'Register': 's',
+        'Scan': '',
+        'SetEpsUeModeOperation': 'u',
+        'SetInitialEpsBearerSettings': 'a{sv}',
+        'DisableFacilityLock': '(us)',
+        'SetCarrierLock': 'ay',
+        'SetPacketServiceState': 'u',
+        'SetNr5gRegistrationSettings': 'a{sv}',
+    },
+    'org.freedesktop.ModemManager1.Modem.Signal': {
+        'Setup': 'u',
+        'SetupThresholds': 'a{sv}',
+    },
+    'org.freedesktop.ModemManager1.Modem.Location': {
+        'Setup': 'ub',
+        'GetLocation': '',
+        'SetSuplServer': 's',
+        'InjectAssistanceData': 'ay',
+        'SetGpsRefreshRate': 'u',
+    },
+    'org.freedesktop.ModemManager1.Modem.Messaging': {
+        'List': '',
+        'Delete': 'o',
+        'Create': 'a{sv}',
+        'SetDefaultStorage': 'u',
+    },
+    'org.freedesktop.ModemManager1.Sms': {
+        'Send': '',
+        'Store': 'u',
+    },
+    'org.freedesktop.ModemManager1.Sim': {
+        'SendPin': 's',
+        'SendPuk': 'ss',
+        'EnablePin': 'sb',
+        'ChangePin': 'ss',
+        'SetPreferredNetworks': 'a(su)',
+    },
+    'org.freedesktop.ModemManager1.Bearer': {
+        'Connect': '',
+        'Disconnect': '',
+    },
+}
+
+# Signature of every property, keyed by interface name and then by property name. Used to build the
+# converters in `PyMM.decoding` once, instead of inspecting every value of every reply.
+PropertySignatures = {
+    'org.freedesktop.ModemManager1': {
+        'Version': 's',
+    },
+    'org.freedesktop.ModemManager1.Modem': {
+        'Sim': 'o',
+        'SimSlots': 'ao',
+        'PrimarySimSlot': 'u',
+        'Bearers': 'ao',
+        'SupportedCapabilities': 'au',
+        'CurrentCapabilities': 'u',
+        'MaxBearers': 'u',
+        'MaxActiveBearers': 'u',
+        'MaxActiveMultiplexedBearers': 'u',
+        'Manufacturer': 's',
+        'Model': 's',
+        'Revision': 's',
+        'CarrierConfiguration': 's',
+        'CarrierConfigurationRevision': 's',
+        'HardwareRevision': 's',
+        'DeviceIdentifier': 's',
+        'Device': 's',
+        'Physdev': 's',
+        'Drivers': 'as',
+        'Plugin': 's',
+        'PrimaryPort': 's',
+        'Ports': 'a(su)',
+        'EquipmentIdentifier': 's',
+        'UnlockRequired': 'u',
+        'UnlockRetries': 'a{uu}',
+        'State': 'i',
+        'StateFailedReason': 'u',
+        'AccessTechnologies': 'u',
+        'SignalQuality': '(ub)',
+        'OwnNumbers': 'as',
+        'PowerState': 'u',
+        'SupportedModes': 'a(uu)',
+        'CurrentModes': '(uu)',
+        'SupportedBands': 'au',
+        'CurrentBands': 'au',
+        'SupportedIpFamilies': 'u',
+    },
+    'org.freedesktop.ModemManager1.Modem.Modem3gpp': {
+        'Imei': 's',
+        'RegistrationState': 'u',
+        'OperatorCode': 's',
+        'OperatorName': 's',
+        'EnabledFacilityLocks': 'u',
+        'SubscriptionState': 'u',
+        'EpsUeModeOperation': 'u',
+        'Pco': 'a(ubay)',
+        'InitialEpsBearer': 'o',
+        'InitialEpsBearerSettings': 'a{sv}',
+        'PacketServiceState': 'u',
+        'Nr5gRegistrationSettings': 'a{sv}',
+    },
+    'org.freedesktop.ModemManager1.Modem.Signal': {
+        'Rate': 'u',
+        'RssiThreshold': 'u',
+        'ErrorRateThreshold': 'b',
+        'Cdma': 'a{sv}',
+        'Evdo': 'a{sv}',
+        'Gsm': 'a{sv}',
+        'Umts': 'a{sv}',
+        'Lte': 'a{sv}',
+        'Nr5g': 'a{sv}',
+    },
+    'org.freedesktop.ModemManager1.Modem.Location': {
+        'Capabilities': 'u',
+        'SupportedAssistanceData': 'u',
+        'Enabled': 'u',
+        'SignalsLocation': 'b',
+        'Location': 'a{uv}',
+        'SuplServer': 's',
+        'AssistanceDataServers': 'as',
+        'GpsRefreshRate': 'u',
+    },
+    'org.freedesktop.ModemManager1.Modem.Messaging': {
+        'Messages': 'ao',
+        'SupportedStorages': 'au',
+        'DefaultStorage': 'u',
+    },
+    'org.freedesktop.ModemManager1.Sms': {
+        'State': 'u',
+        'PduType': 'u',
+        'Number': 's',
+        'Text': 's',
+        'Data': 'ay',
+        'SMSC': 's',
+        'Validity': '(uv)',
+        'Class': 'i',
+        'TeleserviceId': 'u',
+        'ServiceCategory': 'u',
+        'DeliveryReportRequest': 'b',
+        'MessageReference': 'u',
+        'Timestamp': 's',
+        'DischargeTimestamp': 's',
+        'DeliveryState': 'u',
+        'Storage': 'u',
+    },
+    'org.freedesktop.ModemManager1.Sim': {
+        'Active': 'b',
+        'SimIdentifier': 's',
+        'Imsi': 's',
+        'Eid': 's',
+        'OperatorIdentifier': 's',
+        'OperatorName': 's',
+        'EmergencyNumbers': 'as',
+        'PreferredNetworks': 'a(su)',
+        'Gid1': 'ay',
+        'Gid2': 'ay',
+        'SimType': 'u',
+        'EsimStatus': 'u',
+        'Removability': 'u',
+    },
+    'org.freedesktop.ModemManager1.Bearer': {
+        'Interface': 's',
+        'Connected': 'b',
+        'Suspended': 'b',
+        'Multiplexed': 'b',
+        'ConnectionError': '(ss)',
+        'Ip4Config': 'a{sv}',
+        'Ip6Config': 'a{sv}',
+        'Stats': 'a{sv}',
+        'ReloadStatsSupported': 'b',
+        'IpTimeout': 'u',
+        'BearerType': 'u',
+        'ProfileId': 'i',
+        'Properties': 'a{sv}',
+    },
+}
+
+# Signature of the values in the a{sv} dictionaries which ModemManager accepts as method arguments,
+# keyed by interface name, then by method name and then by dictionary key. Needed by the front ends
+# which cannot infer the D-Bus type of a Python integer on their own.
+_BearerPropertiesSignatures = {
+    'apn': 's',
+    'apn-type': 'u',
+    'ip-type': 'u',
+    'allowed-auth': 'u',
+    'user': 's',
+    'password': 's',
+    'access-type-preference': 'u',
+    'roaming-allowance': 'u',
+    'allow-roaming': 'b',
+    'rm-protocol': 'u',
+    'number': 's',
+    'profile-id': 'i',
+    'profile-name': 's',
+    'profile-enabled': 'b',
+    'profile-source': 'u',
+    'multiplex': 'u',
+}
+
+DictionarySignatures = {
+    'org.freedesktop.ModemManager1.Modem': {
+        'CreateBearer': _BearerPropertiesSignatures,
+    },
+    'org.freedesktop.ModemManager1.Modem.Simple': {
+        'Connect': {
+            **_BearerPropertiesSignatures,
+            'pin': 's',
+            'operator-id': 's',
+            'allowed-modes': 'u',
+            'preferred-mode': 'u',
+            'bands': 'au',
+        },
+    },
+    'org.freedesktop.ModemManager1.Modem.Messaging': {
+        'Create': {
+            'number': 's',
+            'text': 's',
+            'data': 'ay',
+            'smsc': 's',
+            'validity': 'u',
+            'class': 'i',
+            'delivery-report-request': 'b',
+            'storage': 'u',
+            'teleservice-id': 'u',
+            'service-category': 'u',
+        },
+    },
+}
+
+# Output signature of the methods which return a value, keyed by interface name and then by method
+# name. All the other methods reply without any arguments.
+ReplySignatures = {
+    'org.freedesktop.DBus.Properties': {
+        'Get': 'v',
+        'GetAll': 'a{sv}',
+    },
+    'org.freedesktop.DBus.ObjectManager': {
+        'GetManagedObjects': 'a{oa{sa{sv}}}',
+    },
+    'org.freedesktop.ModemManager1.Modem': {
+        'ListBearers': 'ao',
+        'CreateBearer': 'o',
+        'GetCellInfo': 'aa{sv}',
+        'Command': 's',
+    },
+    'org.freedesktop.ModemManager1.Modem.Simple': {
+        'Connect': 'o',
+        'GetStatus': 'a{sv}',
+    },
+    'org.freedesktop.ModemManager1.Modem.Modem3gpp': {
+        'Scan': 'aa{sv}',
+    },
+    'org.freedesktop.ModemManager1.Modem.Location': {
+        'GetLocation': 'a{uv}',
+    },
+    'org.freedesktop.ModemManager1.Modem.Messaging': {
+        'List': 'ao',
+        'Create': 'o',
+    },
+}
+
+# Signature of the signals emitted by ModemManager, keyed by interface name and then by signal name
+SignalSignatures = {
+    'org.freedesktop.DBus.Properties': {
+        'PropertiesChanged': 'sa{sv}as',
+    },
+    'org.freedesktop.DBus.ObjectManager': {
+        'InterfacesAdded': 'oa{sa{sv}}',
+        'InterfacesRemoved': 'oas',
+    },
+    'org.freedesktop.ModemManager1.Modem': {
+        'StateChanged': 'iiu',
+    },
+    'org.freedesktop.ModemManager1.Modem.Messaging': {
+        'Added': 'ob',
+        'Deleted': 'o',
+    },
+}
+
+
+def call_method(dbus_object, interface_name, method_name, *args, **kwargs):
+    '''Invokes a method on a proxy created without introspection, marshalling the arguments
+       according to its static signature. The keyword arguments are passed verbatim to dbus-python
+       (for example `timeout`, `reply_handler` and `error_handler`).'''
+
+    method = dbus_object.get_dbus_method(method_name, interface_name)
+    kwargs['signature'] = MethodSignatures[interface_name][method_name]
+
+    if instrumentation.enabled:
+        return instrumentation.instrumented_call(dbus_object, interface_name, method_name, method,
+                                                 args, kwargs)
+
+    return method(*args, **kwargs)
@@ -16,18 +16,15 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 '''Implementation of the Sim module'''
 
-from PyMM import ModemManagerBusName
+from PyMM.managed_object import ManagedObject
 
 
-class Sim:
+class Sim(ManagedObject):
     '''Represents a single Sim card managed by a specific Modem'''
 
-    _sim_interface_name = 'org.freedesktop.ModemManager1.Sim'
+    __slots__ = ()
 
-    def __init__(self, system_bus, sim_path):
-        self._system_bus = system_bus
-        self._path = sim_path
-        self._sim_object = self._system_bus.get_object(ModemManagerBusName, self._path)
+    _interface_name = 'org.freedesktop.ModemManager1.Sim'
 
     def __str__(self):
         return f'Sim @ {self._path}'
@@ -51,9 +48,5 @@ class Sim:
     def OperatorName(self):
         return self.get_property('OperatorName')
 
-    def SendPin(self, pin):
-        return self._sim_object.SendPin(pin, dbus_interface=self._sim_interface_name)
-
-    def get_property(self, property_name):
-        return self._sim_object.Get(self._sim_interface_name, property_name,
-                                    dbus_interface='org.freedesktop.DBus.Properties')
+    def SendPin(self, pin, **kwargs):
+        return self._call('SendPin', pin, **kwargs)
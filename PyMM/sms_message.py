@@ -0,0 +1,46 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Implementation of the sms_message module, which holds the plain contents of an SMS as read from
+   the bus by either `PyMM.messaging` or `PyMM.aio`. It must not depend on dbus-python.'''
+
+import time
+
+from PyMM.enums import SmsState
+
+
+class SmsMessage:
+    '''Contents of a single SMS, as read with one GetAll call (and completed from its
+       PropertiesChanged signals if it was still being received). The `properties` contain all the
+       properties of the Sms object.'''
+
+    __slots__ = ('path', 'modem_path', 'number', 'text', 'data', 'timestamp', 'state', 'storage',
+                 'properties', 'received_at')
+
+    def __init__(self, path, modem_path, properties):
+        self.path = path
+        self.modem_path = modem_path
+        self.number = properties.get('Number')
+        self.text = properties.get('Text')
+        self.data = properties.get('Data')
+        self.timestamp = properties.get('Timestamp')
+        self.state = SmsState(properties.get('State', 0))
+        self.storage = properties.get('Storage')
+        self.properties = properties
+        self.received_at = time.time()
+
+    def __repr__(self):
+        return f'SmsMessage({self.path}, from={self.number}, state={self.state.name})'
@@ -0,0 +1,178 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Implementation of the subscription module, which delivers the property changes of all the
+   ModemManager objects through a single match rule, coalesced per object path'''
+
+from gi.repository import GLib
+from PyMM import ModemManagerBusName
+from PyMM.properties import PropertiesInterfaceName
+
+
+class ChangeFilter:
+    '''Selects the property changes which a subscription receives. Each of `paths`, `interfaces`
+       and `properties` is a collection of the accepted object paths, interface names and property
+       names respectively, or None to accept all of them. Any callable with the same signature as
+       `__call__` can be used as a filter instead.'''
+
+    __slots__ = ('_paths', '_interfaces', '_properties')
+
+    def __init__(self, paths=None, interfaces=None, properties=None):
+        self._paths = None if paths is None else frozenset(paths)
+        self._interfaces = None if interfaces is None else frozenset(interfaces)
+        self._properties = None if properties is None else frozenset(properties)
+
+    def __call__(self, path, interface_name, property_name):
+        return ((self._paths is None or path in self._paths)
+                and (self._interfaces is None or interface_name in self._interfaces)
+                and (self._properties is None or property_name in self._properties))
+
+
+class Subscription:
+    '''Registration of a callback with ChangeDispatcher. The callback is invoked with a dictionary
+       keyed by object path, whose values are dictionaries keyed by interface name of the properties
+       which changed since the previous invocation, each with its latest value (or None if it was
+       invalidated). All the changes which arrive within `coalesce_ms` milliseconds of the first one
+       are merged into a single invocation.'''
+
+    __slots__ = ('_dispatcher', '_filter', '_callback', '_coalesce_ms', '_pending', '_timer_id',
+                 'signals', 'deliveries')
+
+    def __init__(self, dispatcher, filter, callback, coalesce_ms):
+        self._dispatcher = dispatcher
+        self._filter = filter
+        self._callback = callback
+        self._coalesce_ms = coalesce_ms
+        self._pending = {}
+        self._timer_id = None
+
+        # Number of PropertiesChanged signals which matched the filter and of callback invocations,
+        # whose ratio shows how much coalescing is taking place
+        self.signals = 0
+        self.deliveries = 0
+
+    def cancel(self):
+        '''Stops the delivery of changes. Changes which are still pending are discarded.'''
+
+        if self._timer_id is not None:
+            GLib.source_remove(self._timer_id)
+            self._timer_id = None
+
+        self._pending.clear()
+        self._dispatcher._remove(self)
+
+    def flush(self):
+        '''Delivers the pending changes immediately instead of waiting for the coalescing timer.'''
+
+        if self._timer_id is not None:
+            GLib.source_remove(self._timer_id)
+            self._timer_id = None
+
+        self._deliver()
+
+    def _add(self, path, interface_name, changed_properties, invalidated_properties):
+        changes = None
+        for property_name, value in changed_properties.items():
+            if self._filter is None or self._filter(path, interface_name, property_name):
+                if changes is None:
+                    changes = self._pending.setdefault(path, {}).setdefault(interface_name, {})
+                changes[property_name] = value
+
+        for property_name in invalidated_properties:
+            if self._filter is None or self._filter(path, interface_name, property_name):
+                if changes is None:
+                    changes = self._pending.setdefault(path, {}).setdefault(interface_name, {})
+                changes[property_name] = None
+
+        if changes is None:
+            return
+
+        self.signals += 1
+        if self._timer_id is None:
+            self._timer_id = GLib.timeout_add(self._coalesce_ms, self._on_timer)
+
+    def _on_timer(self):
+        self._timer_id = None
+        self._deliver()
+        return False
+
+    def _deliver(self):
+        if not self._pending:
+            return
+
+        changes, self._pending = self._pending, {}
+        self.deliveries += 1
+        self._callback(changes)
+
+
+class ChangeDispatcher:
+    '''Listens for PropertiesChanged from every object of the ModemManager service with one
+       wildcard match rule, instead of one per proxy, and fans the changes out to the subscriptions.
+       The match rule is only added while there is at least one subscription.'''
+
+    __slots__ = ('_bus', '_signal_match', '_subscriptions')
+
+    def __init__(self, bus):
+        self._bus = bus
+        self._signal_match = None
+        self._subscriptions = []
+
+    @property
+    def subscriptions(self):
+        return list(self._subscriptions)
+
+    def subscribe(self, filter, callback, coalesce_ms=100):
+        '''Registers `callback` for the changes accepted by `filter` (a ChangeFilter, a callable or
+           None for all changes) and returns the Subscription.'''
+
+        subscription = Subscription(self, filter, callback, coalesce_ms)
+        self._subscriptions.append(subscription)
+
+        if self._signal_match is None:
+            self._add_signal_match()
+
+        return subscription
+
+    def rebind(self, bus):
+        '''Moves the match rule (if any) to a new connection to the same bus, after reconnecting.'''
+
+        self._bus = bus
+        if self._signal_match is not None:
+            self._add_signal_match()
+
+    def close(self):
+        for subscription in list(self._subscriptions):
+            subscription.cancel()
+
+    def _add_signal_match(self):
+        self._signal_match = self._bus.add_signal_receiver(self._on_properties_changed,
+                                                           signal_name='PropertiesChanged',
+                                                           dbus_interface=PropertiesInterfaceName,
+                                                           bus_name=ModemManagerBusName,
+                                                           path_keyword='path')
+
+    def _remove(self, subscription):
+        if subscription in self._subscriptions:
+            self._subscriptions.remove(subscription)
+
+        if not self._subscriptions and self._signal_match is not None:
+            self._signal_match.remove()
+            self._signal_match = None
+
+    def _on_properties_changed(self, interface_name, changed_properties, invalidated_properties,
+                               path=None):
+        for subscription in tuple(self._subscriptions):
+            subscription._add(path, interface_name, changed_properties, invalidated_properties)
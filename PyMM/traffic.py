@@ -0,0 +1,235 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Implementation of the traffic module, which turns the statistics of the bearers into a stream of
+   throughput samples'''
+
+import time
+
+from collections import deque
+from PyMM.mainloop import run_until
+from PyMM.ring_buffer import ColumnarRingBuffer
+
+
+class TrafficSample:
+    '''Throughput of a single bearer over the interval since its previous Stats update. The
+       `timestamp` comes from `time.monotonic()` and `wall_time` from `time.time()`.'''
+
+    __slots__ = ('bearer_path', 'timestamp', 'wall_time', 'interval', 'rx_rate', 'tx_rate',
+                 'counter_reset')
+
+    def __init__(self, bearer_path, timestamp, wall_time, interval, rx_rate, tx_rate,
+                 counter_reset):
+        self.bearer_path = bearer_path
+        self.timestamp = timestamp
+        self.wall_time = wall_time
+        self.interval = interval
+        self.rx_rate = rx_rate
+        self.tx_rate = tx_rate
+        self.counter_reset = counter_reset
+
+    def __repr__(self):
+        return (f'TrafficSample({self.bearer_path}, rx={self.rx_rate:.0f}B/s, '
+                f'tx={self.tx_rate:.0f}B/s, interval={self.interval:.1f}s)')
+
+
+class _BearerState:
+    __slots__ = ('signal_match', 'rx_bytes', 'tx_bytes', 'updated_at', 'disconnected_at',
+                 'counter_resets', 'throughput', 'outages')
+
+    def __init__(self, signal_match, capacity):
+        self.signal_match = signal_match
+        self.rx_bytes = None
+        self.tx_bytes = None
+        self.updated_at = None
+        self.disconnected_at = None
+        self.counter_resets = 0
+        self.throughput = ColumnarRingBuffer(capacity, [('rx_rate', 'd'), ('tx_rate', 'd'),
+                                                        ('wall_time', 'd')])
+        self.outages = ColumnarRingBuffer(capacity, [('duration', 'd'), ('wall_time', 'd')])
+
+
+class BearerTrafficSampler:
+    '''Converts the cumulative rx/tx byte counters which ModemManager periodically publishes in the
+       Stats property of the connected bearers into per-interval throughput (in bytes per second).
+       Counters going backwards (which happens when the bearer reconnects) are detected and the time
+       spent disconnected is recorded as an outage. The history of every bearer is kept in
+       ColumnarRingBuffer instances of `capacity` rows and the samples are also queued for the
+       `samples` generator and passed to the callbacks registered with `connect_sample`. All the
+       intervals are measured with `time.monotonic()`, so that setting the system clock can neither
+       distort the rates nor the outages.'''
+
+    def __init__(self, capacity=2880, queue_length=10000):
+        self._capacity = capacity
+        self._bearers = {}
+        self._modem_matches = {}
+        self._queue = deque(maxlen=queue_length)
+        self._callbacks = []
+
+    def attach(self, modem_manager):
+        '''Samples the bearers of all the modems of `modem_manager`, including the modems which
+           appear and the bearers which are created later.'''
+
+        for modem in modem_manager.managed_modems.values():
+            self.add_modem(modem)
+
+        modem_manager.connect_modem_added(self.add_modem)
+        modem_manager.connect_modem_removed(self.remove_modem)
+
+    def add_modem(self, modem):
+        '''Samples the current bearers of the modem and follows its Bearers property.'''
+
+        if modem.path in self._modem_matches:
+            return
+
+        def on_modem_properties_changed(interface_name, changed_properties, invalidated):
+            if 'Bearers' in changed_properties:
+                self._sync_bearers(modem, changed_properties['Bearers'])
+
+        self._modem_matches[modem.path] = (
+            modem.connect_to_properties_changed(on_modem_properties_changed), set())
+        self._sync_bearers(modem, modem.get_property('Bearers'))
+
+    def remove_modem(self, modem):
+        signal_match, bearer_paths = self._modem_matches.pop(modem.path, (None, ()))
+        if signal_match is not None:
+            signal_match.remove()
+
+        for bearer_path in bearer_paths:
+            self.remove_bearer(bearer_path)
+
+    def add_bearer(self, bearer):
+        if bearer.path in self._bearers:
+            return
+
+        state = _BearerState(
+            bearer.connect_to_properties_changed(
+                lambda interface_name, changed, invalidated: self._on_bearer_properties_changed(
+                    bearer.path, changed)), self._capacity)
+        self._bearers[bearer.path] = state
+
+        if not bearer.Connected:
+            state.disconnected_at = time.monotonic()
+
+        self._update_stats(bearer.path, state, bearer.Stats)
+
+    def remove_bearer(self, bearer_path):
+        state = self._bearers.pop(bearer_path, None)
+        if state is not None:
+            state.signal_match.remove()
+
+    def close(self):
+        for signal_match, _ in self._modem_matches.values():
+            signal_match.remove()
+        for state in self._bearers.values():
+            state.signal_match.remove()
+
+        self._modem_matches.clear()
+        self._bearers.clear()
+
+    def throughput(self, bearer_path):
+        '''Returns the ColumnarRingBuffer with the (timestamp, rx_rate, tx_rate, wall_time) history
+           of the bearer or None if it is not being sampled.'''
+
+        state = self._bearers.get(bearer_path)
+        return None if state is None else state.throughput
+
+    def outages(self, bearer_path):
+        '''Returns the ColumnarRingBuffer with the (reconnected timestamp, duration, wall_time) of
+           every outage of the bearer or None if it is not being sampled.'''
+
+        state = self._bearers.get(bearer_path)
+        return None if state is None else state.outages
+
+    def counter_resets(self, bearer_path):
+        state = self._bearers.get(bearer_path)
+        return 0 if state is None else state.counter_resets
+
+    def connect_sample(self, callback):
+        '''Registers a callback, which will be invoked with every TrafficSample.'''
+
+        self._callbacks.append(callback)
+
+    def samples(self, timeout=None):
+        '''Generator which yields TrafficSample objects as the bearers publish their statistics,
+           dispatching the GLib main context while there are none. Stops if no sample arrives
+           within `timeout` seconds (waits forever if None).'''
+
+        while True:
+            if not run_until(lambda: len(self._queue) > 0, timeout):
+                return
+
+            yield self._queue.popleft()
+
+    def _sync_bearers(self, modem, bearer_paths):
+        tracked = self._modem_matches[modem.path][1]
+
+        for bearer_path in tracked - set(bearer_paths):
+            self.remove_bearer(bearer_path)
+            tracked.discard(bearer_path)
+
+        # The paths come from the signal, because in the SNAPSHOT property mode the Bearers property
+        # of the modem is not updated
+        for bearer_path in bearer_paths:
+            if bearer_path not in tracked:
+                self.add_bearer(modem.bearer_by_path(bearer_path))
+                tracked.add(bearer_path)
+
+    def _on_bearer_properties_changed(self, bearer_path, changed_properties):
+        state = self._bearers.get(bearer_path)
+        if state is None:
+            return
+
+        if 'Connected' in changed_properties:
+            now = time.monotonic()
+            if not changed_properties['Connected']:
+                state.disconnected_at = now
+            elif state.disconnected_at is not None:
+                state.outages.append(now, now - state.disconnected_at, time.time())
+                state.disconnected_at = None
+
+        if 'Stats' in changed_properties:
+            self._update_stats(bearer_path, state, changed_properties['Stats'])
+
+    def _update_stats(self, bearer_path, state, stats):
+        if 'rx-bytes' not in stats or 'tx-bytes' not in stats:
+            return
+
+        now = time.monotonic()
+        rx_bytes = int(stats['rx-bytes'])
+        tx_bytes = int(stats['tx-bytes'])
+
+        if state.updated_at is not None and now > state.updated_at:
+            # After a reconnect the per-connection counters restart from zero, so everything they
+            # have accumulated so far has been transferred since the previous sample
+            counter_reset = rx_bytes < state.rx_bytes or tx_bytes < state.tx_bytes
+            if counter_reset:
+                state.counter_resets += 1
+                rx_delta, tx_delta = rx_bytes, tx_bytes
+            else:
+                rx_delta, tx_delta = rx_bytes - state.rx_bytes, tx_bytes - state.tx_bytes
+
+            interval = now - state.updated_at
+            sample = TrafficSample(bearer_path, now, time.time(), interval, rx_delta / interval,
+                                   tx_delta / interval, counter_reset)
+            state.throughput.append(now, sample.rx_rate, sample.tx_rate, sample.wall_time)
+            self._queue.append(sample)
+            for callback in self._callbacks:
+                callback(sample)
+
+        state.rx_bytes = rx_bytes
+        state.tx_bytes = tx_bytes
+        state.updated_at = now
@@ -17,226 +17,434 @@
 # NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
 # DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
-'''Script which demonstrates the capabilities of the PyMM package'''
+'''Script which demonstrates the capabilities of the PyMM package with a live dashboard of all the
+   modems. The table is loaded once from the snapshot of the modems and is then updated only from
+   the coalesced property changes and the bearer traffic samples, and only the cells which changed
+   are redrawn. Keyboard input is dispatched by the same GLib main loop, so the screen never blocks
+   on ModemManager and all the actions are non-blocking calls.
 
+   Usage: python PyMMDemo.py [--bus-address <address>] [--apn <apn>] [--fake-modems 100]'''
+
+import argparse
 import curses
 import dbus
 import logging
+import sys
 
-from PyMM import ModemManager
+from gi.repository import GLib
+from PyMM import ModemManager, PropertyMode
+from PyMM.decoding import decode_access_technologies
+from PyMM.messaging import MessageIntake, SendQueue
 from PyMM.modem import ModemState
+from PyMM.subscription import ChangeFilter
+from PyMM.traffic import BearerTrafficSampler
 
-###
-### Infrastructure classes
-###
+ModemInterfaceName = 'org.freedesktop.ModemManager1.Modem'
 
+# Modem properties shown by the dashboard, which are the only ones it subscribes to
+DisplayedProperties = ('State', 'SignalQuality', 'AccessTechnologies', 'Bearers')
 
-class Screen:
-    '''Represents a generic Screen functionality in the application.'''
+# Title and width of every column of the table
+Columns = (('Modem', 6), ('Model', 24), ('State', 14), ('Signal', 6), ('Access', 14), ('Rx', 11),
+           ('Tx', 11))
 
-    def __init__(self, screen_title, mm):
-        self._win = curses.newwin(curses.LINES - 1, curses.COLS - 1, 0, 0)
+HeaderRows = 2
+FooterRows = 3
 
-        self._screen_title = screen_title
-        self._mm = mm
+# Minimum interval between two redraws, so that bursts of changes result in a single one
+RedrawIntervalMs = 50
+
+HelpText = ('Up/Down select  (E)nable  (R)eset  (C)onnect  (D)isconnect  (U)nlock SIM  (S)end SMS  '
+            '(Q)uit')
 
-        self._current_row = 0
-        self._choices = {}
+###
+### Model
+###
 
-    def __show__(self):
-        assert ('This method must not be reached')
 
-    def add_row(self, indent, s, format=curses.A_NORMAL):
-        self._win.addstr(self._current_row, indent, s, format)
-        self._current_row += 1
+def short_name(value, prefix):
+    return value.name[len(prefix):] if value.name.startswith(prefix) else value.name
 
-    def add_choice(self, s, function, format=curses.A_NORMAL):
-        shortcut = str(len(self._choices))
-        self._choices[shortcut] = function
 
-        self.add_row(1, f'({shortcut}) - {s}', format)
+def format_rate(bytes_per_second):
+    for unit in ('B/s', 'kB/s', 'MB/s'):
+        if bytes_per_second < 1000:
+            return f'{bytes_per_second:.0f} {unit}'
+        bytes_per_second /= 1000
 
-    def show(self):
-        while True:
-            self._win.clear()
+    return f'{bytes_per_second:.0f} GB/s'
 
-            self._current_row = 0
-            self._choices = {}
 
-            self.add_row(0, self._screen_title, curses.A_BOLD)
-            self.add_row(0, '')
+class ModemRow:
+    '''Displayed state of a single modem. Redraws are served from here and never go to the bus.'''
 
-            self.__show__()
+    __slots__ = ('modem', 'model', 'state', 'signal_quality', 'access_technologies', 'bearers',
+                 'rates')
 
-            self.add_row(1, '')
-            self.add_row(1, '(Q) - Quit / Previous')
+    def __init__(self, modem):
+        self.modem = modem
+        self.model = f'{modem.Manufacturer} {modem.Model}'
+        self.state = modem.State
+        self.signal_quality = int(modem.SignalQuality[0])
+        self.access_technologies = int(modem.get_property('AccessTechnologies'))
+        self.bearers = set(modem.get_property('Bearers'))
 
-            key = self._win.getkey()
-            if key == 'q' or key == 'Q':
-                break
+        # Last (rx, tx) throughput of every bearer of the modem
+        self.rates = {}
 
-            if key in self._choices:
-                self._choices[key]()
+    def update(self, changed_properties):
+        '''Applies the changed properties of the modem. Invalidated properties (None) are kept at
+           their last value until they change again.'''
 
+        if changed_properties.get('State') is not None:
+            self.state = ModemState(changed_properties['State'])
+        if changed_properties.get('SignalQuality') is not None:
+            self.signal_quality = int(changed_properties['SignalQuality'][0])
+        if changed_properties.get('AccessTechnologies') is not None:
+            self.access_technologies = int(changed_properties['AccessTechnologies'])
+        if changed_properties.get('Bearers') is not None:
+            self.bearers = set(changed_properties['Bearers'])
+            for bearer_path in set(self.rates) - self.bearers:
+                del self.rates[bearer_path]
 
-class ModemScreen(Screen):
-    '''Represents a specialisation of Screen which operates on a specific modem.'''
+    def cells(self):
+        access_technologies = '/'.join(
+            short_name(technology, 'MM_MODEM_ACCESS_TECHNOLOGY_')
+            for technology in sorted(decode_access_technologies(self.access_technologies))) or '-'
 
-    def __init__(self, screen_title, mm, modem):
-        super().__init__(screen_title, mm)
-        self._modem = modem
+        return (self.modem.path.rsplit('/', 1)[-1], self.model,
+                short_name(self.state,
+                           'MM_MODEM_STATE_'), f'{self.signal_quality}%', access_technologies,
+                format_rate(sum(rx for rx, _ in self.rates.values())),
+                format_rate(sum(tx for _, tx in self.rates.values())))
 
 
 ###
-### Specific screen implementations below
+### Dashboard
 ###
 
 
-class SelectModem(Screen):
-    '''Screen which prompts the caller to select a modem from the set of available modems and
-       returns the new selection. If (P) is pressed, returns current_modem.'''
+class Dashboard:
+    '''Live table of all the modems, with the selected modem as the target of the actions. The
+       cells last written to the screen are remembered, so a redraw only writes the ones whose text
+       or attributes changed.'''
 
-    def __init__(self, mm, current_modem):
-        super().__init__('Select modem', mm)
-        self._current_modem = current_modem
+    def __init__(self, stdscr, mm, connect_properties):
+        self._stdscr = stdscr
+        self._mm = mm
+        self._connect_properties = connect_properties
+        self._loop = GLib.MainLoop()
 
-    def __show__(self):
+        self._rows = {}
+        self._order = []
+        self._bearer_modems = {}
+        self._selected = 0
+        self._top = 0
 
-        def select_modem(m):
-            self._current_modem = m
+        self._screen = {}
+        self._redraw_timer_id = None
+        self._status = ''
+        self._prompt = None
 
-        for modem in [None] + list(self._mm.managed_modems.values()):
-            self.add_choice(modem, lambda modem=modem: select_modem(modem),
-                            curses.A_BOLD if self.selected_modem == modem else curses.A_NORMAL)
+        self._send_queue = SendQueue()
 
-    @property
-    def selected_modem(self):
-        return self._current_modem
+        curses.curs_set(0)
+        stdscr.nodelay(True)
+        stdscr.keypad(True)
 
+        self._subscription = mm.subscribe(
+            ChangeFilter(interfaces=(ModemInterfaceName, ), properties=DisplayedProperties),
+            self._on_changes)
 
-class UnlockModem(ModemScreen):
-    '''Screen which prompts the caller to unlock a locked modem by entering a PIN.'''
+        for modem in mm.managed_modems.values():
+            self._add_modem(modem)
 
-    def __init__(self, mm, modem):
-        super().__init__('Unlock modem', mm, modem)
+        mm.connect_modem_added(self._add_modem)
+        mm.connect_modem_removed(self._remove_modem)
 
-    def __show__(self):
-        curses.echo()
+        self._sampler = BearerTrafficSampler(capacity=60)
+        self._sampler.attach(mm)
+        self._sampler.connect_sample(self._on_sample)
 
-        self.add_row(0, 'Enter PIN: ')
-        PIN = self._win.getstr(4).decode('utf-8')
-        self._modem.Sim.SendPin(PIN)
+        self._intake = MessageIntake()
+        self._intake.attach(mm)
+        self._intake.connect_message_received(
+            lambda message: self._set_status(f'SMS from {message.number}: {message.text}'))
 
+        GLib.io_add_watch(sys.stdin.fileno(), GLib.IO_IN, self._on_input)
 
-class ReceivedSMS(ModemScreen):
-    '''Screen which shows the received SMS(s).'''
+        self._schedule_redraw()
 
-    def __init__(self, mm, modem):
-        super().__init__('Received SMS', mm, modem)
+    def run(self):
+        '''Runs the main loop until the user quits.'''
 
-    def __show__(self):
-        self.add_row(1, '(P) Back to the previous menu')
+        try:
+            self._loop.run()
+        finally:
+            self._subscription.cancel()
+            self._sampler.close()
+            self._intake.close()
 
-        while True:
-            key = self._win.getkey()
-            if key == 'p' or key == 'P':
-                break
+    @property
+    def selected_modem(self):
+        return self._rows[self._order[self._selected]].modem if self._order else None
 
+    ## Model updates
 
-class SendSMS(ModemScreen):
-    '''Screen which allows an SMS to be sent.'''
+    def _add_modem(self, modem):
+        row = ModemRow(modem)
+        self._rows[modem.path] = row
+        self._order.append(modem.path)
+        for bearer_path in row.bearers:
+            self._bearer_modems[bearer_path] = modem.path
 
-    def __init__(self, mm, modem):
-        super().__init__('Send SMS', mm, modem)
+        self._schedule_redraw()
 
-    def __show__(self):
-        self.add_row(1, '(P) Back to the previous menu')
+    def _remove_modem(self, modem):
+        row = self._rows.pop(modem.path, None)
+        if row is None:
+            return
 
-        while True:
-            key = self._win.getkey()
-            if key == 'p' or key == 'P':
-                break
+        self._order.remove(modem.path)
+        self._selected = min(self._selected, max(len(self._order) - 1, 0))
+        for bearer_path in row.bearers:
+            self._bearer_modems.pop(bearer_path, None)
 
+        self._schedule_redraw()
 
-class Internet(ModemScreen):
-    '''Screen to manage the internet connections of the modem.'''
+    def _on_changes(self, changes):
+        for path, interfaces in changes.items():
+            row = self._rows.get(path)
+            if row is None:
+                continue
 
-    def __init__(self, mm, modem):
-        super().__init__('Internet', mm, modem)
-        self._modem_simple = modem.simple_interface
+            row.update(interfaces.get(ModemInterfaceName, {}))
+            for bearer_path in row.bearers:
+                self._bearer_modems[bearer_path] = path
 
-    def __show__(self):
-        self.add_choice('Connect', lambda: self.connect())
-        self.add_choice('Disconnect', lambda: self.disconnect())
+        self._schedule_redraw()
 
-    def connect(self):
-        self._modem_simple.Connect({
-            'apn': 'telefonica.es',
-            'user': 'telefonica',
-            'password': 'telefonica',
-        })
-        pass
+    def _on_sample(self, sample):
+        row = self._rows.get(self._bearer_modems.get(sample.bearer_path))
+        if row is None:
+            return
 
-    def disconnect(self):
-        self._modem_simple.Disconnect()
-        pass
+        row.rates[sample.bearer_path] = (sample.rx_rate, sample.tx_rate)
+        self._schedule_redraw()
 
+    def _set_status(self, status):
+        self._status = status
+        self._schedule_redraw()
 
-class MainScreen(Screen):
-    '''The main screen of the application.'''
+    ## Actions
 
-    def __init__(self, stdscr, mm):
-        super().__init__(f'ModemManager {mm.Version} with {len(mm.managed_modems)} managed modems',
-                         mm)
+    def _call(self, description, method, *args):
+        '''Invokes a non-blocking method of the selected modem and reports the outcome.'''
 
-        if len(mm.managed_modems) > 0:
-            self._modem = list(mm.managed_modems.values())[0]
-        else:
-            self._modem = None
+        modem = self.selected_modem
+        if modem is None:
+            return
+
+        self._set_status(f'{description} {modem}...')
+        method(modem)(
+            *args, reply_handler=lambda *reply: self._set_status(f'{description} {modem}: done'),
+            error_handler=lambda error: self._set_status(f'{description} {modem} failed: {error}'))
 
-    def __show__(self):
-        self.add_row(0, f'Active modem: {self._modem}', curses.A_BOLD)
+    def _unlock(self, pin):
+        self._call('Unlock', lambda modem: modem.Sim.SendPin, pin)
 
-        if self._modem:
-            self.add_row(1, f'Manufacturer: {self._modem.Manufacturer}')
-            self.add_row(1, f'State: {self._modem.State.name}')
+    def _send_sms(self, number, text):
+        modem = self.selected_modem
+        if modem is None:
+            return
 
-            if self._modem.State > ModemState.MM_MODEM_STATE_INITIALIZING:
-                self.add_row(1, f'Signal quality: {self._modem.SignalQuality}')
-                self.add_row(1, f'Carrier configuration: {self._modem.CarrierConfiguration}')
-                self.add_row(
-                    1,
-                    f'SIM IMEI: {self._modem.Sim.SimIdentifier}, SIM IMSI: {self._modem.Sim.Imsi}')
+        def on_sent(request):
+            self._set_status(f'SMS to {number}: ' +
+                             ('sent' if request.ok else f'failed: {request.error}'))
 
-        self.add_row(0, '')
-        self.add_row(0, 'Select an option from the menu:', curses.A_STANDOUT)
-        self.add_row(0, '')
+        self._set_status(f'Sending SMS to {number}...')
+        self._send_queue.send(modem, number, text, callback=on_sent)
 
-        def select_modem():
-            selector = SelectModem(self._mm, self._modem)
-            selector.show()
+    ## Input
 
-            self._modem = selector.selected_modem
+    def _on_input(self, source, condition):
+        while True:
+            try:
+                key = self._stdscr.get_wch()
+            except curses.error:
+                # No more input is pending
+                return True
+
+            if self._prompt is not None:
+                self._on_prompt_key(key)
+            else:
+                self._on_key(key)
+
+    def _on_key(self, key):
+        if key in ('q', 'Q'):
+            self._loop.quit()
+        elif key in (curses.KEY_UP, 'k'):
+            self._select(self._selected - 1)
+        elif key in (curses.KEY_DOWN, 'j'):
+            self._select(self._selected + 1)
+        elif key == curses.KEY_PPAGE:
+            self._select(self._selected - self._visible_rows())
+        elif key == curses.KEY_NPAGE:
+            self._select(self._selected + self._visible_rows())
+        elif key == curses.KEY_HOME:
+            self._select(0)
+        elif key == curses.KEY_END:
+            self._select(len(self._order) - 1)
+        elif key == curses.KEY_RESIZE:
+            self._stdscr.clear()
+            self._screen.clear()
+            self._schedule_redraw()
+        elif key in ('e', 'E'):
+            self._call('Enable', lambda modem: modem.Enable)
+        elif key in ('r', 'R'):
+            self._call('Reset', lambda modem: modem.Reset)
+        elif key in ('c', 'C'):
+            self._call('Connect', lambda modem: modem.simple_interface.Connect,
+                       self._connect_properties)
+        elif key in ('d', 'D'):
+            self._call('Disconnect', lambda modem: modem.simple_interface.Disconnect)
+        elif key in ('u', 'U'):
+            self._ask('PIN', self._unlock)
+        elif key in ('s', 'S'):
+            self._ask('Number',
+                      lambda number: self._ask('Text', lambda text: self._send_sms(number, text)))
+
+    def _ask(self, label, on_done):
+        self._prompt = [label, '', on_done]
+        self._schedule_redraw()
+
+    def _on_prompt_key(self, key):
+        label, text, on_done = self._prompt
+
+        if key in ('\n', '\r', curses.KEY_ENTER):
+            self._prompt = None
+            on_done(text)
+        elif key == '\x1b':
+            self._prompt = None
+        elif key in (curses.KEY_BACKSPACE, '\x7f', '\b'):
+            self._prompt[1] = text[:-1]
+        elif isinstance(key, str) and key.isprintable():
+            self._prompt[1] = text + key
+
+        self._schedule_redraw()
+
+    def _select(self, index):
+        self._selected = min(max(index, 0), max(len(self._order) - 1, 0))
+        self._schedule_redraw()
+
+    ## Rendering
+
+    def _visible_rows(self):
+        lines, _ = self._stdscr.getmaxyx()
+        return max(lines - HeaderRows - FooterRows, 1)
+
+    def _schedule_redraw(self):
+        if self._redraw_timer_id is None:
+            self._redraw_timer_id = GLib.timeout_add(RedrawIntervalMs, self._redraw)
+
+    def _put(self, y, x, text, attributes=curses.A_NORMAL):
+        _, cols = self._stdscr.getmaxyx()
+        text = text[:max(cols - 1 - x, 0)]
+        if not text or self._screen.get((y, x)) == (text, attributes):
+            return
+
+        self._screen[(y, x)] = (text, attributes)
+        try:
+            self._stdscr.addstr(y, x, text, attributes)
+        except curses.error:
+            # The window is shorter than the layout
+            pass
+
+    def _redraw(self):
+        self._redraw_timer_id = None
+
+        lines, cols = self._stdscr.getmaxyx()
+        visible_rows = self._visible_rows()
+        if self._selected < self._top:
+            self._top = self._selected
+        elif self._selected >= self._top + visible_rows:
+            self._top = self._selected - visible_rows + 1
+
+        self._put(0, 0, f'ModemManager with {len(self._order)} managed modems'.ljust(cols - 1),
+                  curses.A_BOLD)
+        x = 0
+        for title, width in Columns:
+            self._put(1, x, title.ljust(width), curses.A_UNDERLINE)
+            x += width + 1
+
+        for row_index in range(visible_rows):
+            index = self._top + row_index
+            if index < len(self._order):
+                cells = self._rows[self._order[index]].cells()
+                attributes = curses.A_REVERSE if index == self._selected else curses.A_NORMAL
+            else:
+                cells = ('', ) * len(Columns)
+                attributes = curses.A_NORMAL
+
+            x = 0
+            for (_, width), cell in zip(Columns, cells):
+                self._put(HeaderRows + row_index, x, cell[:width].ljust(width), attributes)
+                x += width + 1
+
+        modem = self.selected_modem
+        row = self._rows[modem.path] if modem is not None else None
+        details = '' if row is None else (f'{modem}: {modem.EquipmentIdentifier}, '
+                                          f'{len(row.bearers)} bearer(s)')
+        if self._prompt is not None:
+            footer = f'{self._prompt[0]}: {self._prompt[1]}_'
+        else:
+            footer = HelpText
 
-        self.add_choice('Select modem', select_modem)
+        for y, text in enumerate((details, self._status, footer), lines - FooterRows):
+            self._put(y, 0, text.ljust(cols - 1),
+                      curses.A_STANDOUT if y == lines - 1 else curses.A_NORMAL)
 
-        if self._modem:
-            self.add_choice('Unlock SIM', lambda: UnlockModem(self._mm, self._modem).show())
-            self.add_choice('Send SMS', lambda: SendSMS(self._mm, self._modem).show())
-            self.add_choice('Received SMS', lambda: ReceivedSMS(self._mm, self._modem).show())
-            self.add_choice('Internet', lambda: Internet(self._mm, self._modem).show())
-            self.add_choice('Enable active modem', lambda: self._modem.Enable())
-            self.add_choice('Reset active modem', lambda: self._modem.Reset())
-            self.add_choice('Refresh', lambda: None)
+        self._stdscr.noutrefresh()
+        curses.doupdate()
+        return False
 
 
 def application_main():
     '''Main entrypoint for the PyMMDemo application'''
 
+    parser = argparse.ArgumentParser(description='Live dashboard of the modems of ModemManager')
+    parser.add_argument('--bus-address',
+                        help='Address of the bus of ModemManager (defaults to the system bus)')
+    parser.add_argument('--apn', default='internet', help='APN used by the Connect action')
+    parser.add_argument('--user', help='User name used by the Connect action')
+    parser.add_argument('--password', help='Password used by the Connect action')
+    parser.add_argument('--fake-modems', type=int, default=0,
+                        help='Runs against a fake ModemManager with this many modems instead')
+    args = parser.parse_args()
+
     logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(message)s')
 
+    connect_properties = {'apn': args.apn}
+    if args.user:
+        connect_properties['user'] = args.user
+    if args.password:
+        connect_properties['password'] = args.password
+
+    if args.fake_modems:
+        from PyMM.fake_modem_manager import FakeModemManagerProcess, PrivateBus
+
+        with PrivateBus() as private_bus, FakeModemManagerProcess(private_bus.address,
+                                                                  args.fake_modems,
+                                                                  signal_interval=1,
+                                                                  stats_interval=1):
+            run_dashboard(private_bus.address, connect_properties)
+    else:
+        run_dashboard(args.bus_address, connect_properties)
+
+
+def run_dashboard(bus_address, connect_properties):
     try:
-        mm = ModemManager()
+        mm = ModemManager(property_mode=PropertyMode.SNAPSHOT, bus_address=bus_address)
     except dbus.exceptions.DBusException:
         logging.exception(
             'Exception caught instantiating the ModemManager service. Most likely cause is that the service has not been started.'
@@ -245,7 +453,8 @@ def application_main():
 
     logging.info(f'Found {mm} {mm.all_properties}')
 
-    curses.wrapper(lambda stdscr: MainScreen(stdscr, mm).show())
+    with mm:
+        curses.wrapper(lambda stdscr: Dashboard(stdscr, mm, connect_properties).run())
 
 
 if __name__ == '__main__':
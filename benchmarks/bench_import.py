@@ -0,0 +1,128 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Benchmark of the cold-start cost of the PyMM package. Every sample imports the package in a
+   fresh interpreter, so nothing is cached in `sys.modules`, and reports the p50/p99 wall-clock time
+   of the import on top of a bare interpreter, together with whether it loaded dbus-python or GLib.
+   The scenarios which create a ModemManager run against the fake service on a private bus.
+
+   Usage: python benchmarks/bench_import.py [--iterations 20]'''
+
+import argparse
+import contextlib
+import json
+import math
+import os
+import subprocess
+import sys
+
+Root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, Root)
+
+# Statement to time, for each scenario. Statements which refer to {address} need the fake service.
+Scenarios = [
+    ('import PyMM', 'import PyMM'),
+    ('import PyMM.signatures', 'import PyMM.signatures'),
+    ('from PyMM import PropertyMode', 'from PyMM import PropertyMode'),
+    ('from PyMM import ModemManager', 'from PyMM import ModemManager'),
+    ('ModemManager(mainloop=None)', 'from PyMM import ModemManager\n'
+     'ModemManager(mainloop=None, bus_address={address!r}).managed_modems'),
+    ("ModemManager(mainloop='glib')", 'from PyMM import ModemManager\n'
+     "ModemManager(mainloop='glib', bus_address={address!r}).managed_modems"),
+]
+
+# Address of the bus of the fake service, once started
+_FakeService = {}
+
+_Probe = '''
+import json, sys, time
+started_at = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - started_at
+print(json.dumps([elapsed, 'dbus' in sys.modules, 'gi.repository.GLib' in sys.modules,
+                  'dbus.mainloop.glib' in sys.modules]))
+'''
+
+
+def sample(statement):
+    '''Runs `statement` in a fresh interpreter and returns its import time and the stacks loaded.'''
+
+    output = subprocess.run(
+        [sys.executable, '-c', _Probe.replace('{statement}', statement)], cwd=Root,
+        capture_output=True, text=True, check=True).stdout
+    return json.loads(output)
+
+
+def percentile(values, percentile):
+    rank = max(math.ceil(len(values) * percentile / 100) - 1, 0)
+    return sorted(values)[rank]
+
+
+def fake_service(stack):
+    '''Starts the fake service with one modem on a private bus (once) and returns its address or
+       None if it cannot be started here.'''
+
+    if 'address' not in _FakeService:
+        try:
+            from PyMM.fake_modem_manager import FakeModemManagerProcess, PrivateBus
+
+            private_bus = stack.enter_context(PrivateBus())
+            stack.enter_context(FakeModemManagerProcess(private_bus.address, 1))
+            _FakeService['address'] = private_bus.address
+        except (ImportError, OSError, RuntimeError):
+            _FakeService['address'] = None
+
+    return _FakeService['address']
+
+
+def run_scenario(name, statement, iterations):
+    try:
+        samples = [sample(statement) for _ in range(iterations)]
+    except subprocess.CalledProcessError as e:
+        print(f'{name:<36} failed: {e.stderr.strip().splitlines()[-1]}', flush=True)
+        return
+
+    latencies = [elapsed for elapsed, *_ in samples]
+    _, dbus_loaded, glib_loaded, mainloop_loaded = samples[-1]
+
+    print(
+        f'{name:<36} {percentile(latencies, 50) * 1000:>10.3f} '
+        f'{percentile(latencies, 99) * 1000:>10.3f} {"yes" if dbus_loaded else "no":>6} '
+        f'{"yes" if glib_loaded else "no":>6} {"yes" if mainloop_loaded else "no":>10}', flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PyMM import-time benchmark')
+    parser.add_argument('--iterations', type=int, default=20, help='Interpreters per scenario')
+    args = parser.parse_args()
+
+    print(f'{"scenario":<36} {"p50 (ms)":>10} {"p99 (ms)":>10} {"dbus":>6} {"GLib":>6} '
+          f'{"main loop":>10}')
+
+    with contextlib.ExitStack() as stack:
+        for name, statement in Scenarios:
+            if '{address' in statement:
+                address = fake_service(stack)
+                if address is None:
+                    print(f'{name:<36} skipped: the fake service could not be started', flush=True)
+                    continue
+                statement = statement.format(address=address)
+
+            run_scenario(name, statement, args.iterations)
+
+
+if __name__ == '__main__':
+    main()
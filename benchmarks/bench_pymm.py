@@ -0,0 +1,228 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Benchmarks of the PyMM package against the fake ModemManager service running on a private bus.
+   Every iteration of a benchmark sweeps over all the fake modems, so the reported p50/p99 latency
+   and the throughput are those of a whole sweep for increasing numbers of modems. This makes the
+   performance regressions visible without any modem hardware.
+
+   Usage: python benchmarks/bench_pymm.py [--sizes 1 10 100 500] [--latency 0.001]'''
+
+import argparse
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from PyMM import ModemManager, PropertyMode
+from PyMM.fake_modem_manager import FakeModemManagerProcess, PrivateBus
+from PyMM.modem import ModemState
+from PyMM.properties import PropertiesInterfaceName
+from PyMM.signatures import call_method
+
+ModemInterfaceName = 'org.freedesktop.ModemManager1.Modem'
+InventoryProperties = ('Manufacturer', 'Model', 'Revision', 'EquipmentIdentifier', 'Drivers',
+                       'State', 'SignalQuality', 'AccessTechnologies')
+
+
+class BenchmarkResult:
+
+    def __init__(self, name, modems, latencies, elapsed):
+        self.name = name
+        self.modems = modems
+        self.latencies = sorted(latencies)
+        self.elapsed = elapsed
+
+    def percentile(self, percentile):
+        rank = max(math.ceil(len(self.latencies) * percentile / 100) - 1, 0)
+        return self.latencies[rank]
+
+    def __str__(self):
+        return (f'{self.name:<40} {self.modems:>6} {len(self.latencies):>10} '
+                f'{self.percentile(50) * 1000:>15.3f} {self.percentile(99) * 1000:>15.3f} '
+                f'{len(self.latencies) / self.elapsed:>12.1f}')
+
+
+def measure(name, modems, operation, iterations, setup=None, teardown=None):
+    '''Times `iterations` invocations of `operation`, calling `setup` (untimed) before each and
+       `teardown` (untimed) with the return value of each.'''
+
+    latencies = []
+    elapsed = 0
+    for _ in range(iterations):
+        argument = setup() if setup else None
+
+        started_at = time.perf_counter()
+        result = operation(argument) if setup else operation()
+        latency = time.perf_counter() - started_at
+
+        if teardown:
+            teardown(result)
+
+        latencies.append(latency)
+        elapsed += latency
+
+    return BenchmarkResult(name, modems, latencies, elapsed)
+
+
+def close_modem_manager(mm):
+    '''Closes `mm` together with the connection which was injected into it.'''
+
+    bus = mm.bus
+    mm.close()
+    bus.close()
+
+
+def bench_enumeration(private_bus, size, iterations):
+
+    def enumerate_modems(bus):
+        mm = ModemManager(bus=bus)
+        mm.managed_modems
+        return mm
+
+    yield measure('enumeration (ModemManager + managed_modems)', size, enumerate_modems, iterations,
+                  setup=private_bus.connect, teardown=close_modem_manager)
+
+
+def bench_property_reads(private_bus, size, iterations):
+    for property_mode in PropertyMode:
+        mm = ModemManager(property_mode=property_mode, bus=private_bus.connect())
+        try:
+            modems = list(mm.managed_modems.values())
+
+            def read_inventory():
+                for modem in modems:
+                    modem.Manufacturer, modem.Model, modem.Drivers, modem.State, modem.SignalQuality
+
+            yield measure(f'inventory of all modems ({property_mode.name})', size, read_inventory,
+                          iterations)
+        finally:
+            close_modem_manager(mm)
+
+
+def bench_get_vs_get_all(private_bus, size, iterations):
+    bus = private_bus.connect()
+    mm = ModemManager(bus=bus)
+    proxies = [
+        bus.get_object('org.freedesktop.ModemManager1', path, introspect=False)
+        for path in mm.managed_modems
+    ]
+    mm.close()
+
+    def get_each():
+        for proxy in proxies:
+            for property_name in InventoryProperties:
+                call_method(proxy, PropertiesInterfaceName, 'Get', ModemInterfaceName,
+                            property_name)
+
+    def get_all():
+        for proxy in proxies:
+            call_method(proxy, PropertiesInterfaceName, 'GetAll', ModemInterfaceName)
+
+    try:
+        yield measure(f'{len(InventoryProperties)} x Get per modem', size, get_each, iterations)
+        yield measure('1 x GetAll per modem', size, get_all, iterations)
+    finally:
+        bus.close()
+
+
+def bench_proxy_creation(private_bus, size, iterations):
+    mm = ModemManager(bus=private_bus.connect())
+    paths = list(mm.managed_modems)
+    close_modem_manager(mm)
+
+    def create_and_call(bus, introspect):
+        for path in paths:
+            proxy = bus.get_object('org.freedesktop.ModemManager1', path, introspect=introspect)
+            if introspect:
+                proxy.Get(ModemInterfaceName, 'State', dbus_interface=PropertiesInterfaceName)
+            else:
+                call_method(proxy, PropertiesInterfaceName, 'Get', ModemInterfaceName, 'State')
+        return bus
+
+    yield measure('proxy creation + first call (introspect)', size,
+                  lambda bus: create_and_call(bus, True), iterations, setup=private_bus.connect,
+                  teardown=lambda bus: bus.close())
+    yield measure('proxy creation + first call (static)', size,
+                  lambda bus: create_and_call(bus, False), iterations, setup=private_bus.connect,
+                  teardown=lambda bus: bus.close())
+
+
+def bench_fleet(private_bus, size, iterations):
+    mm = ModemManager(bus=private_bus.connect())
+    try:
+        modems = list(mm.managed_modems.values())
+
+        def reset_all():
+            mm.for_each(modems, 'Reset')
+            return modems
+
+        def enable_sequentially(modems):
+            for modem in modems:
+                modem.Enable()
+
+        yield measure('fleet Enable (sequential)', size, enable_sequentially, iterations,
+                      setup=reset_all)
+        yield measure('fleet Enable (for_each)', size, lambda modems: mm.for_each(modems, 'Enable'),
+                      iterations, setup=reset_all)
+
+        def enable_all():
+            reset_all()
+            mm.for_each(modems, 'Enable')
+            for modem in modems:
+                modem.wait_for_state([ModemState.MM_MODEM_STATE_REGISTERED], timeout=30)
+            return modems
+
+        def connect_all(modems):
+            mm.for_each(
+                modems,
+                lambda modem, **kwargs: modem.simple_interface.Connect({'apn': 'fake'}, **kwargs))
+
+        yield measure('fleet Simple.Connect (for_each)', size, connect_all, iterations,
+                      setup=enable_all)
+    finally:
+        close_modem_manager(mm)
+
+
+Benchmarks = [
+    bench_enumeration, bench_property_reads, bench_get_vs_get_all, bench_proxy_creation, bench_fleet
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PyMM benchmarks')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100, 500],
+                        help='Numbers of fake modems to benchmark with')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='Latency (in seconds) which the fake service adds to every reply')
+    parser.add_argument('--iterations', type=int, default=10, help='Iterations per benchmark')
+    args = parser.parse_args()
+
+    print(f'{"benchmark":<40} {"modems":>6} {"iterations":>10} {"p50 sweep (ms)":>15} '
+          f'{"p99 sweep (ms)":>15} {"sweeps/sec":>12}')
+
+    for size in args.sizes:
+        with PrivateBus() as private_bus, FakeModemManagerProcess(private_bus.address, size,
+                                                                  args.latency):
+            for benchmark in Benchmarks:
+                for result in benchmark(private_bus, size, args.iterations):
+                    print(result, flush=True)
+
+
+if __name__ == '__main__':
+    main()
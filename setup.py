@@ -35,6 +35,9 @@ setup(
     long_description=read('README.md'),
     license=read('LICENSE'),
     packages=['PyMM'],
+    extras_require={
+        'asyncio': ['dbus-next'],
+    },
     entry_points={
         'console_scripts': ['PyMMUI=PyMMUI:application_main'],
     },
@@ -0,0 +1,65 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Tests of the marshalling of the arguments by the asyncio front end'''
+
+import pytest
+
+pytest.importorskip('dbus_next')
+
+from dbus_next import Variant
+from PyMM.aio import _marshal, _unmarshal
+
+MessagingInterfaceName = 'org.freedesktop.ModemManager1.Modem.Messaging'
+
+
+def test_dictionary_values_are_typed_from_the_signature_tables():
+    props, = _marshal(MessagingInterfaceName, 'Create', 'a{sv}', [{
+        'number': '+15550000000',
+        'text': 'Hello',
+        'validity': 5,
+        'delivery-report-request': True,
+    }])
+
+    assert props['number'] == Variant('s', '+15550000000')
+    assert props['text'] == Variant('s', 'Hello')
+    assert props['validity'] == Variant('u', 5)
+    assert props['delivery-report-request'] == Variant('b', True)
+
+
+def test_explicit_variants_are_kept():
+    props, = _marshal(MessagingInterfaceName, 'Create', 'a{sv}', [{'class': Variant('i', -1)}])
+    assert props['class'] == Variant('i', -1)
+
+
+def test_integers_without_a_known_signature_are_rejected():
+    with pytest.raises(TypeError):
+        _marshal(MessagingInterfaceName, 'Create', 'a{sv}', [{'unknown': 1}])
+
+
+def test_property_set_is_typed_from_the_property_signature():
+    args = _marshal('org.freedesktop.DBus.Properties', 'Set', 'ssv',
+                    ['org.freedesktop.ModemManager1.Modem', 'PowerState', 3])
+    assert args == ['org.freedesktop.ModemManager1.Modem', 'PowerState', Variant('u', 3)]
+
+
+def test_other_arguments_are_passed_verbatim():
+    assert _marshal('org.freedesktop.ModemManager1.Modem', 'Command', 'su',
+                    ['ATI', 5]) == ['ATI', 5]
+
+
+def test_unmarshal_strips_the_variants():
+    assert _unmarshal({'a': Variant('as', ['x']), 'b': [Variant('u', 1)]}) == {'a': ['x'], 'b': [1]}
@@ -0,0 +1,129 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Tests of the typed decoding of the property values'''
+
+import pytest
+
+dbus = pytest.importorskip('dbus')
+
+from PyMM.decoding import (IpConfig, PropertyDecoder, SignalQuality, converter_for_signature,
+                           decode_interfaces, decode_managed_objects, decode_simple_status,
+                           to_native)
+from PyMM.enums import ModemAccessTechnology, ModemState
+
+ModemInterfaceName = 'org.freedesktop.ModemManager1.Modem'
+
+
+def test_modem_properties():
+    decoder = PropertyDecoder.for_interface(ModemInterfaceName)
+    assert decoder is PropertyDecoder.for_interface(ModemInterfaceName)
+
+    properties = decoder.decode_all(
+        dbus.Dictionary(
+            {
+                'State':
+                    dbus.Int32(8),
+                'AccessTechnologies':
+                    dbus.UInt32(ModemAccessTechnology.MM_MODEM_ACCESS_TECHNOLOGY_LTE
+                                | ModemAccessTechnology.MM_MODEM_ACCESS_TECHNOLOGY_HSPA),
+                'SignalQuality':
+                    dbus.Struct((dbus.UInt32(77), dbus.Boolean(True))),
+                'Bearers':
+                    dbus.Array([dbus.ObjectPath('/b/0')], signature='o'),
+                'Unknown':
+                    dbus.String('kept'),
+            }, signature='sv'))
+
+    assert properties['State'] is ModemState.MM_MODEM_STATE_REGISTERED
+    assert properties['AccessTechnologies'] == frozenset(
+        (ModemAccessTechnology.MM_MODEM_ACCESS_TECHNOLOGY_LTE,
+         ModemAccessTechnology.MM_MODEM_ACCESS_TECHNOLOGY_HSPA))
+    assert properties['SignalQuality'] == SignalQuality(77, True)
+    assert properties['Bearers'] == ['/b/0']
+    assert type(properties['Bearers'][0]) is str
+    assert type(properties['Unknown']) is str
+
+
+def test_bearer_ip_config():
+    decoder = PropertyDecoder.for_interface('org.freedesktop.ModemManager1.Bearer')
+    ip_config = decoder.decode(
+        'Ip4Config',
+        dbus.Dictionary(
+            {
+                'method': dbus.UInt32(2),
+                'address': dbus.String('10.0.0.2'),
+                'prefix': dbus.UInt32(30),
+                'dns1': dbus.String('8.8.8.8'),
+                'dns2': dbus.String('8.8.4.4'),
+            }, signature='sv'))
+
+    assert ip_config == IpConfig(2, '10.0.0.2', 30, None, ['8.8.8.8', '8.8.4.4'], None)
+
+
+@pytest.mark.parametrize('signature, value, expected', [
+    ('u', dbus.UInt32(5), 5),
+    ('ay', dbus.ByteArray(b'ab'), b'ab'),
+    ('a(su)', dbus.Array([dbus.Struct((dbus.String('21407'), dbus.UInt32(1)))]), [('21407', 1)]),
+    ('a{uv}', dbus.Dictionary({dbus.UInt32(4): dbus.String('x', variant_level=1)}), {
+                                   4: 'x'
+                               }),
+    ('(uv)', dbus.Struct((dbus.UInt32(1), dbus.UInt32(2, variant_level=1))), (1, 2)),
+])
+def test_converter_for_signature(signature, value, expected):
+    assert converter_for_signature(signature)(value) == expected
+
+
+def test_unsupported_signature():
+    with pytest.raises(ValueError):
+        converter_for_signature('h{')
+
+
+def test_to_native_of_nested_values():
+    value = dbus.Dictionary({'a': dbus.Array([dbus.Int32(1)], signature='i')}, signature='sv')
+    assert to_native(value) == {'a': [1]}
+
+
+def test_simple_status():
+    status = decode_simple_status(
+        dbus.Dictionary({
+            'state': dbus.UInt32(11),
+            'm3gpp-operator-code': dbus.String('21407'),
+        }, signature='sv'))
+
+    assert status.state is ModemState.MM_MODEM_STATE_CONNECTED
+    assert status.operator_code == '21407'
+    assert status.signal_quality is None
+
+
+def test_managed_objects_and_interfaces():
+    interfaces = dbus.Dictionary(
+        {ModemInterfaceName: dbus.Dictionary({'State': dbus.Int32(8)}, signature='sv')},
+        signature='sa{sv}')
+
+    assert decode_interfaces(interfaces) == {
+        ModemInterfaceName: {
+            'State': ModemState.MM_MODEM_STATE_REGISTERED
+        }
+    }
+    assert decode_managed_objects(dbus.Dictionary(
+        {dbus.ObjectPath('/m/0'): interfaces})) == {
+             '/m/0': {
+                 ModemInterfaceName: {
+                     'State': ModemState.MM_MODEM_STATE_REGISTERED
+                 }
+             }
+         }
@@ -0,0 +1,171 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Tests which run PyMM against the fake ModemManager service on a private bus'''
+
+import shutil
+
+import pytest
+
+pytest.importorskip('dbus')
+pytest.importorskip('gi')
+if shutil.which('dbus-daemon') is None:
+    pytest.skip('dbus-daemon is not installed', allow_module_level=True)
+
+from PyMM import ModemManager, PropertyMode
+from PyMM.bringup import ApnProfile, BringUp
+from PyMM.enums import ModemState, SmsState
+from PyMM.fake_modem_manager import FakeModemManagerProcess, PrivateBus
+from PyMM.mainloop import run_until
+from PyMM.messaging import MessageIntake, SendQueue
+from PyMM.proxy_pool import ProxyPool
+from PyMM.subscription import ChangeFilter
+
+Modems = 3
+
+ModemInterfaceName = 'org.freedesktop.ModemManager1.Modem'
+
+
+@pytest.fixture
+def modem_manager():
+    with PrivateBus() as private_bus, FakeModemManagerProcess(private_bus.address, Modems):
+        bus = private_bus.connect()
+        mm = ModemManager(PropertyMode.CACHED, bus=bus)
+        try:
+            yield mm
+        finally:
+            mm.close()
+            bus.close()
+
+
+def registered_modem(mm):
+    modem = mm.modem_by_path(sorted(mm.managed_modems)[0])
+    modem.Enable(True)
+    modem.wait_for_state(ModemState.MM_MODEM_STATE_REGISTERED, 10)
+    return modem
+
+
+def test_enumeration(modem_manager):
+    modems = modem_manager.managed_modems
+    assert len(modems) == Modems
+
+    for path, modem in modems.items():
+        assert modem.path == path
+        assert modem_manager.modem_by_equipment_identifier(modem.EquipmentIdentifier) is modem
+
+
+def test_proxy_pool_reuses_the_wrappers(modem_manager):
+    pool = ProxyPool.for_bus(modem_manager.bus)
+    modem = next(iter(modem_manager.managed_modems.values()))
+
+    sim = modem.Sim
+    assert modem.Sim is sim
+    assert modem.sim_by_path(sim.path) is sim
+    assert pool.get_object(modem.path) is pool.get_object(modem.path)
+    assert sim.OperatorIdentifier == '21407'
+
+    # The SIM is owned by the modem, so it is discarded together with it
+    pool.discard(modem.path)
+    assert pool.get_wrapper(type(sim), sim.path, property_mode=PropertyMode.CACHED) is not sim
+
+
+def test_subscription_coalesces_the_changes(modem_manager):
+    changes = []
+    subscription = modem_manager.subscribe(
+        ChangeFilter(interfaces=[ModemInterfaceName], properties=['State']), changes.append, 200)
+
+    modem = registered_modem(modem_manager)
+
+    def registered():
+        states = [change[modem.path][ModemInterfaceName]['State'] for change in changes]
+        return ModemState.MM_MODEM_STATE_REGISTERED in states
+
+    assert run_until(registered, 10)
+
+    # Enabling goes through several states, which arrive together
+    assert subscription.deliveries < subscription.signals
+    for change in changes:
+        assert set(change) == {modem.path}
+        assert set(change[modem.path][ModemInterfaceName]) == {'State'}
+
+    subscription.cancel()
+
+
+def test_bring_up(modem_manager):
+    results = BringUp(modem_manager.managed_modems.values(), default_profile=ApnProfile('internet'),
+                      pins={
+                          '*': '1234'
+                      }, concurrency=2).run(30)
+
+    assert len(results) == Modems
+    for path, result in results.items():
+        assert result.ok, result
+        assert result.bearer_path is not None
+        assert modem_manager.modem_by_path(path).wait_for_state(
+            ModemState.MM_MODEM_STATE_CONNECTED, 10) == ModemState.MM_MODEM_STATE_CONNECTED
+
+
+def test_message_intake(modem_manager):
+    intake = MessageIntake(delete_received=True)
+    intake.attach(modem_manager)
+    modem = registered_modem(modem_manager)
+    own_number = str(modem.get_property('OwnNumbers')[0])
+
+    queue = SendQueue()
+    request = queue.send(modem, own_number, 'Hello')
+    assert queue.wait(10)
+    assert request.ok, request
+
+    # The fake receives the messages sent to its own number back
+    message = next(intake.messages(timeout=10))
+    assert (message.modem_path, message.number, message.text) == (modem.path, own_number, 'Hello')
+    assert message.state == SmsState.MM_SMS_STATE_RECEIVED
+
+    # Only the sent message is left once the received one has been deleted
+    messaging = modem.messaging_interface
+    assert run_until(lambda: [sms.path for sms in messaging.Messages] == [request.sms_path], 10)
+
+    intake.close()
+
+
+def test_message_intake_of_existing_messages(modem_manager):
+    modem = registered_modem(modem_manager)
+    own_number = str(modem.get_property('OwnNumbers')[0])
+
+    queue = SendQueue()
+    queue.send(modem, own_number, 'Before')
+    assert queue.wait(10)
+    messaging = modem.messaging_interface
+    assert run_until(lambda: len(messaging.Messages) == 2, 10)
+
+    # The sent message is among the existing ones, but only the received one is streamed
+    intake = MessageIntake()
+    intake.attach(modem_manager, existing=True)
+    messages = list(intake.messages(timeout=1))
+    assert [message.text for message in messages] == ['Before']
+
+    intake.close()
+
+
+def test_send_to_an_unregistered_modem_fails(modem_manager):
+    modem = next(iter(modem_manager.managed_modems.values()))
+
+    queue = SendQueue()
+    request = queue.send(modem, '+15550000000', 'Hello')
+    assert queue.wait(10)
+    assert not request.ok
+    assert 'WrongState' in request.error.get_dbus_name()
+    assert queue.pending == 0
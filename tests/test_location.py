@@ -0,0 +1,83 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Tests of the NMEA parsing of the location module'''
+
+import math
+
+from PyMM.location import Fix, NmeaParser
+
+Gga = '$GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47'
+Rmc = '$GPRMC,123519,A,4807.038,N,01131.000,E,022.4,084.4,230394,003.1,W*6A'
+
+
+def test_gga_and_rmc_of_the_same_epoch_are_combined():
+    parser = NmeaParser()
+    assert parser.feed(Gga + '\n' + Rmc + '\n')
+
+    fix = parser.fix('/modem', 1.0)
+    assert math.isclose(fix.latitude, 48 + 7.038 / 60)
+    assert math.isclose(fix.longitude, 11 + 31.0 / 60)
+    assert fix.altitude == 545.4
+    assert fix.satellites == 8
+    assert fix.hdop == 0.9
+    assert math.isclose(fix.speed, 22.4 * 1852 / 3600)
+    assert fix.course == 84.4
+    # 23 March 1994 12:35:19 UTC
+    assert fix.fix_time == 764426119
+
+
+def test_repeated_sentences_are_skipped():
+    parser = NmeaParser()
+    assert parser.feed(Gga + '\n')
+    assert not parser.feed(Gga + '\n')
+    assert parser.parsed == 1
+    assert parser.skipped == 1
+
+
+def test_sentences_split_across_chunks():
+    parser = NmeaParser()
+    assert not parser.feed(Gga[:20])
+    assert parser.feed(Gga[20:] + '\n')
+    assert parser.fix('/modem', 1.0) is not None
+
+
+def test_bad_checksum_is_rejected():
+    parser = NmeaParser()
+    assert not parser.feed(Gga[:-2] + '00\n')
+    assert parser.invalid == 1
+    assert parser.fix('/modem', 1.0) is None
+
+
+def test_southern_and_western_hemispheres_are_negative():
+    parser = NmeaParser()
+    parser.feed('$GPGGA,123519,3351.000,S,15112.000,W,1,05,1.2,10.0,M,0.0,M,,\n')
+
+    fix = parser.fix('/modem', 1.0)
+    assert math.isclose(fix.latitude, -(33 + 51 / 60))
+    assert math.isclose(fix.longitude, -(151 + 12 / 60))
+
+
+def test_no_fix_without_position():
+    parser = NmeaParser()
+    parser.feed('$GPGGA,123519,,,,,0,00,,,M,,M,,\n')
+    assert parser.fix('/modem', 1.0) is None
+
+
+def test_fix_from_gps_raw():
+    fix = Fix.from_gps_raw('/modem', 1.0, {'latitude': 48.1, 'longitude': 11.5, 'altitude': 500})
+    assert (fix.latitude, fix.longitude, fix.altitude) == (48.1, 11.5, 500.0)
+    assert Fix.from_gps_raw('/modem', 1.0, {'utc-time': '123519'}) is None
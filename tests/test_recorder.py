@@ -0,0 +1,116 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Tests of the log encoding of the recorder module'''
+
+import pytest
+
+dbus = pytest.importorskip('dbus')
+
+from PyMM.recorder import (CallRecord, LogWriter, SignalRecord, _key, decode_value, encode_value,
+                           read_log)
+
+
+def roundtrip(value):
+    out = bytearray()
+    encode_value(out, value)
+    decoded, offset = decode_value(out)
+    assert offset == len(out)
+    return decoded
+
+
+@pytest.mark.parametrize('value', [
+    dbus.Byte(255),
+    dbus.Int16(-32768),
+    dbus.UInt16(65535),
+    dbus.Int32(-1),
+    dbus.UInt32(4294967295),
+    dbus.Int64(-(1 << 63)),
+    dbus.UInt64((1 << 64) - 1),
+    dbus.Double(-0.5),
+    dbus.Boolean(True),
+    dbus.String('Fake Operator'),
+    dbus.ObjectPath('/org/freedesktop/ModemManager1/Modem/0'),
+    dbus.Signature('a{sv}'),
+    dbus.ByteArray(b'\x00\xff'),
+])
+def test_basic_values_keep_their_type(value):
+    decoded = roundtrip(value)
+    assert type(decoded) is type(value)
+    assert decoded == value
+
+
+def test_containers_keep_their_signature_and_variant_level():
+    value = dbus.Dictionary(
+        {
+            'rx-bytes': dbus.UInt64(1 << 40, variant_level=1),
+            'ip': dbus.Struct((dbus.String('10.0.0.2'), dbus.UInt32(30)), variant_level=1),
+            'bearers': dbus.Array([dbus.ObjectPath('/b/0')], signature='o', variant_level=1),
+        }, signature='sv')
+
+    decoded = roundtrip(value)
+    assert decoded.signature == 'sv'
+    assert decoded == value
+    assert decoded['rx-bytes'].variant_level == 1
+    assert type(decoded['rx-bytes']) is dbus.UInt64
+    assert decoded['bearers'].signature == 'o'
+    assert tuple(decoded['ip']) == ('10.0.0.2', 30)
+
+
+def test_unknown_values_are_rejected():
+    with pytest.raises(TypeError):
+        encode_value(bytearray(), object())
+
+
+def test_log_roundtrip(tmp_path):
+    path = str(tmp_path / 'log')
+    writer = LogWriter(path)
+    writer.write(CallRecord, writer._started_at + 1.5, '/m/0',
+                 'org.freedesktop.ModemManager1.Modem', 'Enable', [dbus.Boolean(True)], None, '',
+                 '', 0.25)
+    writer.write(SignalRecord, writer._started_at + 2.0, '/m/0',
+                 'org.freedesktop.ModemManager1.Modem', 'StateChanged',
+                 [dbus.Int32(6), dbus.Int32(8), dbus.UInt32(0)])
+    # A frame which was cut off by a recorder which did not close the log is ignored
+    writer.write(SignalRecord, writer._started_at + 3.0, '/m/0', 'x', 'y', [])
+    writer.close()
+    with open(path, 'r+b') as log:
+        log.truncate(log.seek(0, 2) - 1)
+
+    call, signal = list(read_log(path))
+    assert call.kind == CallRecord
+    assert (call.timestamp, call.member, call.args, call.elapsed) == (1.5, 'Enable', (True, ), 0.25)
+    assert signal.kind == SignalRecord
+    assert (signal.timestamp, signal.member, signal.args) == (2.0, 'StateChanged', (6, 8, 0))
+
+
+def test_log_of_another_format_is_rejected(tmp_path):
+    path = tmp_path / 'log'
+    path.write_bytes(b'x' * 64)
+    with pytest.raises(ValueError):
+        LogWriter(str(path))
+
+
+def test_key_ignores_the_dbus_types():
+    assert _key('/m/0', 'i', 'Command',
+                [dbus.String('ATI'), dbus.UInt32(5)]) == _key('/m/0', 'i', 'Command', ['ATI', 5])
+    assert _key('/m/0', 'i', 'Create', [dbus.Dictionary({
+        'b': 1,
+        'a': 2
+    })]) == _key('/m/0', 'i', 'Create', [{
+        'a': 2,
+        'b': 1
+    }])
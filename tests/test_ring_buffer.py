@@ -0,0 +1,70 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Tests of ColumnarRingBuffer and aggregate'''
+
+import math
+
+from PyMM.ring_buffer import ColumnarRingBuffer, aggregate
+
+
+def test_rows_are_returned_in_order():
+    buffer = ColumnarRingBuffer(4, [('value', 'd')])
+    for timestamp in range(3):
+        buffer.append(timestamp, timestamp * 10)
+
+    assert len(buffer) == 3
+    assert list(buffer.rows()) == [(0, 0), (1, 10), (2, 20)]
+    assert buffer.last() == (2, 20)
+
+
+def test_oldest_rows_are_overwritten_once_full():
+    buffer = ColumnarRingBuffer(3, [('value', 'd')])
+    for timestamp in range(5):
+        buffer.append(timestamp, timestamp)
+
+    assert len(buffer) == 3
+    assert list(buffer.column('timestamp')) == [2, 3, 4]
+    assert buffer.nbytes == 2 * 3 * 8
+
+
+def test_time_window():
+    buffer = ColumnarRingBuffer(5, [('value', 'i')])
+    for timestamp in range(8):
+        buffer.append(timestamp, timestamp)
+
+    assert list(buffer.column('value', since=4, until=6)) == [4, 5]
+    assert list(buffer.column('value', since=6)) == [6, 7]
+    assert list(buffer.column('value', until=4)) == [3]
+
+
+def test_empty_buffer():
+    buffer = ColumnarRingBuffer(2, [('value', 'd')])
+    assert buffer.last() is None
+    assert list(buffer.rows()) == []
+
+
+def test_aggregate_ignores_nan():
+    buffer = ColumnarRingBuffer(8, [('value', 'd')])
+    for timestamp, value in enumerate([1.0, math.nan, 2.0, 3.0, 4.0]):
+        buffer.append(timestamp, value)
+
+    result = aggregate(buffer.column('value'))
+    assert result['count'] == 4
+    assert result['min'] == 1.0
+    assert result['max'] == 4.0
+    assert result['mean'] == 2.5
+    assert result['p50'] == 2.5
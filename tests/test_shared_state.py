@@ -0,0 +1,111 @@
+# Copyright 2022 Kaloian Manassiev
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge, publish, distribute,
+# sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or
+# substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+# NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+# DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+'''Tests of the shared state file, which do not need a bus'''
+
+import pytest
+
+from PyMM.shared_state import ModemRecord, SharedStateReader, SharedStateWriter
+
+
+@pytest.fixture
+def writer(tmp_path):
+    writer = SharedStateWriter(str(tmp_path / 'state'), capacity=4)
+    yield writer
+    writer.close()
+
+
+def test_roundtrip(writer):
+    writer.write(
+        2,
+        ModemRecord('/org/freedesktop/ModemManager1/Modem/7', '350000000000007', 'PyMM',
+                    'Fake Modem', 'Fake Operator', state=11, access_technologies=16384,
+                    signal_quality=77, signal_quality_recent=True, connected=True, rx_bytes=1 << 40,
+                    tx_bytes=5, updated_at=123.5))
+
+    reader = SharedStateReader(writer.path)
+    try:
+        assert reader.capacity == 4
+        assert reader.generation == 1
+        assert reader.read(0) is None
+
+        record = reader.read(2)
+        assert record.path == '/org/freedesktop/ModemManager1/Modem/7'
+        assert record.equipment_identifier == '350000000000007'
+        assert record.operator_name == 'Fake Operator'
+        assert (record.state, record.access_technologies) == (11, 16384)
+        assert (record.signal_quality, record.signal_quality_recent) == (77, True)
+        assert record.connected
+        assert (record.rx_bytes, record.tx_bytes) == (1 << 40, 5)
+        assert record.updated_at == 123.5
+
+        assert reader.record('/org/freedesktop/ModemManager1/Modem/7') is not None
+        writer.clear(2)
+        assert reader.records() == []
+        assert reader.generation == 2
+    finally:
+        reader.close()
+
+
+def test_long_strings_are_truncated(writer):
+    writer.write(0, ModemRecord('/modem', model='x' * 100))
+
+    reader = SharedStateReader(writer.path)
+    try:
+        assert reader.read(0).model == 'x' * 32
+    finally:
+        reader.close()
+
+
+def test_read_of_a_record_left_mid_update_times_out(writer):
+    writer.write(0, ModemRecord('/modem'))
+
+    def die_mid_update(offset):
+        raise RuntimeError('Writer died')
+
+    # Leaves the sequence of the record odd, as a writer which died during the update would
+    with pytest.raises(RuntimeError):
+        writer._update(0, die_mid_update)
+
+    reader = SharedStateReader(writer.path)
+    try:
+        with pytest.raises(TimeoutError):
+            reader.read(0, timeout=0.01)
+    finally:
+        reader.close()
+
+
+def test_reopen_if_replaced(tmp_path):
+    path = str(tmp_path / 'state')
+    first = SharedStateWriter(path, capacity=1)
+    reader = SharedStateReader(path)
+    try:
+        assert not reader.reopen_if_replaced()
+
+        first.close(unlink=False)
+        second = SharedStateWriter(path, capacity=2)
+        try:
+            assert reader.reopen_if_replaced()
+            assert reader.capacity == 2
+        finally:
+            second.close()
+    finally:
+        reader.close()
+
+
+def test_write_outside_of_the_capacity(writer):
+    with pytest.raises(IndexError):
+        writer.write(4, ModemRecord('/modem'))